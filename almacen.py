@@ -0,0 +1,385 @@
+"""Almacén columnar de temporadas (Parquet / Arrow).
+
+Cada archivo validado se guarda una sola vez como Parquet, con los nombres,
+competiciones y rivales codificados como diccionario (categóricos) y los
+enteros reducidos al tipo más pequeño que los contiene (motor.compactar). Las cargas
+posteriores del mismo contenido se leen con memory-map en lugar de volver a
+parsear el CSV.
+
+Cada parte es un directorio particionado por temporada y competición
+(`TEMPORADA=2024-25/COMPETICION=Liga/...`), así que una lectura de algunas
+temporadas o competiciones solo abre sus archivos. Las jornadas añadidas se
+guardan como partes que apuntan a su temporada base, de modo que añadir filas
+no reescribe la temporada completa.
+
+El almacén tiene un tamaño máximo y una caducidad (APP_ESTADISTICAS_ALMACEN_MAX_MB
+y APP_ESTADISTICAS_ALMACEN_TTL_DIAS): al guardar se borran las temporadas
+caducadas y, si no cabe todo, las usadas hace más tiempo.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from motor import COLUMNAS_CATEGORICAS, COLUMNAS_ENTERAS, COLUMNAS_PARTICION, compactar, temporadas_de
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow viene con streamlit, pero el almacén es opcional
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO_ALMACEN = os.environ.get("APP_ESTADISTICAS_ALMACEN", ".almacen")
+# Retención (0 = sin límite): tras cada guardado se borran las temporadas sin
+# usar en más de TTL_ALMACEN segundos y, si el almacén ocupa más de
+# MAX_BYTES_ALMACEN, las usadas hace más tiempo (LRU). El último uso de una
+# temporada es la fecha de modificación de sus metadatos, que `cargar` actualiza.
+MAX_BYTES_ALMACEN = int(float(os.environ.get("APP_ESTADISTICAS_ALMACEN_MAX_MB", "2048")) * 1024 * 1024)
+TTL_ALMACEN = float(os.environ.get("APP_ESTADISTICAS_ALMACEN_TTL_DIAS", "90")) * 24 * 60 * 60
+
+
+def disponible():
+    return pq is not None
+
+
+def ruta_temporada(huella, directorio=None):
+    return os.path.join(directorio or DIRECTORIO_ALMACEN, f"{huella}.parquet")
+
+
+def ruta_metadatos(huella, directorio=None):
+    return os.path.join(directorio or DIRECTORIO_ALMACEN, f"{huella}.json")
+
+
+def _escribir_atomico(ruta, escribir, es_directorio=False):
+    # Se escribe en un temporal (archivo o directorio) del mismo directorio y se renombra
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    if es_directorio:
+        temporal = tempfile.mkdtemp(dir=os.path.dirname(ruta), suffix=".tmp")
+    else:
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+        os.close(descriptor)
+    try:
+        escribir(temporal)
+        os.replace(temporal, ruta)
+    except OSError:
+        if os.path.isdir(temporal):
+            shutil.rmtree(temporal, ignore_errors=True)
+        elif os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def guardar(huella, df, directorio=None, nombre=None, base=None):
+    # Guarda una parte de temporada. Si se indica `base`, la parte solo contiene
+    # las filas añadidas y la temporada completa es la cadena base + parte.
+    if not disponible():
+        return None
+    ruta = ruta_temporada(huella, directorio)
+    tabla = tabla_de(df)
+    try:
+        _escribir_atomico(ruta, lambda destino: escribir_tabla(tabla, destino), es_directorio=True)
+        _guardar_metadatos(huella, directorio, nombre, base, len(df), list(df.columns))
+    except OSError:
+        logger.warning("No se pudo guardar la temporada %s en el almacén", huella[:12], exc_info=True)
+        return None
+    purgar(directorio, conservar=cadena(huella, directorio) or [huella])
+    return ruta
+
+
+def tabla_de(df):
+    # Las particiones usan el MES_INICIO_TEMPORADA vigente al guardar; el
+    # modelo vuelve a calcular la temporada a partir de FECHA al cargar
+    return pa.Table.from_pandas(df.assign(TEMPORADA=temporadas_de(df["FECHA"])), preserve_index=False)
+
+
+def escribir_tabla(tabla, destino, plantilla=None):
+    # Añade la tabla al directorio particionado `destino` (`plantilla`: nombre
+    # de sus archivos, para no pisar los de otros bloques)
+    pq.write_to_dataset(
+        tabla, destino, partition_cols=COLUMNAS_PARTICION, use_dictionary=COLUMNAS_CATEGORICAS,
+        basename_template=plantilla,
+    )
+
+
+def _guardar_metadatos(huella, directorio, nombre, base, filas, columnas):
+    datos = {
+        "huella": huella,
+        "nombre": nombre or huella[:12],
+        "base": base,
+        "filas": filas,
+        "columnas": columnas,
+        "creado": time.time(),
+    }
+
+    def escribir_metadatos(destino):
+        with open(destino, "w", encoding="utf-8") as f:
+            json.dump(datos, f)
+
+    _escribir_atomico(ruta_metadatos(huella, directorio), escribir_metadatos)
+
+
+class Escritura:
+    """Temporada que se guarda bloque a bloque (ingesta por bloques).
+
+    Los bloques se escriben en un directorio temporal que se publica al salir
+    del `with` sin errores; si hay un error (filas no válidas, cancelación)
+    se borra. Todos los bloques se escriben con el esquema del primero, con
+    diccionarios e enteros de ancho fijo para que los archivos sean compatibles.
+    """
+
+    def __init__(self, huella, directorio=None, nombre=None):
+        self.huella = huella
+        self.directorio = directorio
+        self.nombre = nombre
+        self.filas = 0
+        self.columnas = None
+        self._esquema = None
+        self._temporal = None
+
+    def __enter__(self):
+        if disponible():
+            try:
+                os.makedirs(self.directorio or DIRECTORIO_ALMACEN, exist_ok=True)
+                self._temporal = tempfile.mkdtemp(dir=self.directorio or DIRECTORIO_ALMACEN, suffix=".tmp")
+            except OSError:
+                logger.warning("No se pudo guardar la temporada %s en el almacén", self.huella[:12], exc_info=True)
+        return self
+
+    def anadir(self, df):
+        if self._temporal is None:
+            return
+        tabla = tabla_de(df)
+        if self._esquema is None:
+            self._esquema = pa.schema([esquema_fijo(campo) for campo in tabla.schema])
+            self.columnas = list(df.columns)
+        try:
+            escribir_tabla(tabla.cast(self._esquema), self._temporal, f"bloque-{self.filas}-{{i}}.parquet")
+        except (OSError, pa.ArrowException):
+            logger.warning("No se pudo guardar la temporada %s en el almacén", self.huella[:12], exc_info=True)
+            self._descartar()
+            return
+        self.filas += len(df)
+
+    def __exit__(self, tipo, error, traza):
+        if self._temporal is None:
+            return False
+        if tipo is not None or not self.filas:
+            self._descartar()
+            return False
+        try:
+            os.replace(self._temporal, ruta_temporada(self.huella, self.directorio))
+            _guardar_metadatos(self.huella, self.directorio, self.nombre, None, self.filas, self.columnas)
+        except OSError:
+            logger.warning("No se pudo guardar la temporada %s en el almacén", self.huella[:12], exc_info=True)
+            self._descartar()
+            return False
+        purgar(self.directorio, conservar=[self.huella])
+        return False
+
+    def _descartar(self):
+        shutil.rmtree(self._temporal, ignore_errors=True)
+        self._temporal = None
+
+
+def esquema_fijo(campo):
+    # Tipo de una columna igual para todos los bloques (cada bloque compacta sus
+    # categóricos y enteros según sus propios valores)
+    if pa.types.is_dictionary(campo.type) or pa.types.is_string(campo.type) or pa.types.is_large_string(campo.type):
+        return campo.with_type(pa.dictionary(pa.int32(), pa.string()))
+    if campo.name in COLUMNAS_ENTERAS:
+        return campo.with_type(pa.int32())
+    if campo.name == "NOTA":
+        return campo.with_type(pa.float32())
+    return campo
+
+
+def metadatos(huella, directorio=None):
+    try:
+        with open(ruta_metadatos(huella, directorio), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"huella": huella, "nombre": huella[:12], "base": None}
+
+
+def existe(huella, directorio=None):
+    return disponible() and os.path.exists(ruta_temporada(huella, directorio))
+
+
+def cadena(huella, directorio=None):
+    # Partes que forman la temporada, de la más antigua a la más reciente
+    partes = []
+    while huella is not None:
+        if huella in partes or not existe(huella, directorio):
+            return None
+        partes.append(huella)
+        huella = metadatos(huella, directorio).get("base")
+    return partes[::-1]
+
+
+def leer_parte(ruta, temporadas=None, competiciones=None):
+    # Tabla Arrow de una parte con solo las particiones pedidas (None = todas)
+    filtros = [
+        (columna, "in", list(valores))
+        for columna, valores in zip(COLUMNAS_PARTICION, (temporadas, competiciones)) if valores is not None
+    ]
+    if os.path.isdir(ruta):
+        return pq.read_table(ruta, filters=filtros or None, memory_map=True).drop_columns(["TEMPORADA"])
+    # Partes guardadas antes de particionar el almacén: un solo archivo, filtrado después
+    tabla = pq.read_table(ruta, memory_map=True)
+    if filtros:
+        claves = tabla.select(["FECHA", "COMPETICION"]).to_pandas()
+        mascara = claves["COMPETICION"].isin(competiciones) if competiciones is not None else True
+        if temporadas is not None:
+            mascara = mascara & temporadas_de(claves["FECHA"]).isin(temporadas)
+        tabla = tabla.filter(pa.array(np.broadcast_to(mascara, len(claves))))
+    return tabla
+
+
+def cargar(huella, directorio=None, temporadas=None, competiciones=None):
+    # Devuelve el DataFrame guardado (o solo sus particiones de `temporadas` y
+    # `competiciones`) o None si la temporada no está en el almacén
+    partes = cadena(huella, directorio) if disponible() else None
+    if not partes:
+        return None
+    try:
+        tablas = [leer_parte(ruta_temporada(parte, directorio), temporadas, competiciones) for parte in partes]
+    except (OSError, pa.ArrowException):
+        logger.warning("Temporada %s ilegible en el almacén; se vuelve a procesar", huella[:12], exc_info=True)
+        return None
+    for parte in partes:
+        usar(parte, directorio)
+    # Las partes añadidas pueden tener enteros más anchos o diccionarios
+    # distintos: se promocionan al tipo común
+    tabla = tablas[0] if len(tablas) == 1 else pa.concat_tables(tablas, promote_options="permissive")
+    # En las partes particionadas la competición se lee de la ruta y queda al
+    # final: se reordena en la tabla Arrow, sin copiar columnas
+    columnas = metadatos(partes[0], directorio).get("columnas")
+    if columnas and set(columnas) == set(tabla.column_names):
+        tabla = tabla.select(columnas)
+    # split_blocks + self_destruct evitan consolidar bloques y permiten que las
+    # columnas numéricas sin nulos se compartan sin copia con el mapa de memoria
+    df = tabla.to_pandas(split_blocks=True, self_destruct=True)
+    # Solo las temporadas guardadas con versiones anteriores del esquema se
+    # vuelven a compactar (compactar copia todas las columnas)
+    if esquema_antiguo(df):
+        df = compactar(df)
+    # Con varias partes o varios bloques los diccionarios se unifican en orden
+    # de aparición: se reordenan como los de compactar
+    for columna in COLUMNAS_CATEGORICAS:
+        if columna in df.columns and not df[columna].cat.categories.is_monotonic_increasing:
+            df[columna] = df[columna].cat.set_categories(sorted(df[columna].cat.categories))
+    return df
+
+
+def esquema_antiguo(df):
+    # Columnas con un tipo distinto del que dejan compactar o Escritura
+    # (texto sin diccionario, enteros de 64 bits, notas en float64)
+    for columna in COLUMNAS_CATEGORICAS:
+        if columna in df.columns and not isinstance(df[columna].dtype, pd.CategoricalDtype):
+            return True
+    for columna in COLUMNAS_ENTERAS:
+        if columna in df.columns and df[columna].dtype.itemsize > 4:
+            return True
+    return "NOTA" in df.columns and df["NOTA"].dtype != np.float32
+
+
+def usar(huella, directorio=None):
+    # Marca la temporada como usada ahora (para la retención LRU)
+    try:
+        os.utime(ruta_metadatos(huella, directorio))
+    except OSError:
+        pass
+
+
+def _tamano(ruta):
+    if os.path.isdir(ruta):
+        return sum(
+            os.path.getsize(os.path.join(carpeta, archivo))
+            for carpeta, _subcarpetas, archivos in os.walk(ruta) for archivo in archivos
+        )
+    return os.path.getsize(ruta)
+
+
+def purgar(directorio=None, conservar=(), max_bytes=None, ttl=None):
+    # Aplica la retención (ver MAX_BYTES_ALMACEN y TTL_ALMACEN) y devuelve las
+    # huellas borradas. Las de `conservar` (la temporada recién guardada y sus
+    # partes base) no se borran. Al borrar una base, las partes añadidas sobre
+    # ella dejan de cargarse (cadena devuelve None) y se vuelven a procesar.
+    max_bytes = MAX_BYTES_ALMACEN if max_bytes is None else max_bytes
+    ttl = TTL_ALMACEN if ttl is None else ttl
+    if not disponible() or (not max_bytes and not ttl):
+        return []
+    carpeta = directorio or DIRECTORIO_ALMACEN
+    temporadas = []
+    total = 0
+    try:
+        for archivo in os.listdir(carpeta):
+            if not archivo.endswith(".json"):
+                continue
+            huella = archivo[:-len(".json")]
+            try:
+                uso = os.path.getmtime(ruta_metadatos(huella, directorio))
+                tamano = _tamano(ruta_temporada(huella, directorio)) if existe(huella, directorio) else 0
+            except OSError:
+                continue
+            total += tamano
+            temporadas.append((uso, huella, tamano))
+    except OSError:
+        return []
+
+    ahora = time.time()
+    borradas = []
+    for uso, huella, tamano in sorted(temporadas):
+        if huella in conservar:
+            continue
+        caducada = ttl and ahora - uso > ttl
+        if not caducada and (not max_bytes or total <= max_bytes):
+            continue
+        borrar(huella, directorio)
+        total -= tamano
+        borradas.append(huella)
+        logger.info(
+            "Almacén: borrada la temporada %s (%.1f MB, %s)",
+            huella[:12], tamano / 2**20, "caducada" if caducada else "por tamaño",
+        )
+    return borradas
+
+
+def borrar(huella, directorio=None):
+    # Primero los datos (existe() deja de verla) y después los metadatos
+    ruta = ruta_temporada(huella, directorio)
+    try:
+        if os.path.isdir(ruta):
+            shutil.rmtree(ruta)
+        elif os.path.exists(ruta):
+            os.remove(ruta)
+        os.remove(ruta_metadatos(huella, directorio))
+    except OSError:
+        logger.warning("No se pudo borrar la temporada %s del almacén", huella[:12], exc_info=True)
+
+
+def huella_anexo(huella_base, huella_filas):
+    # Identidad de la temporada resultante de añadir unas filas a otra
+    return hashlib.sha256(f"{huella_base}+{huella_filas}".encode()).hexdigest()
+
+
+def anexar(huella_base, huella_filas, df_nuevo, directorio=None, nombre=None):
+    # Solo se escriben las filas nuevas; la temporada base no se reescribe
+    huella = huella_anexo(huella_base, huella_filas)
+    if existe(huella, directorio):
+        return huella
+    if not existe(huella_base, directorio):
+        return None
+    if nombre is None:
+        nombre = f"{metadatos(huella_base, directorio)['nombre']} + {len(df_nuevo)} filas"
+    guardar(huella, df_nuevo, directorio, nombre=nombre, base=huella_base)
+    return huella
+
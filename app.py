@@ -1,10 +1,569 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
+
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
+
+import almacen
+import ingesta
+import metricas
+from graficos import METRICAS_RIVALES, figura_comparador, figura_equipo, figura_forma, figura_jugador, figura_rivales
+from motor import (
+    AGREGADOR_PANDAS, ALPHA, BETA, GAMMA, K, TOTAL_JORNADAS, VENTANA_FORMA, ArchivoInvalido, DatosInvalidos,
+    anexar_jornada, barrido_nota_ajustada, calcular_agregados, columnas_resumen, compactar, construir_cubo,
+    estabilidad_posiciones, fila_resumen, forma_reciente, matriz_rivales, rango_vuelta, series_comparador,
+    tabla_rivales, totales_de, totales_particiones, validar_datos,
+)
 
 
 st.set_page_config(layout="centered")
 
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Instrumentación
+# -------------------------------
+# Cada etapa (carga, validación, filtros, agregaciones de cada sección,
+# figuras y tablas) se mide con `medir` y se acumula por sesión y por proceso.
+#   APP_ESTADISTICAS_DEPURACION=1      panel con las métricas en la barra lateral
+#   APP_ESTADISTICAS_ASIGNACIONES=1    también memoria asignada (tracemalloc, más lento)
+#   APP_ESTADISTICAS_METRICAS_PUERTO   /metrics (Prometheus) y /metrics.json en localhost
+#   APP_ESTADISTICAS_METRICAS_ARCHIVO  archivo .prom o .json actualizado tras cada ejecución
+DEPURACION = os.environ.get("APP_ESTADISTICAS_DEPURACION") == "1"
+ASIGNACIONES = os.environ.get("APP_ESTADISTICAS_ASIGNACIONES") == "1"
+PUERTO_METRICAS = os.environ.get("APP_ESTADISTICAS_METRICAS_PUERTO")
+ARCHIVO_METRICAS = os.environ.get("APP_ESTADISTICAS_METRICAS_ARCHIVO")
+INTERVALO_ARCHIVO_METRICAS = 10  # Segundos como mínimo entre escrituras del archivo
+
+
+@st.cache_resource
+def registro_metricas():
+    if ASIGNACIONES and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    registro = metricas.RegistroMetricas()
+    if PUERTO_METRICAS:
+        metricas.servir(registro, int(PUERTO_METRICAS))
+    return registro
+
+
+@st.cache_resource
+def archivo_metricas():
+    return metricas.ArchivoMetricas(ARCHIVO_METRICAS, INTERVALO_ARCHIVO_METRICAS)
+
+
+def medir(nombre):
+    registro = registro_metricas()
+    return metricas.tramo(nombre, registro.proceso, registro.de_sesion(id_sesion()))
+
+
+inicio_ejecucion = time.perf_counter()
+
+# -------------------------------
+# Caché de ingestión
+# -------------------------------
+# Cada interacción con un widget vuelve a ejecutar el script completo. Para no
+# volver a parsear el CSV en cada rerun, el modelo ya validado, tipado y
+# enriquecido se guarda usando como clave el hash del contenido subido: en la
+# memoria de las sesiones (ContableMemoria) y en el almacén. Los datos no se
+# guardan con st.cache_data, que tendría sus propias copias fuera del
+# presupuesto de memoria; solo el barrido del ranking, pequeño.
+TTL_CACHE_DATOS = 60 * 60      # Segundos que una entrada permanece en caché
+MAX_ENTRADAS_CACHE = 16        # Máximo de datasets distintos en memoria
+
+
+class ContadoresCache:
+    """Contadores de aciertos y fallos de la caché de ingestión (compartidos por el proceso)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.consultas = 0
+        self.fallos = 0
+
+    def registrar_consulta(self):
+        with self._lock:
+            self.consultas += 1
+
+    def registrar_fallo(self):
+        with self._lock:
+            self.fallos += 1
+
+    def resumen(self):
+        with self._lock:
+            return {"consultas": self.consultas, "aciertos": self.consultas - self.fallos, "fallos": self.fallos}
+
+
+@st.cache_resource
+def contadores_cache():
+    return ContadoresCache()
+
+
+def cargar_temporada(huella):
+    # Temporada ya guardada (posiblemente con jornadas añadidas). Sin caché
+    # propia: el modelo pasa a la memoria de las sesiones (ContableMemoria),
+    # que lo comparte por huella, y volver a leerlo del almacén es un memory-map
+    contadores_cache().registrar_fallo()
+    with medir("carga_almacen"):
+        df = almacen.cargar(huella)
+    if df is None:
+        raise ArchivoInvalido("La temporada guardada ya no está disponible. Vuelve a subir el archivo.")
+    with medir("modelo"):
+        return construir_cubo(df)
+
+
+# -------------------------------
+# Ingesta en segundo plano
+# -------------------------------
+# Los archivos subidos se procesan en un hilo (ver ingesta.py) para que la
+# página siga respondiendo: se muestra el avance por etapas y, si la sesión ya
+# tenía un dataset, se siguen mostrando sus resultados hasta que el nuevo está
+# listo. El resultado de una tarea pasa a la memoria de las sesiones (ver
+# ContableMemoria), donde lo reutilizan las que suben el mismo archivo.
+INTERVALO_PROGRESO = 0.5  # Segundos entre actualizaciones de la barra de progreso
+
+
+@st.cache_resource
+def ingestas():
+    return ingesta.Ingestas(max_terminadas=MAX_ENTRADAS_CACHE, ttl=TTL_CACHE_DATOS)
+
+
+@st.fragment(run_every=INTERVALO_PROGRESO)
+def progreso_ingesta(tarea):
+    if tarea.terminada:
+        st.rerun()
+    st.progress(tarea.progreso, text=f"Procesando «{tarea.nombre}»: {tarea.texto}…")
+
+
+def dataset_subido(huella, contenido, nombre):
+    # Devuelve (huella, modelo, agregados sin filtros) del dataset a mostrar:
+    # el del archivo subido si ya está listo; si no, el anterior de la sesión
+    # (o se detiene la ejecución si no lo hay) mientras se muestra el avance.
+    contable = contable_memoria()
+    datos = contable.obtener(id_sesion(), "dataset")
+    if datos is not None and datos["huella"] == huella:
+        return huella, datos["modelo"], datos["agregados"]
+    compartidos = contable.compartido(huella)
+    if compartidos is not None:
+        # Otra sesión ya tiene este archivo en memoria
+        ingestas().soltar(id_sesion())
+        contadores_cache().registrar_consulta()
+        contable.guardar(id_sesion(), "dataset", compartidos, huella=huella)
+        return huella, compartidos["modelo"], compartidos["agregados"]
+
+    registro = registro_metricas()
+    destinos = (registro.proceso, registro.de_sesion(id_sesion()))
+    tarea, nueva = ingestas().tarea_de(
+        id_sesion(), huella, nombre, ingesta.procesar, contenido, AGREGADOR,
+        lambda etapa: metricas.tramo(etapa, *destinos),
+    )
+    contadores = contadores_cache()
+    contadores.registrar_consulta()
+    if nueva:
+        contadores.registrar_fallo()
+        logger.info("Caché de ingestión: fallo para %s", huella[:12])
+    logger.debug("Caché de ingestión: %s", contadores.resumen())
+
+    if not tarea.terminada:
+        progreso_ingesta(tarea)
+        if datos is None:
+            st.stop()
+        st.info(f"Mostrando los resultados anteriores mientras se procesa «{nombre}».")
+        return datos["huella"], datos["modelo"], datos["agregados"]
+
+    # El resultado pasa al contable (compartido por huella): la tarea no lo
+    # retiene, así que liberar las sesiones que lo usan libera la memoria
+    datos = contable.guardar(id_sesion(), "dataset", tarea.resultado(), huella=huella)
+    ingestas().retirar(huella)
+    return huella, datos["modelo"], datos["agregados"]
+
+
+@st.cache_resource
+def leer_bytes(ruta):
+    with open(ruta, "rb") as f:
+        return f.read()
+
+
+# -------------------------------
+# Motor de agregación
+# -------------------------------
+# pandas por defecto. Con APP_ESTADISTICAS_AGREGADOR=duckdb (y DuckDB instalado)
+# los totales y la serie del equipo se calculan con SQL en DuckDB; el
+# resultado es idéntico (ver motor_duckdb.comprobar_paridad). DuckDB solo se
+# importa si se elige. Consulta las tablas del modelo en memoria ya filtradas
+# por pandas (filtrar_rangos), no el almacén, y los totales sin filtros de
+# jornadas o fechas salen de las particiones (totales_particiones) con
+# cualquier motor: solo cambia quién agrega las vistas filtradas.
+def agregador_configurado():
+    if os.environ.get("APP_ESTADISTICAS_AGREGADOR") == "duckdb":
+        import motor_duckdb
+
+        if motor_duckdb.disponible():
+            return motor_duckdb
+        logger.warning("APP_ESTADISTICAS_AGREGADOR=duckdb, pero DuckDB no está instalado: se usa pandas")
+    return AGREGADOR_PANDAS
+
+
+AGREGADOR = agregador_configurado()
+
+
+# -------------------------------
+# Caché de resultados por filtros
+# -------------------------------
+# Los usuarios alternan entre unas pocas combinaciones de filtros (p. ej. "solo
+# Liga, segunda vuelta" y "todas las competiciones"). Los agregados de cada
+# combinación (cubo filtrado y tablas de todas las secciones) se guardan con
+# clave (huella del dataset, filtros canónicos), con un máximo de entradas y
+# un presupuesto de memoria; al superarlos se expulsa la menos usada. La
+# matriz de rivales y la forma reciente de cada vista van a la misma caché.
+MAX_ENTRADAS_FILTROS = 64                  # Combinaciones guardadas en el proceso
+MEMORIA_CACHE_FILTROS = 256 * 1024 * 1024  # Bytes como máximo entre todas ellas
+
+
+def memoria_de(objeto):
+    # Bytes aproximados de un resultado (DataFrames y arrays dentro de dicts y tuplas)
+    if isinstance(objeto, (pd.DataFrame, pd.Series)):
+        return int(np.sum(objeto.memory_usage(index=True, deep=True)))
+    if isinstance(objeto, np.ndarray):
+        return objeto.nbytes
+    if isinstance(objeto, dict):
+        return sum(memoria_de(valor) for valor in objeto.values())
+    if isinstance(objeto, (list, tuple)):
+        return sum(memoria_de(valor) for valor in objeto)
+    return 0
+
+
+def clave_filtros(huella, comp_filtro, jornadas=None, fechas=None, temporadas=None):
+    # Forma canónica: ni el orden de selección de las competiciones o
+    # temporadas ni la forma de elegir el tramo (vuelta o rango de jornadas)
+    # cambian la clave
+    return (
+        huella,
+        tuple(sorted(comp_filtro)),
+        tuple(int(j) if j is not None else None for j in jornadas) if jornadas is not None else None,
+        tuple(str(f) for f in fechas) if fechas is not None else None,
+        tuple(sorted(temporadas)) if temporadas is not None else None,
+    )
+
+
+class CacheResultados:
+    """Resultados por combinación de filtros, con expulsión LRU por entradas y memoria."""
+
+    def __init__(self, max_entradas=MAX_ENTRADAS_FILTROS, memoria_max=MEMORIA_CACHE_FILTROS):
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self.max_entradas = max_entradas
+        self.memoria_max = memoria_max
+        self.memoria = 0
+        self.consultas = 0
+        self.fallos = 0
+
+    def obtener(self, clave, calcular):
+        with self._lock:
+            self.consultas += 1
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                return self._entradas[clave][0]
+            self.fallos += 1
+        # Se calcula fuera del candado: otras sesiones no esperan a esta
+        valor = calcular()
+        tamano = memoria_de(valor)
+        if tamano > self.memoria_max:
+            return valor
+        with self._lock:
+            if clave not in self._entradas:
+                self._entradas[clave] = (valor, tamano)
+                self.memoria += tamano
+                while len(self._entradas) > self.max_entradas or self.memoria > self.memoria_max:
+                    _, (_, liberado) = self._entradas.popitem(last=False)
+                    self.memoria -= liberado
+        return valor
+
+    def resumen(self):
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "memoria": self.memoria,
+                "consultas": self.consultas,
+                "aciertos": self.consultas - self.fallos,
+                "fallos": self.fallos,
+            }
+
+
+@st.cache_resource
+def cache_resultados():
+    # Compartida por todas las sesiones: los resultados son de solo lectura
+    return CacheResultados()
+
+
+# -------------------------------
+# Memoria por sesión
+# -------------------------------
+# Cada sesión con un archivo propio mantiene en memoria su modelo (tabla de
+# partidos, cubo e índices) y sus agregados sin filtros. Un contable compartido
+# por el proceso registra lo que ocupa cada sesión y, al superar el
+# presupuesto, libera los datos de las sesiones inactivas empezando por la que
+# lleva más tiempo sin usarse. Una sesión liberada recupera sus datos de la
+# caché de ingestión o del almacén en su siguiente interacción. Los datos de un
+# mismo archivo (misma huella) se comparten entre las sesiones que lo usan y se
+# cuentan una sola vez; solo se liberan cuando los suelta la última.
+MEMORIA_SESIONES = 512 * 1024 * 1024  # Bytes para los datos de todas las sesiones
+INACTIVIDAD_SESION = 60               # Segundos sin interacción para poder liberar una sesión
+
+
+class ContableMemoria:
+    """Datos en memoria de cada sesión, con liberación LRU de las sesiones inactivas."""
+
+    def __init__(self, memoria_max=MEMORIA_SESIONES, inactividad=INACTIVIDAD_SESION, caducidad=TTL_CACHE_DATOS):
+        self._lock = threading.Lock()
+        self._sesiones = OrderedDict()  # De la menos a la más recientemente usada
+        self._compartidos = {}          # huella -> [valor, tamaño, {(sesión, nombre) que lo usan}]
+        self.memoria_max = memoria_max
+        self.inactividad = inactividad
+        self.caducidad = caducidad
+        self.memoria = 0
+        self.liberadas = 0
+
+    def obtener(self, sesion, nombre):
+        with self._lock:
+            registro = self._sesiones.get(sesion)
+            if registro is None:
+                return None
+            registro["uso"] = time.monotonic()
+            self._sesiones.move_to_end(sesion)
+            entrada = registro["datos"].get(nombre)
+            return None if entrada is None else entrada[0]
+
+    def compartido(self, huella):
+        # Datos de `huella` que ya tiene en memoria alguna sesión (o None)
+        with self._lock:
+            entrada = self._compartidos.get(huella)
+            return None if entrada is None else entrada[0]
+
+    def guardar(self, sesion, nombre, valor, huella=None):
+        # Con `huella` el valor se comparte con las sesiones que guarden la
+        # misma: se cuenta una vez y se devuelve el que ya estuviera en memoria
+        tamano = memoria_de(valor) if huella is None or self.compartido(huella) is None else 0
+        with self._lock:
+            registro = self._sesiones.setdefault(sesion, {"datos": {}, "uso": time.monotonic()})
+            anterior = registro["datos"].pop(nombre, None)
+            if anterior is not None:
+                self._soltar(sesion, nombre, anterior)
+            if huella is not None:
+                compartido = self._compartidos.get(huella)
+                if compartido is None:
+                    compartido = self._compartidos[huella] = [valor, tamano or memoria_de(valor), set()]
+                    self.memoria += compartido[1]
+                compartido[2].add((sesion, nombre))
+                valor, tamano = compartido[0], 0
+            else:
+                self.memoria += tamano
+            registro["datos"][nombre] = (valor, tamano, huella)
+            registro["uso"] = time.monotonic()
+            self._sesiones.move_to_end(sesion)
+            self._liberar()
+        return valor
+
+    def _soltar(self, sesion, nombre, entrada):
+        # Devuelve los bytes liberados (los compartidos, solo al soltarlos la última sesión)
+        _, tamano, huella = entrada
+        if huella is None:
+            self.memoria -= tamano
+            return tamano
+        compartido = self._compartidos[huella]
+        compartido[2].discard((sesion, nombre))
+        if compartido[2]:
+            return 0
+        del self._compartidos[huella]
+        self.memoria -= compartido[1]
+        return compartido[1]
+
+    def _tamano(self, entrada):
+        _, tamano, huella = entrada
+        return tamano if huella is None else self._compartidos[huella][1]
+
+    def _liberar(self):
+        # Sesiones caducadas (pestañas cerradas) siempre; inactivas solo si se
+        # supera el presupuesto. La sesión en curso es la más reciente y nunca
+        # está inactiva.
+        ahora = time.monotonic()
+        for sesion in list(self._sesiones):
+            inactiva = ahora - self._sesiones[sesion]["uso"]
+            if inactiva < self.inactividad:
+                break
+            if self.memoria <= self.memoria_max and inactiva < self.caducidad:
+                continue
+            registro = self._sesiones.pop(sesion)
+            liberado = sum(self._soltar(sesion, nombre, entrada) for nombre, entrada in registro["datos"].items())
+            self.liberadas += 1
+            logger.info("Memoria de sesiones: liberados %.1f MB de la sesión %s", liberado / 2**20, sesion[:8])
+        if self.memoria > self.memoria_max:
+            logger.warning("Memoria de sesiones por encima del presupuesto: %s", self.resumen(bloquear=False))
+
+    def resumen(self, bloquear=True):
+        if bloquear:
+            with self._lock:
+                return self.resumen(bloquear=False)
+        return {
+            "memoria": self.memoria,
+            "memoria_max": self.memoria_max,
+            "sesiones": len(self._sesiones),
+            "compartidos": len(self._compartidos),
+            "liberadas": self.liberadas,
+            "por_sesion": {
+                sesion[:8]: sum(self._tamano(entrada) for entrada in registro["datos"].values())
+                for sesion, registro in self._sesiones.items()
+            },
+        }
+
+
+@st.cache_resource
+def contable_memoria():
+    return ContableMemoria()
+
+
+def id_sesion():
+    return st.session_state.setdefault("id_sesion", uuid.uuid4().hex)
+
+
+def dataset_de_sesion(huella, cargar):
+    # Modelo y agregados sin filtros del dataset de la sesión. Si el contable
+    # los liberó (o es otro dataset) se vuelven a obtener con `cargar`.
+    contable = contable_memoria()
+    datos = contable.obtener(id_sesion(), "dataset")
+    if datos is None or datos["huella"] != huella:
+        datos = contable.compartido(huella)
+        contadores_cache().registrar_consulta()
+        if datos is None:
+            modelo = cargar()
+            datos = {"huella": huella, "modelo": modelo, "agregados": agregados_completos(modelo)}
+        datos = contable.guardar(id_sesion(), "dataset", datos, huella=huella)
+        resumen = contable.resumen()
+        logger.info(
+            "Memoria de sesiones: %.1f de %.0f MB en %d sesiones",
+            resumen["memoria"] / 2**20, resumen["memoria_max"] / 2**20, resumen["sesiones"],
+        )
+    return datos["modelo"], datos["agregados"]
+
+
+# -------------------------------
+# Filtros en la URL
+# -------------------------------
+# Opcionalmente el estado de los filtros se guarda en los parámetros de la URL
+# para compartir o recargar la misma vista. Los valores se validan contra el
+# dataset actual y los que no encajan se ignoran.
+PARAMETROS_FILTROS = ["temp", "comp", "desde", "hasta", "total", "vuelta", "jornada_ini", "jornada_fin"]
+
+
+def filtros_desde_url(parametros):
+    filtros = {}
+    if "temp" in parametros:
+        filtros["temp"] = parametros.get_all("temp")
+    if "comp" in parametros:
+        filtros["comp"] = parametros.get_all("comp")
+    try:
+        if "desde" in parametros and "hasta" in parametros:
+            filtros["fechas"] = (pd.Timestamp(parametros["desde"]).date(), pd.Timestamp(parametros["hasta"]).date())
+        if "total" in parametros:
+            filtros["total"] = int(parametros["total"])
+        if "jornada_ini" in parametros and "jornada_fin" in parametros:
+            filtros["jornadas"] = (int(parametros["jornada_ini"]), int(parametros["jornada_fin"]))
+    except ValueError:
+        logger.info("Filtros de la URL no válidos: %s", dict(parametros))
+    if "vuelta" in parametros:
+        filtros["vuelta"] = parametros["vuelta"]
+    return filtros
+
+
+def filtros_a_url(parametros, comp_filtro, fechas, total, vuelta, jornadas, temporadas=None):
+    # Escribe solo lo que difiere de los valores por defecto
+    valores = {
+        "temp": list(temporadas) if temporadas else None,
+        "comp": list(comp_filtro),
+        "desde": fechas[0].isoformat() if fechas else None,
+        "hasta": fechas[1].isoformat() if fechas else None,
+        "total": str(total) if total != TOTAL_JORNADAS else None,
+        "vuelta": vuelta if vuelta != "Toda la Liga" else None,
+        "jornada_ini": str(jornadas[0]) if jornadas else None,
+        "jornada_fin": str(jornadas[1]) if jornadas else None,
+    }
+    for nombre, valor in valores.items():
+        if valor is None:
+            parametros.pop(nombre, None)
+        elif parametros.get_all(nombre) != (valor if isinstance(valor, list) else [valor]):
+            parametros[nombre] = valor
+
+
+def borrar_filtros_url(parametros):
+    for nombre in PARAMETROS_FILTROS:
+        parametros.pop(nombre, None)
+
+
+def agregados_completos(modelo):
+    # Agregados sin filtros: punto de partida para añadir jornadas. Se guardan
+    # con el modelo en la memoria de las sesiones (ver dataset_de_sesion)
+    competiciones = sorted(modelo["partidos"]["COMPETICION"].unique())
+    with medir("agregados_completos"):
+        return calcular_agregados(modelo, competiciones, agregador=AGREGADOR, medir=medir)
+
+
+@st.cache_data(ttl=TTL_CACHE_DATOS, max_entries=MAX_ENTRADAS_CACHE, show_spinner=False)
+def barrido_ranking(totales, equipo, ranking_jugadores, rejilla):
+    # La clave incluye la tabla de totales (una fila por jugador) y la rejilla,
+    # así que cada combinación de filtros y rejilla se evalúa una sola vez
+    with medir("ranking_notas.barrido"):
+        _, notas = barrido_nota_ajustada(totales, equipo, *rejilla)
+        return estabilidad_posiciones(totales, notas, ranking_jugadores)
+
+
+def rivales_de(clave, cubo):
+    # Matriz jugador × rival del cubo filtrado; `clave` (clave_filtros)
+    # identifica el dataset y los filtros, así que se calcula una vez por vista.
+    # Va a la caché de resultados, que la cuenta en su presupuesto de memoria.
+    def calcular():
+        with medir("rivales.agregacion"):
+            return matriz_rivales(cubo, AGREGADOR)
+
+    return cache_resultados().obtener((clave, "rivales"), calcular)
+
+
+def forma_de(clave, cubo, ventana):
+    # Forma reciente de todos los jugadores del cubo filtrado (ver rivales_de)
+    def calcular():
+        with medir("forma.agregacion"):
+            return forma_reciente(cubo, ventana)
+
+    return cache_resultados().obtener((clave, "forma", ventana), calcular)
+
+
+# -------------------------------
+# Dataset de ejemplo compartido
+# -------------------------------
+# La mayoría de visitantes no sube ningún archivo: el ejemplo y todos sus
+# agregados con los filtros por defecto se calculan una sola vez por proceso y
+# se comparten entre sesiones. Los objetos devueltos son de solo lectura.
+ARCHIVO_EJEMPLO = "ejemplo.csv"
+
+
+@st.cache_resource(show_spinner="Preparando datos de ejemplo...")
+def datos_ejemplo():
+    contenido = leer_bytes(ARCHIVO_EJEMPLO)
+    huella = hashlib.sha256(contenido).hexdigest()
+    # El mismo proceso que los archivos subidos, pero en el hilo del script
+    datos = ingesta.procesar(ingesta.Tarea(huella), contenido, AGREGADOR, medir)
+    return {"huella": huella, "modelo": datos["modelo"], "defecto": datos["agregados"]}
+
+
+# Precalentamiento: la primera ejecución del script en el proceso deja listo el
+# ejemplo antes de pintar nada; las siguientes sesiones lo reciben ya calculado.
+datos_ejemplo()
+
+
 #Explicación de la Nota Ajustada
 @st.dialog("ℹ️ ¿Qué es la Nota Ajustada?", width="medium")
 def mostrar_explicacion_nota_ajustada():
@@ -67,6 +626,24 @@ def mostrar_explicacion_nota_ajustada():
     """)
 
 
+MAX_ERRORES_VISIBLES = 200  # Filas del informe de errores que se muestran (se descarga entero)
+
+
+def mostrar_archivo_invalido(e):
+    # Error de carga y, si hay filas no válidas, su informe para descargar
+    registro_metricas().proceso.incrementar("archivos_invalidos")
+    st.error(str(e))
+    if isinstance(e, DatosInvalidos):
+        st.dataframe(e.informe.head(MAX_ERRORES_VISIBLES), use_container_width=True, hide_index=True)
+        st.download_button(
+            label="📥 Descargar informe de errores",
+            data=e.informe.to_csv(index=False).encode("utf-8"),
+            file_name="informe_errores.csv",
+            mime="text/csv",
+        )
+    st.stop()
+
+
 # 🔹 Ajustar el ancho del contenido principal
 st.markdown("""
     <style>
@@ -80,7 +657,7 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # -------------------------------
-# 📂 Subir archivo CSV
+# 📂 Subir archivo CSV o Excel
 # -------------------------------
 st.title("📊 Análisis del Equipo y Estadísticas por Jugador según tus Notas Personales y más.")
 
@@ -93,19 +670,15 @@ with st.expander("ℹ️ **IMPORTANTE** ¿Cómo usar la plantilla de Excel?"):
     Sigue estos pasos:
 
     1. **Descarga el archivo** usando el botón Descargar plantilla de Excel.
-    2. **Crea una nueva hoja de cálculo en Google Sheets**.
-    3. En la barra de navegación de Google Sheets, ve a **Archivo → Importar**.
-    4. Se abrirá un pop-up. Dirígete a la pestaña **Subir** y agrega el archivo `.xlsx` descargado anteriormente.
-    5. ¡Listo! Ya tienes la plantilla lista para rellenar con los datos del Equipo.
-    6. Una vez que hayas completado la plantilla, descárgala como `.csv` desde Google Sheets, Archivo → Descargar → Valores separados por comas (.csv).
+    2. Ábrelo con Excel, LibreOffice o Google Sheets y **rellénalo con los datos del Equipo**.
+    3. **Sube el `.xlsx`** tal cual (o, si lo prefieres, expórtalo como `.csv`). Se lee la primera hoja.
 
     💡 **Tips adicionales:**  
     - Puedes cambiar los nombres de los jugadores y las competiciones para adaptarlo a cualquier otro equipo.  
-    - Guarda los cambios y luego descarga como `.csv` si quieres subirlo a la app.
+    - Desde Google Sheets, descárgalo con Archivo → Descargar → Microsoft Excel (.xlsx).
     """)
 
-with open("plantilla_estadisticas.xlsx", "rb") as f:
-    excel_bytes = f.read()
+excel_bytes = leer_bytes("plantilla_estadisticas.xlsx")
 
 st.download_button(
     label="📥 Descargar plantilla de Excel",
@@ -115,485 +688,517 @@ st.download_button(
 )
 
 # -------------------------------
-# Subir archivo CSV del usuario
+# Subir archivo CSV o Excel del usuario
 # -------------------------------
 archivo_usuario = st.file_uploader(
-    "Sube tu archivo CSV con las estadísticas",
-    type=["csv"]
+    "Sube tu archivo CSV o Excel (.xlsx) con las estadísticas",
+    type=["csv", "xlsx"]
 )
 
-archivo_ejemplo = "ejemplo.csv"
-if archivo_usuario is None:
-    st.info("Mostrando archivo de ejemplo.")
-    df = pd.read_csv(archivo_ejemplo, dayfirst=True)
-else:
-    df = pd.read_csv(archivo_usuario, dayfirst=True)
+ejemplo = None
+temporada_guardada = st.query_params.get("temporada")
+try:
+    if archivo_usuario is not None:
+        # -------------------------------
+        # Carga y validación en segundo plano (con caché)
+        # -------------------------------
+        contenido = archivo_usuario.getvalue()
+        huella = hashlib.sha256(contenido).hexdigest()
+        huella, modelo, completos = dataset_subido(huella, contenido, archivo_usuario.name)
+    elif temporada_guardada and almacen.existe(temporada_guardada):
+        ingestas().soltar(id_sesion())
+        huella = temporada_guardada
+        st.info(f"Mostrando la temporada guardada «{almacen.metadatos(huella)['nombre']}».")
+        modelo, completos = dataset_de_sesion(huella, lambda: cargar_temporada(huella))
+    else:
+        ingestas().soltar(id_sesion())
+        st.info("Mostrando archivo de ejemplo.")
+        ejemplo = datos_ejemplo()
+        huella, modelo, completos = ejemplo["huella"], ejemplo["modelo"], ejemplo["defecto"]
+except ArchivoInvalido as e:
+    mostrar_archivo_invalido(e)
 
 # -------------------------------
-# Validación de columnas
+# Añadir jornada: solo se procesan las filas nuevas
 # -------------------------------
-columnas_esperadas = [
-    "FECHA", "COMPETICION", "NOMBRE", "GOLES", 
-    "ASISTENCIAS", "NOTA", "MINS_JUGADOS", "GOLES_EN_CONTRA", "RIVAL"
-]
-faltantes = [col for col in columnas_esperadas if col not in df.columns]
-
-if faltantes:
-    st.error(f"Archivo CSV inválido. Faltan las columnas: {', '.join(faltantes)}")
-    st.stop()
-
-# Formato de columnas
-df["FECHA"] = pd.to_datetime(df["FECHA"], dayfirst=True)
-df["G/A"] = df["GOLES"] + df["ASISTENCIAS"]
-df["DIFERENCIA_GOLES"] = df["GOLES"] - df["GOLES_EN_CONTRA"]
+if ejemplo is None:
+    with st.expander("➕ Añadir jornada"):
+        st.markdown(
+            "Sube un CSV o Excel con **solo las filas nuevas** (mismas columnas que la plantilla). "
+            "Se añadirán a la temporada actual sin volver a procesarla entera."
+        )
+        archivo_jornada = st.file_uploader("CSV o Excel con la nueva jornada", type=["csv", "xlsx"], key="archivo_jornada")
+
+    if archivo_jornada is not None:
+        contenido_jornada = archivo_jornada.getvalue()
+        huella_filas = hashlib.sha256(contenido_jornada).hexdigest()
+        huella_anexada = almacen.huella_anexo(huella, huella_filas)
+        anexada = contable_memoria().obtener(id_sesion(), "anexada")
+        if anexada is None or anexada["huella"] != huella_anexada:
+            anexada = contable_memoria().compartido(huella_anexada)
+            if anexada is None:
+                try:
+                    with medir("validacion"):
+                        df_nuevo = compactar(validar_datos(ingesta.leer(contenido_jornada)))
+                    with medir("anexar_jornada"):
+                        modelo_anexado, completos_anexados = anexar_jornada(modelo, completos, df_nuevo)
+                except ArchivoInvalido as e:
+                    mostrar_archivo_invalido(e)
+                almacen.anexar(huella, huella_filas, df_nuevo)
+                anexada = {"huella": huella_anexada, "modelo": modelo_anexado, "agregados": completos_anexados}
+            anexada = contable_memoria().guardar(id_sesion(), "anexada", anexada, huella=huella_anexada)
+        huella, modelo, completos = anexada["huella"], anexada["modelo"], anexada["agregados"]
+
+    if almacen.existe(huella):
+        st.caption(f"🔗 [Enlace a esta temporada](?temporada={huella}) para volver a abrirla más adelante.")
+
+partidos = modelo["partidos"]
+jugadores = sorted(modelo["cubo"]["NOMBRE"].unique())
 
 # -------------------------------
 # Filtros generales
 # -------------------------------
 st.sidebar.header("Filtros generales")
-competiciones = sorted(df["COMPETICION"].unique())
+
+# Valores iniciales de los filtros desde la URL (una vez por sesión, para que
+# los valores por defecto de los widgets no cambien entre reruns)
+if "filtros_url" not in st.session_state:
+    st.session_state["filtros_url"] = filtros_desde_url(st.query_params)
+filtros_url = st.session_state["filtros_url"]
+
+# Temporadas (solo con archivos de varias): el modelo está particionado por
+# temporada y competición, así que los filtros solo leen sus particiones
+temporadas = sorted(partidos["TEMPORADA"].unique())
+temp_filtro = temporadas
+if len(temporadas) > 1:
+    temp_filtro = st.sidebar.multiselect(
+        "Selecciona las temporadas", options=temporadas,
+        default=[t for t in filtros_url.get("temp", []) if t in temporadas] or temporadas
+    )
+    if not temp_filtro:
+        st.warning("Selecciona al menos una temporada.")
+        st.stop()
+temporadas_sel = tuple(sorted(temp_filtro)) if len(temp_filtro) < len(temporadas) else None
+# Partidos de las temporadas elegidas: límites de los rangos de fechas y jornadas
+partidos_temporadas = partidos if temporadas_sel is None else partidos[partidos["TEMPORADA"].isin(temporadas_sel)]
+
+competiciones = sorted(partidos["COMPETICION"].unique())
 comp_filtro = st.sidebar.multiselect(
-    "Selecciona las competiciones", options=competiciones, default=competiciones
+    "Selecciona las competiciones", options=competiciones,
+    default=[c for c in filtros_url.get("comp", []) if c in competiciones] or competiciones
 )
-df_filtrado = df[df["COMPETICION"].isin(comp_filtro)].copy()
-if df_filtrado.empty:
+if not comp_filtro:
     st.warning("Selecciona al menos una competición.")
     st.stop()
 
+rango_fechas = None
+fechas_sel = None
+fecha_min, fecha_max = partidos_temporadas["FECHA"].iloc[0].date(), partidos_temporadas["FECHA"].iloc[-1].date()
+if fecha_min < fecha_max:
+    fecha_ini, fecha_fin = filtros_url.get("fechas", (fecha_min, fecha_max))
+    fecha_ini, fecha_fin = max(fecha_ini, fecha_min), min(fecha_fin, fecha_max)
+    fecha_ini, fecha_fin = st.sidebar.slider(
+        "Rango de fechas", min_value=fecha_min, max_value=fecha_max,
+        value=(fecha_ini, fecha_fin) if fecha_ini <= fecha_fin else (fecha_min, fecha_max), format="DD/MM/YYYY"
+    )
+    if (fecha_ini, fecha_fin) != (fecha_min, fecha_max):
+        fechas_sel = (fecha_ini, fecha_fin)
+        # Fin exclusivo al día siguiente para incluir todo el último día
+        rango_fechas = (
+            np.datetime64(pd.Timestamp(fecha_ini)),
+            np.datetime64(pd.Timestamp(fecha_fin) + pd.Timedelta(days=1)) - np.timedelta64(1, "ns"),
+        )
+
 # -------------------------------
-# Filtro especial: Primera / Segunda vuelta (solo Liga)
+# Filtro especial: Primera / Segunda vuelta o rango de jornadas (solo Liga)
 # -------------------------------
+TRAMOS_LIGA = ["Toda la Liga", "Primera vuelta", "Segunda vuelta", "Rango de jornadas"]
+total_jornadas_input = TOTAL_JORNADAS
+vuelta = "Toda la Liga"
+rango_jornadas = None
+jornadas_sel = None
 if "Liga" in comp_filtro:
     st.sidebar.markdown("### ⚙️ Configuración de la Liga", help="Por defecto es 38 (LaLiga). Cambia este valor si tu liga tiene otro número de jornadas.")
     total_jornadas_input = st.sidebar.number_input(
-        "Número total de jornadas", min_value=1, max_value=60, value=38, step=1
+        "Número total de jornadas", min_value=1, max_value=60,
+        value=min(max(filtros_url.get("total", TOTAL_JORNADAS), 1), 60), step=1
     )
     vuelta = st.sidebar.radio(
-        "Selecciona el tramo de la Liga", ["Toda la Liga", "Primera vuelta", "Segunda vuelta"], index=0
+        "Selecciona el tramo de la Liga", TRAMOS_LIGA,
+        index=TRAMOS_LIGA.index(filtros_url["vuelta"]) if filtros_url.get("vuelta") in TRAMOS_LIGA else 0
     )
-
-    liga_dates = (
-        df[df["COMPETICION"] == "Liga"]
-        .sort_values("FECHA")["FECHA"]
-        .drop_duplicates()
-        .reset_index(drop=True)
-    )
-    date_to_jornada = {fecha: i+1 for i, fecha in enumerate(liga_dates)}
-    df_filtrado.loc[df_filtrado["COMPETICION"] == "Liga", "JORNADA"] = df_filtrado.loc[
-        df_filtrado["COMPETICION"] == "Liga", "FECHA"
-    ].map(date_to_jornada)
-
-    corte_liga = total_jornadas_input // 2
-    if vuelta == "Primera vuelta":
-        df_filtrado = df_filtrado[~(
-            (df_filtrado["COMPETICION"] == "Liga") & (df_filtrado["JORNADA"] > corte_liga)
-        )]
-    elif vuelta == "Segunda vuelta":
-        df_filtrado = df_filtrado[~(
-            (df_filtrado["COMPETICION"] == "Liga") & (df_filtrado["JORNADA"] <= corte_liga)
-        )]
-
-# -------------------------------
-# SECCIÓN 1: Estadísticas por jugador o equipo (hover + resumen)
-# -------------------------------
-st.header("📈 Estadísticas individuales / Equipo")
-
-opciones_jugadores = ["Equipo General"] + sorted(df["NOMBRE"].unique())
-jugador_sel = st.selectbox("Selecciona el jugador o Equipo General", opciones_jugadores)
-tipo_stat = st.selectbox("Selecciona la estadística a mostrar", ["NOTA", "GOLES", "ASISTENCIAS", "G/A"])
-
-if jugador_sel == "Equipo General":
-    df_equipo = (
-        df_filtrado.groupby(["FECHA", "COMPETICION", "RIVAL"])
-        .agg({
-            "NOTA":"mean",
-            "GOLES":"sum",
-            "ASISTENCIAS":"sum",
-            "G/A":"sum",
-            "GOLES_EN_CONTRA":"max"
-        })
-        .reset_index()
-        .sort_values("FECHA")
-    )
-    
-    # Redondeamos nota para hover
-    df_equipo["NOTA"] = df_equipo["NOTA"].round(2)
-    
-    hover_cols = ["COMPETICION", "RIVAL", "GOLES_EN_CONTRA", "GOLES", "ASISTENCIAS", "G/A", "NOTA"]
-    fig = px.line(df_equipo, x="FECHA", y=tipo_stat, markers=True)
-    fig.update_traces(
-        customdata=df_equipo[hover_cols].values,
-        hovertemplate=(
-            "Competición: %{customdata[0]}<br>" +
-            "Rival: %{customdata[1]}<br>" +
-            "Goles en contra: %{customdata[2]}<br>" +
-            "Goles: %{customdata[3]}<br>" +
-            "Asistencias: %{customdata[4]}<br>" +
-            "G/A: %{customdata[5]}<br>" +
-            "Nota: %{customdata[6]}"
+    if vuelta == "Rango de jornadas":
+        jornadas_jugadas = max(int(partidos_temporadas["JORNADA"].max()), 2)
+        jornada_ini, jornada_fin = filtros_url.get("jornadas", (1, jornadas_jugadas))
+        jornada_ini, jornada_fin = max(jornada_ini, 1), min(jornada_fin, jornadas_jugadas)
+        rango_jornadas = st.sidebar.slider(
+            "Jornadas", min_value=1, max_value=jornadas_jugadas,
+            value=(jornada_ini, jornada_fin) if jornada_ini <= jornada_fin else (1, jornadas_jugadas)
         )
-    )
+        jornadas_sel = rango_jornadas
+    else:
+        rango_jornadas = rango_vuelta(vuelta, total_jornadas_input)
+
+if st.sidebar.toggle(
+    "🔗 Guardar filtros en el enlace", value=bool(filtros_url), key="filtros_en_url",
+    help="Añade los filtros a la URL para volver a esta misma vista o compartirla."
+):
+    filtros_a_url(st.query_params, comp_filtro, fechas_sel, total_jornadas_input, vuelta, jornadas_sel, temporadas_sel)
 else:
-    df_jugador = df_filtrado[df_filtrado["NOMBRE"]==jugador_sel].sort_values("FECHA")
-    hover_cols = ["COMPETICION", "RIVAL", "GOLES_EN_CONTRA", "GOLES", "ASISTENCIAS", "G/A", "MINS_JUGADOS", "NOTA"]
-    fig = px.line(df_jugador, x="FECHA", y=tipo_stat, markers=True)
-    fig.update_traces(
-        customdata=df_jugador[hover_cols].values,
-        hovertemplate=(
-            "Competición: %{customdata[0]}<br>" +
-            "Rival: %{customdata[1]}<br>" +
-            "Goles en contra: %{customdata[2]}<br>" +
-            "Goles: %{customdata[3]}<br>" +
-            "Asistencias: %{customdata[4]}<br>" +
-            "G/A: %{customdata[5]}<br>" +
-            "Mins jugados: %{customdata[6]}<br>" +
-            "Nota: %{customdata[7]}"
-        )
-    )
-
-fig.update_layout(
-    xaxis_title="MESES",
-    yaxis_title=tipo_stat,
-    hovermode="x unified"
+    borrar_filtros_url(st.query_params)
+
+# Con los filtros por defecto se reutilizan los agregados sin filtros ya
+# calculados (compartidos del proceso para el ejemplo, de solo lectura); el
+# resto de combinaciones se guardan en la caché de resultados por filtros
+usar_precalculados = (
+    sorted(comp_filtro) == competiciones
+    and rango_jornadas is None
+    and rango_fechas is None
+    and temporadas_sel is None
 )
-st.plotly_chart(fig, use_container_width=True)
-
-# -------------------------------
-# Tabla resumen con estadística seleccionada (Sección 1)
-# -------------------------------
-def calcular_por_partido(total, partidos):
-    return round(total / partidos, 2) if partidos else 0
-
-if jugador_sel == "Equipo General":
-    fila = {
-        "NOMBRE": "Equipo General",
-        "PARTIDOS_JUGADOS": df_filtrado["FECHA"].nunique(),
-        "MINUTOS_TOTALES": df_filtrado["MINS_JUGADOS"].sum(),
-    }
-    partidos = fila["PARTIDOS_JUGADOS"]
-
-    if tipo_stat == "NOTA":
-        nota_media = df_filtrado["NOTA"].mean()
-        
-        media_global = df_filtrado["NOTA"].mean()
-        
-        fila.update({"NOTA_MEDIA": round(nota_media,2)})
-        columnas = ["NOMBRE", "NOTA_MEDIA","PARTIDOS_JUGADOS","MINUTOS_TOTALES"]
-
-    elif tipo_stat == "GOLES":
-        total = df_filtrado["GOLES"].sum()
-        goles_en_contra_total = df_filtrado[["FECHA","GOLES_EN_CONTRA"]].drop_duplicates()["GOLES_EN_CONTRA"].sum()
-        diferencia_total = total - goles_en_contra_total
-        fila.update({"GOLES": total, "GOLES_EN_CONTRA": goles_en_contra_total, "DIFERENCIA_GOLES": diferencia_total})
-        fila["GOLES_POR_PARTIDO"] = calcular_por_partido(total, partidos)
-        columnas = ["NOMBRE","GOLES","GOLES_POR_PARTIDO","GOLES_EN_CONTRA","DIFERENCIA_GOLES","PARTIDOS_JUGADOS","MINUTOS_TOTALES"]
-
-    elif tipo_stat == "ASISTENCIAS":
-        total = df_filtrado["ASISTENCIAS"].sum()
-        fila.update({"ASISTENCIAS": total, "ASISTENCIAS_POR_PARTIDO": calcular_por_partido(total, partidos)})
-        columnas = ["NOMBRE","ASISTENCIAS","ASISTENCIAS_POR_PARTIDO","PARTIDOS_JUGADOS","MINUTOS_TOTALES"]
-
-    elif tipo_stat == "G/A":
-        total = df_filtrado["G/A"].sum()
-        fila.update({"G/A": total, "G/A_POR_PARTIDO": calcular_por_partido(total, partidos)})
-        columnas = ["NOMBRE","G/A","G/A_POR_PARTIDO","PARTIDOS_JUGADOS","MINUTOS_TOTALES"]
-
-    resumen = pd.DataFrame([fila])[columnas]
-
+if usar_precalculados:
+    agregados = completos
 else:
-    df_j = df_filtrado[df_filtrado["NOMBRE"]==jugador_sel]
-    fila = {
-        "NOMBRE": jugador_sel,
-        "PARTIDOS_JUGADOS": df_j["FECHA"].nunique(),
-        "MINUTOS_TOTALES": df_j["MINS_JUGADOS"].sum(),
-        "PARTIDOS_REALES": (df_j["MINS_JUGADOS"].sum() / 90).round(2)
-    }
-    partidos = fila["PARTIDOS_JUGADOS"]
-
-    if tipo_stat == "NOTA":
-        nota_media = df_j["NOTA"].mean()
-        
-        media_global = df_filtrado["NOTA"].mean()
-        
-        fila.update({"NOTA_MEDIA": round(nota_media,2)})
-        columnas = ["NOMBRE", "NOTA_MEDIA","PARTIDOS_JUGADOS","MINUTOS_TOTALES", "PARTIDOS_REALES"]
-
-    elif tipo_stat == "GOLES":
-        total = df_j["GOLES"].sum()
-        fila.update({"GOLES": total, "GOLES_POR_PARTIDO": calcular_por_partido(total, partidos)})
-        columnas = ["NOMBRE","GOLES","GOLES_POR_PARTIDO","PARTIDOS_JUGADOS","MINUTOS_TOTALES", "PARTIDOS_REALES"]
-
-    elif tipo_stat == "ASISTENCIAS":
-        total = df_j["ASISTENCIAS"].sum()
-        fila.update({"ASISTENCIAS": total, "ASISTENCIAS_POR_PARTIDO": calcular_por_partido(total, partidos)})
-        columnas = ["NOMBRE","ASISTENCIAS","ASISTENCIAS_POR_PARTIDO","PARTIDOS_JUGADOS","MINUTOS_TOTALES", "PARTIDOS_REALES"]
-
-    elif tipo_stat == "G/A":
-        total = df_j["G/A"].sum()
-        fila.update({"G/A": total, "G/A_POR_PARTIDO": calcular_por_partido(total, partidos)})
-        columnas = ["NOMBRE","G/A","G/A_POR_PARTIDO","PARTIDOS_JUGADOS","MINUTOS_TOTALES", "PARTIDOS_REALES"]
-
-    resumen = pd.DataFrame([fila])[columnas]
-
-# Encabezado con enlace informativo
-st.markdown("### 📋 Resumen de participación")
+    with medir("filtros"):
+        agregados = cache_resultados().obtener(
+            clave_filtros(huella, comp_filtro, rango_jornadas, rango_fechas, temporadas_sel),
+            lambda: calcular_agregados(
+                modelo, comp_filtro, rango_jornadas, rango_fechas,
+                agregador=AGREGADOR, medir=medir, temporadas=temporadas_sel,
+            ),
+        )
 
-st.dataframe(resumen, use_container_width=True, hide_index=True)
+if agregados["cubo"].empty:
+    st.warning("No hay partidos con los filtros seleccionados.")
+    st.stop()
 
+# Cada sección es un fragmento con entradas explícitas: sus propios widgets
+# solo vuelven a ejecutar esa sección; los filtros generales (barra lateral)
+# vuelven a ejecutar la página. Los desplegables costosos se calculan solo
+# cuando están abiertos.
 
 
 # -------------------------------
-# SECCIÓN 2: Comparador de jugadores (hover + resumen)
+# SECCIÓN 1: Estadísticas por jugador o equipo (hover + resumen)
 # -------------------------------
-st.header("🆚 Comparador de jugadores")
+@st.fragment
+def seccion_estadisticas(agregados, jugadores, total_jornadas):
+    cubo_filtrado = agregados["cubo"]
+    totales = agregados["totales"]
+
+    st.header("📈 Estadísticas individuales / Equipo")
+
+    opciones_jugadores = ["Equipo General"] + jugadores
+    jugador_sel = st.selectbox("Selecciona el jugador o Equipo General", opciones_jugadores)
+    tipo_stat = st.selectbox("Selecciona la estadística a mostrar", ["NOTA", "GOLES", "ASISTENCIAS", "G/A"])
+
+    if jugador_sel == "Equipo General":
+        with medir("estadisticas.figura"):
+            fig = figura_equipo(agregados["df_equipo"], tipo_stat)
+    else:
+        with medir("estadisticas.agregacion"):
+            df_jugador = cubo_filtrado[cubo_filtrado["NOMBRE"]==jugador_sel].sort_values("FECHA")
+        with medir("estadisticas.figura"):
+            fig = figura_jugador(df_jugador, tipo_stat)
+
+    with medir("estadisticas.grafico"):
+        st.plotly_chart(fig, use_container_width=True)
+
+    # -------------------------------
+    # Tabla resumen con estadística seleccionada (Sección 1)
+    # -------------------------------
+    with medir("estadisticas.agregacion"):
+        if jugador_sel == "Equipo General":
+            fila = fila_resumen("Equipo General", agregados["equipo"], tipo_stat, equipo=True)
+            columnas = columnas_resumen(tipo_stat, equipo=True)
+            cubo_desglose = cubo_filtrado
+        else:
+            fila = fila_resumen(jugador_sel, totales_de(totales, [jugador_sel]).to_dict("records")[0], tipo_stat)
+            columnas = columnas_resumen(tipo_stat)
+            cubo_desglose = cubo_filtrado[cubo_filtrado["NOMBRE"] == jugador_sel]
+
+        resumen = pd.DataFrame([fila])[columnas]
+
+    # Encabezado con enlace informativo
+    st.markdown("### 📋 Resumen de participación")
+
+    with medir("estadisticas.tabla"):
+        st.dataframe(resumen, use_container_width=True, hide_index=True)
+
+    with st.expander("Desglose por competición y vuelta", key="desglose_abierto", on_change="rerun") as desplegable:
+        if desplegable.open:
+            with medir("estadisticas.desglose"):
+                desglose = AGREGADOR.agregar_cubo(cubo_desglose, ["COMPETICION", "TRAMO"], total_jornadas).reset_index()
+                desglose["NOTA_MEDIA"] = desglose["NOTA_MEDIA"].round(2)
+            with medir("estadisticas.tabla"):
+                st.dataframe(
+                    desglose[["COMPETICION", "TRAMO", "NOTA_MEDIA", "GOLES", "ASISTENCIAS", "G/A", "PARTIDOS_JUGADOS", "MINUTOS_TOTALES"]],
+                    use_container_width=True,
+                    hide_index=True
+                )
 
-jugadores = sorted(df["NOMBRE"].unique())
-jugadores_comparar = st.multiselect(
-    "Selecciona los jugadores a comparar",
-    jugadores,
-    default=[jugadores[0], jugadores[1]] if len(jugadores) > 1 else jugadores
-)
-tipo_comparar = st.selectbox("Selecciona la estadística a comparar", ["NOTA","GOLES","ASISTENCIAS","G/A"])
-
-fig2 = px.line()
-for j in jugadores_comparar:
-    df_temp = df_filtrado[df_filtrado["NOMBRE"] == j].sort_values("FECHA")
-    hover_cols = ["COMPETICION", "RIVAL", "GOLES_EN_CONTRA", "GOLES", "ASISTENCIAS", "G/A", "MINS_JUGADOS","NOTA"]
-    fig2.add_scatter(
-        x=df_temp["FECHA"],
-        y=df_temp[tipo_comparar],
-        mode='lines+markers',
-        name=j,
-        hovertemplate=(
-            "Competición: %{customdata[0]}<br>" +
-            "Rival: %{customdata[1]}<br>" +
-            "Goles en contra: %{customdata[2]}<br>" +
-            "Goles: %{customdata[3]}<br>" +
-            "Asistencias: %{customdata[4]}<br>" +
-            "G/A: %{customdata[5]}<br>" +
-            "Mins jugados: %{customdata[6]}<br>" +
-            "Nota: %{customdata[7]}"
-        ),
-        customdata=df_temp[hover_cols].values
-    )
-
-fig2.update_layout(
-    title=f"Comparativa de {tipo_comparar} entre jugadores",
-    xaxis_title="MESES",
-    yaxis_title=tipo_comparar,
-    hovermode="x",
-    #height=600
-)
-st.plotly_chart(fig2, use_container_width=True)
 
 # -------------------------------
-# Tabla resumen comparativa con estadística seleccionada (Sección 2)
+# SECCIÓN 2: Comparador de jugadores (hover + resumen)
 # -------------------------------
-resumen = []
-for jugador in jugadores_comparar:
-    df_j = df_filtrado[df_filtrado["NOMBRE"] == jugador]
-    partidos = df_j["FECHA"].nunique()
-    fila = {
-        "NOMBRE": jugador,
-        "PARTIDOS_JUGADOS": partidos,
-        "MINUTOS_TOTALES": df_j["MINS_JUGADOS"].sum(),
-        "PARTIDOS_REALES": (df_j["MINS_JUGADOS"].sum() / 90).round(2)
-    }
-
-    if tipo_comparar == "NOTA":
-        nota_media = df_j["NOTA"].mean()
-        
-        media_global = df_filtrado["NOTA"].mean()
-        
-        fila.update({"NOTA_MEDIA": round(nota_media,2)})
-        columnas = ["NOMBRE", "NOTA_MEDIA","PARTIDOS_JUGADOS","MINUTOS_TOTALES", "PARTIDOS_REALES"]
-
-    elif tipo_comparar == "GOLES":
-        total = df_j["GOLES"].sum()
-        fila.update({"GOLES": total, "GOLES_POR_PARTIDO": calcular_por_partido(total, partidos)})
-        columnas = ["NOMBRE","GOLES","GOLES_POR_PARTIDO","PARTIDOS_JUGADOS","MINUTOS_TOTALES", "PARTIDOS_REALES"]
-
-    elif tipo_comparar == "ASISTENCIAS":
-        total = df_j["ASISTENCIAS"].sum()
-        fila.update({"ASISTENCIAS": total, "ASISTENCIAS_POR_PARTIDO": calcular_por_partido(total, partidos)})
-        columnas = ["NOMBRE","ASISTENCIAS","ASISTENCIAS_POR_PARTIDO","PARTIDOS_JUGADOS","MINUTOS_TOTALES", "PARTIDOS_REALES"]
-
-    elif tipo_comparar == "G/A":
-        total = df_j["G/A"].sum()
-        fila.update({"G/A": total, "G/A_POR_PARTIDO": calcular_por_partido(total, partidos)})
-        columnas = ["NOMBRE","G/A","G/A_POR_PARTIDO","PARTIDOS_JUGADOS","MINUTOS_TOTALES", "PARTIDOS_REALES"]
-
-    resumen.append(pd.DataFrame([fila])[columnas])
-
-st.markdown("### 📋 Resumen de participación")
-
-st.dataframe(pd.concat(resumen, ignore_index=True), use_container_width=True, hide_index=True)
-
+@st.fragment
+def seccion_comparador(agregados, jugadores, temporadas, comp_filtro, particiones=None):
+    # `particiones`: totales por partición del modelo si los filtros solo
+    # eligen temporadas y competiciones completas (sin jornadas ni fechas)
+    cubo_filtrado = agregados["cubo"]
+    totales = agregados["totales"]
+
+    st.header("🆚 Comparador de jugadores")
+
+    jugadores_comparar = st.multiselect(
+        "Selecciona los jugadores a comparar",
+        jugadores,
+        default=[jugadores[0], jugadores[1]] if len(jugadores) > 1 else jugadores
+    )
+    tipo_comparar = st.selectbox("Selecciona la estadística a comparar", ["NOTA","GOLES","ASISTENCIAS","G/A"])
+
+    with medir("comparador.agregacion"):
+        seleccion, tramos = series_comparador(cubo_filtrado, jugadores_comparar)
+    with medir("comparador.figura"):
+        fig2 = figura_comparador(seleccion, tramos, jugadores_comparar, tipo_comparar)
+    with medir("comparador.grafico"):
+        st.plotly_chart(fig2, use_container_width=True)
+
+    # -------------------------------
+    # Tabla resumen comparativa con estadística seleccionada (Sección 2)
+    # -------------------------------
+    with medir("comparador.agregacion"):
+        totales_comparar = totales_de(totales, jugadores_comparar)
+        filas = [
+            fila_resumen(jugador, totales_jugador, tipo_comparar)
+            for jugador, totales_jugador in zip(jugadores_comparar, totales_comparar.to_dict("records"))
+        ]
+        resumen = pd.DataFrame(filas, columns=columnas_resumen(tipo_comparar))
+
+    st.markdown("### 📋 Resumen de participación")
+
+    with medir("comparador.tabla"):
+        st.dataframe(resumen, use_container_width=True, hide_index=True)
+
+    if len(temporadas) < 2:
+        return
+    with st.expander("Desglose por temporada", key="temporadas_abierto", on_change="rerun") as desplegable:
+        if desplegable.open:
+            with medir("comparador.temporadas"):
+                if particiones is not None:
+                    # Roll-up de los totales por partición: no depende del número de partidos
+                    por_temporada = totales_particiones(particiones, comp_filtro, temporadas, por=("NOMBRE", "TEMPORADA"))
+                    por_temporada = por_temporada[por_temporada.index.get_level_values("NOMBRE").isin(jugadores_comparar)]
+                else:
+                    por_temporada = AGREGADOR.agregar_cubo(seleccion, ["NOMBRE", "TEMPORADA"])
+                por_temporada = por_temporada.reset_index()
+                por_temporada["NOTA_MEDIA"] = por_temporada["NOTA_MEDIA"].round(2)
+            with medir("comparador.tabla"):
+                st.dataframe(
+                    por_temporada[["NOMBRE", "TEMPORADA", "NOTA_MEDIA", "GOLES", "ASISTENCIAS", "G/A", "PARTIDOS_JUGADOS", "MINUTOS_TOTALES"]],
+                    use_container_width=True,
+                    hide_index=True
+                )
 
 
 # -------------------------------
 # SECCIÓN 3: Ranking por notas de rendimiento (versión mejorada)
 # -------------------------------
-st.header("🏆 Ranking por notas de rendimiento")
-
-# Parámetros de la fórmula ajustable
-alpha = 2    # Potencia para peso de minutos
-k = 60       # Suavizado hacia la nota global
-gamma = 0.25 # Intensidad del bonus por minutos
-beta = 2     # Curvatura del bonus
-media_global = df_filtrado["NOTA"].mean()
-
-# Agrupamos datos base por jugador
-ranking_notas = (
-    df_filtrado.groupby("NOMBRE")
-    .agg({
-        "NOTA": "mean",
-        "FECHA": "nunique",
-        "MINS_JUGADOS": "sum"
-    })
-    .rename(columns={
-        "FECHA": "PARTIDOS_JUGADOS",
-        "MINS_JUGADOS": "MINUTOS_TOTALES",
-        "NOTA": "NOTA_MEDIA",
-    })
-    .reset_index()
-)
-
-# Calculamos máximo de minutos para normalizar el bonus
-minutos_max = ranking_notas["MINUTOS_TOTALES"].replace(0, 1).max()
-
-# Paso 1: peso no lineal por minutos (partidos equivalentes ^ alpha)
-ranking_notas["PESO_MINUTOS"] = (ranking_notas["MINUTOS_TOTALES"] / 90.0) ** alpha
-
-# Paso 2: base ponderada entre nota del jugador y media global
-ranking_notas["BASE"] = (
-    (ranking_notas["PESO_MINUTOS"] * ranking_notas["NOTA_MEDIA"] + k * media_global)
-    / (ranking_notas["PESO_MINUTOS"] + k)
-)
-
-# Paso 3: bonus por minutos jugados (normalizado respecto al máximo/2)
-ranking_notas["BONUS"] = gamma * (ranking_notas["MINUTOS_TOTALES"] / minutos_max) ** beta
+@st.fragment
+def seccion_ranking_notas(agregados):
+    st.header("🏆 Ranking por notas de rendimiento")
+
+    equipo_notas, ranking_jugadores = agregados["ranking_notas"]
+
+    # -------------------------------
+    # Mostrar resultados
+    # -------------------------------
+    st.markdown("### 🔴 Equipo General")
+    with medir("ranking_notas.tabla"):
+        st.dataframe(equipo_notas, use_container_width=True, hide_index=True)
+
+    st.button("ℹ️ ¿Qué es la Nota Ajustada?", on_click=mostrar_explicacion_nota_ajustada, key="nota_ajustada_btn3")
+
+    st.markdown("### 🔵 Jugadores (Posición ordenada según Nota Ajustada)")
+    with medir("ranking_notas.tabla"):
+        st.dataframe(
+            ranking_jugadores,
+            use_container_width=True,
+            hide_index=True,
+            height=max(400, len(ranking_jugadores)*35+40)
+        )
 
-# Paso 4: nota ajustada final
-ranking_notas["NOTA_AJUSTADA"] = (ranking_notas["BASE"] + ranking_notas["BONUS"]).round(2)
-ranking_notas["NOTA_MEDIA"] = ranking_notas["NOTA_MEDIA"].round(2)
+    # -------------------------------
+    # Barrido de parámetros: estabilidad de la POS
+    # -------------------------------
+    with st.expander("🎛️ Barrido de parámetros de la Nota Ajustada", key="barrido_abierto", on_change="rerun") as desplegable:
+        if desplegable.open:
+            st.markdown(
+                "Evalúa la Nota Ajustada para toda una rejilla de valores de **α**, **k**, **γ** y **β** "
+                "y muestra cuánto cambia la posición de cada jugador. "
+                f"Valores actuales: α={ALPHA}, k={K}, γ={GAMMA}, β={BETA}."
+            )
+            col_a, col_b = st.columns(2)
+            alpha_rango = col_a.slider("α (peso de minutos)", 0.5, 4.0, (1.0, 3.0), step=0.25)
+            k_rango = col_b.slider("k (suavizado)", 0, 200, (20, 120), step=5)
+            gamma_rango = col_a.slider("γ (intensidad del bonus)", 0.0, 1.0, (0.0, 0.5), step=0.05)
+            beta_rango = col_b.slider("β (curvatura del bonus)", 0.5, 4.0, (1.0, 3.0), step=0.25)
+            valores_por_parametro = st.slider("Valores por parámetro", 2, 10, 6)
+
+            rejilla = tuple(
+                tuple(np.linspace(inicio, fin, valores_por_parametro).round(4))
+                for inicio, fin in (alpha_rango, k_rango, gamma_rango, beta_rango)
+            )
+            estabilidad = barrido_ranking(agregados["totales"], agregados["equipo"], ranking_jugadores, rejilla)
+            st.caption(
+                f"{valores_por_parametro ** 4} combinaciones evaluadas. "
+                "%_MISMA_POS: porcentaje de combinaciones en las que el jugador mantiene su posición actual."
+            )
+            with medir("ranking_notas.tabla"):
+                st.dataframe(
+                    estabilidad,
+                    use_container_width=True,
+                    hide_index=True,
+                    height=max(400, len(estabilidad)*35+40)
+                )
 
-# Añadimos columna de partidos reales
-ranking_notas["PARTIDOS_REALES"] = (ranking_notas["MINUTOS_TOTALES"] / 90).round(2)
 
 # -------------------------------
-# Equipo general
+# SECCIÓN 4: Ranking ofensivo (corregido y bonito)
 # -------------------------------
-nota_ajustada_equipo = ranking_notas["NOTA_AJUSTADA"].mean().round(2)
-nota_media_equipo = ranking_notas["NOTA_MEDIA"].mean().round(2)
+@st.fragment
+def seccion_ranking_ofensivo(agregados):
+    st.header("⚽ Ranking de rendimiento ofensivo")
+
+    equipo_of, ranking_jugadores_of = agregados["ranking_ofensivo"]
+
+    # Mostrar tablas
+    st.markdown("### 🔴 Equipo General")
+    with medir("ranking_ofensivo.tabla"):
+        st.dataframe(equipo_of, use_container_width=True, hide_index=True)
+
+    st.markdown("### 🔵 Jugadores (Posición ordenada según G/A)")
+    with medir("ranking_ofensivo.tabla"):
+        st.dataframe(
+            ranking_jugadores_of,
+            use_container_width=True,
+            hide_index=True,
+            height=max(400, len(ranking_jugadores_of)*35+40)
+        )
 
-equipo_notas = pd.DataFrame({
-    "POS": ["-"],
-    "NOMBRE": ["Equipo General"],
-    "NOTA_AJUSTADA": [nota_ajustada_equipo],
-    "NOTA_MEDIA": [nota_media_equipo],
-    "PARTIDOS_JUGADOS": [df_filtrado["FECHA"].nunique()],
-    "MINUTOS_TOTALES": [df_filtrado["MINS_JUGADOS"].sum()],
-})
 
 # -------------------------------
-# Ranking final de jugadores
+# SECCIÓN 5: Rendimiento por rival y forma reciente
 # -------------------------------
-ranking_jugadores = ranking_notas.sort_values("NOTA_AJUSTADA", ascending=False).reset_index(drop=True)
-ranking_jugadores.insert(0, "POS", range(1, len(ranking_jugadores) + 1))
+MAX_JUGADORES_MAPA = 30  # Filas del mapa de calor (los jugadores con más minutos)
 
-# Columnas a mostrar
-columnas_equipo = [
-    "POS", "NOMBRE", "NOTA_AJUSTADA", "NOTA_MEDIA",
-    "PARTIDOS_JUGADOS", "MINUTOS_TOTALES"
-]
 
-columnas_jugadores = columnas_equipo + ["PARTIDOS_REALES"]
+@st.fragment
+def seccion_rivales_forma(agregados, jugadores, clave):
+    cubo_filtrado = agregados["cubo"]
+    totales = agregados["totales"]
 
-ranking_jugadores = ranking_jugadores[columnas_jugadores]
-equipo_notas = equipo_notas[columnas_equipo]
+    st.header("🎯 Rendimiento por rival y forma reciente")
 
-# -------------------------------
-# Mostrar resultados
-# -------------------------------
-st.markdown("### 🔴 Equipo General")
-st.dataframe(equipo_notas, use_container_width=True, hide_index=True)
+    metrica = st.selectbox(
+        "Selecciona la estadística por rival", list(METRICAS_RIVALES),
+        format_func=lambda m: METRICAS_RIVALES[m][0],
+    )
+    principales = list(totales["MINUTOS_TOTALES"].nlargest(MAX_JUGADORES_MAPA).index)
+
+    matriz = rivales_de(clave, cubo_filtrado)
+    with medir("rivales.figura"):
+        fig = figura_rivales(
+            tabla_rivales(matriz, metrica, principales),
+            tabla_rivales(matriz, "PARTIDOS_JUGADOS", principales),
+            metrica,
+        )
+    with medir("rivales.grafico"):
+        st.plotly_chart(fig, use_container_width=True)
+    if len(totales) > MAX_JUGADORES_MAPA:
+        st.caption(f"Se muestran los {MAX_JUGADORES_MAPA} jugadores con más minutos.")
+
+    # -------------------------------
+    # Forma reciente: ventana móvil por jugador (Sección 5)
+    # -------------------------------
+    st.markdown("### 📈 Forma reciente")
+    jugadores_forma = st.multiselect(
+        "Selecciona los jugadores", jugadores, default=[j for j in principales[:2] if j in jugadores],
+    )
+    col_stat, col_ventana = st.columns(2)
+    tipo_forma = col_stat.selectbox("Selecciona la estadística de forma", ["NOTA", "G/A"])
+    ventana = col_ventana.slider("Partidos de la ventana", 2, 15, VENTANA_FORMA)
+
+    serie, tramos = forma_de(clave, cubo_filtrado, ventana)
+    with medir("forma.figura"):
+        fig_forma = figura_forma(serie, tramos, jugadores_forma, f"{tipo_forma}_FORMA", ventana)
+    with medir("forma.grafico"):
+        st.plotly_chart(fig_forma, use_container_width=True)
 
-st.button("ℹ️ ¿Qué es la Nota Ajustada?", on_click=mostrar_explicacion_nota_ajustada, key="nota_ajustada_btn3")
 
-st.markdown("### 🔵 Jugadores (Posición ordenada según Nota Ajustada)")
-st.dataframe(
-    ranking_jugadores,
-    use_container_width=True,
-    hide_index=True,
-    height=max(400, len(ranking_jugadores)*35+40)
+seccion_estadisticas(agregados, jugadores, total_jornadas_input)
+seccion_comparador(
+    agregados, jugadores, temp_filtro, comp_filtro,
+    modelo["particiones"] if rango_jornadas is None and rango_fechas is None else None,
+)
+seccion_ranking_notas(agregados)
+seccion_ranking_ofensivo(agregados)
+seccion_rivales_forma(
+    agregados, jugadores, clave_filtros(huella, comp_filtro, rango_jornadas, rango_fechas, temporadas_sel),
 )
 
 
 # -------------------------------
-# SECCIÓN 4: Ranking ofensivo (corregido y bonito)
+# Métricas: exportación y panel de depuración
 # -------------------------------
-st.header("⚽ Ranking de rendimiento ofensivo")
-
-# Ranking individual de jugadores
-ranking_ofensivo = (
-    df_filtrado.groupby("NOMBRE")
-    .agg({
-        "GOLES": "sum",
-        "ASISTENCIAS": "sum",
-        "G/A": "sum",
-        "FECHA": "nunique",
-        "MINS_JUGADOS": "sum"
-    })
-    .rename(columns={"FECHA": "PARTIDOS_JUGADOS", "MINS_JUGADOS": "MINUTOS_TOTALES"})
-    .reset_index()
-)
-ranking_ofensivo["GOLES_POR_PARTIDO"] = (ranking_ofensivo["GOLES"] / ranking_ofensivo["PARTIDOS_JUGADOS"]).round(2)
-ranking_ofensivo["ASISTENCIAS_POR_PARTIDO"] = (ranking_ofensivo["ASISTENCIAS"] / ranking_ofensivo["PARTIDOS_JUGADOS"]).round(2)
-ranking_ofensivo["G/A_POR_PARTIDO"] = (ranking_ofensivo["G/A"] / ranking_ofensivo["PARTIDOS_JUGADOS"]).round(2)
-ranking_ofensivo["PARTIDOS_REALES"] = (ranking_ofensivo["MINUTOS_TOTALES"] / 90).round(2)
-
-# Ordenamos jugadores por G/A
-ranking_jugadores_of = ranking_ofensivo.sort_values("G/A", ascending=False).reset_index(drop=True)
-ranking_jugadores_of.insert(0, "POS", range(1, len(ranking_jugadores_of)+1))
-
-# -----------------------
-# Equipo General
-# -----------------------
-partidos = df_filtrado[["FECHA", "GOLES_EN_CONTRA"]].drop_duplicates()
-goles_en_contra_total = partidos["GOLES_EN_CONTRA"].sum()
-diferencia_total = df_filtrado["GOLES"].sum() - goles_en_contra_total
-
-equipo_of = pd.DataFrame({
-    "POS": ["-"],
-    "NOMBRE": ["Equipo General"],
-    #"G/A": [df_filtrado["G/A"].sum()],
-    "GOLES": [df_filtrado["GOLES"].sum()],
-    #"ASISTENCIAS": [df_filtrado["ASISTENCIAS"].sum()],
-    "GOLES_EN_CONTRA": [goles_en_contra_total],
-    "DIFERENCIA_GOLES": [diferencia_total],
-    "GOLES_POR_PARTIDO": [(df_filtrado["GOLES"].sum()/df_filtrado["FECHA"].nunique()).round(2)],
-    #"ASISTENCIAS_POR_PARTIDO": [(df_filtrado["ASISTENCIAS"].sum()/df_filtrado["FECHA"].nunique()).round(2)],
-    #"G/A_POR_PARTIDO": [(df_filtrado["G/A"].sum()/df_filtrado["FECHA"].nunique()).round(2)],
-    "PARTIDOS_JUGADOS": [df_filtrado["FECHA"].nunique()],
-    #"MINUTOS_TOTALES": [df_filtrado["MINS_JUGADOS"].sum()],
-})
-
-ranking_jugadores_of = ranking_jugadores_of[[
-    "POS", "NOMBRE", "G/A", "GOLES", "ASISTENCIAS",
-    "GOLES_POR_PARTIDO", "ASISTENCIAS_POR_PARTIDO", "G/A_POR_PARTIDO",
-    "PARTIDOS_JUGADOS", "MINUTOS_TOTALES", "PARTIDOS_REALES"
-]]
-
-# Mostrar tablas
-st.markdown("### 🔴 Equipo General")
-st.dataframe(equipo_of, use_container_width=True, hide_index=True)
-
-st.markdown("### 🔵 Jugadores (Posición ordenada según G/A)")
-st.dataframe(
-    ranking_jugadores_of,
-    use_container_width=True,
-    hide_index=True,
-    height=max(400, len(ranking_jugadores_of)*35+40)
+def tabla_metricas(resumen):
+    # Una fila por etapa, de la más costosa a la que menos
+    filas = [
+        {
+            "ETAPA": nombre,
+            "N": tramo["n"],
+            "TOTAL_MS": round(tramo["segundos"] * 1000, 1),
+            "MEDIA_MS": round(tramo["segundos"] * 1000 / tramo["n"], 1),
+            "MAX_MS": round(tramo["max"] * 1000, 1),
+            "ULTIMO_MS": round(tramo["ultimo"] * 1000, 1),
+            "MB_ASIGNADOS": round(tramo["bytes"] / 2**20, 1),
+        }
+        for nombre, tramo in resumen["tramos"].items()
+    ]
+    tabla = pd.DataFrame(filas, columns=["ETAPA", "N", "TOTAL_MS", "MEDIA_MS", "MAX_MS", "ULTIMO_MS", "MB_ASIGNADOS"])
+    if not ASIGNACIONES:
+        tabla = tabla.drop(columns="MB_ASIGNADOS")
+    return tabla.sort_values("TOTAL_MS", ascending=False)
+
+
+registro = registro_metricas()
+registro.fuentes.update(
+    cache_ingestion=contadores_cache().resumen,
+    ingestas=ingestas().resumen,
+    cache_filtros=cache_resultados().resumen,
+    memoria_sesiones=contable_memoria().resumen,
 )
+# Ejecución completa del script (los fragmentos se miden en sus propias etapas)
+duracion_ejecucion = time.perf_counter() - inicio_ejecucion
+for destino in (registro.proceso, registro.de_sesion(id_sesion())):
+    destino.registrar("ejecucion", duracion_ejecucion)
+if ARCHIVO_METRICAS:
+    archivo_metricas().actualizar(registro)
+
+if AGREGADOR is not AGREGADOR_PANDAS:
+    st.sidebar.caption(
+        "⚙️ Agregación con DuckDB: SQL sobre las tablas en memoria ya filtradas. "
+        "Los totales sin filtros de jornadas o fechas salen de las particiones precalculadas."
+    )
 
+if DEPURACION:
+    with st.sidebar.expander("🛠️ Depuración: tiempos por etapa"):
+        st.markdown("**Esta sesión**")
+        st.dataframe(tabla_metricas(registro.de_sesion(id_sesion()).resumen()), hide_index=True)
+        st.markdown("**Proceso**")
+        st.dataframe(tabla_metricas(registro.proceso.resumen()), hide_index=True)
+        st.markdown("**Cachés y memoria**")
+        st.json({nombre: fuente() for nombre, fuente in registro.fuentes.items()}, expanded=False)
+        col_json, col_prom = st.columns(2)
+        col_json.download_button("JSON", metricas.a_json(registro), "metricas.json", "application/json")
+        col_prom.download_button("Prometheus", metricas.a_prometheus(registro), "metricas.prom", "text/plain")
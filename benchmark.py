@@ -0,0 +1,187 @@
+"""Benchmark por etapas sobre temporadas sintéticas (ver sintetico.py).
+
+Mide por separado cada etapa del cálculo que hace la app, desde la lectura
+del CSV hasta la construcción y serialización de las figuras, en escenarios
+de distinto tamaño. Cada etapa se repite varias veces y se toma la mediana:
+
+    python benchmark.py --guardar-base      # registra la línea base
+    python benchmark.py                     # compara con la línea base
+
+Una etapa se marca como regresión si tarda más que la base en más de
+`--umbral` (20 % por defecto) y en más de `--minimo` milisegundos, para no
+dar por lentas etapas de microsegundos por ruido. Con regresiones termina con
+código 1, así que se puede usar en CI.
+"""
+import argparse
+import gc
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import plotly
+
+import motor
+import sintetico
+from graficos import figura_comparador, figura_equipo, figura_jugador
+from lote import agregador_por_nombre
+
+# Parámetros de sintetico.generar de cada escenario
+ESCENARIOS = {
+    "pequeno": {"temporadas": 1, "jugadores": 25, "por_partido": 11},
+    "mediano": {"temporadas": 5, "jugadores": 200, "por_partido": 25},
+    "grande": {"temporadas": 30, "jugadores": 2000, "por_partido": 100},
+}
+
+BASE = "benchmark_base.json"
+UMBRAL = 0.2    # Aumento relativo a partir del cual una etapa es una regresión
+MINIMO = 2.0    # Milisegundos de diferencia mínima para considerarla
+
+
+def medir(funcion, repeticiones):
+    # Devuelve (mediana en segundos, resultado de la última ejecución). La
+    # primera ejecución no cuenta: incluye importaciones y cachés en frío
+    funcion()
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos), resultado
+
+
+def medir_escenario(parametros, repeticiones=5, agregador=None):
+    # Tiempos de cada etapa; la entrada de cada etapa es la salida de la anterior
+    agregador = agregador or motor.AGREGADOR_PANDAS
+    buffer = io.StringIO()
+    sintetico.generar(**parametros).to_csv(buffer, index=False)
+    contenido = buffer.getvalue().encode()
+
+    tiempos = {}
+
+    def etapa(nombre, funcion):
+        tiempos[nombre], resultado = medir(funcion, repeticiones)
+        return resultado
+
+    crudo = etapa("ingesta", lambda: motor.leer_csv(io.BytesIO(contenido)))
+    df = etapa("validacion", lambda: motor.compactar(motor.validar_datos(crudo)))
+    celdas = etapa("celdas", lambda: motor.celdas_de(df))
+    etapa("jornadas", lambda: motor.construir_partidos(celdas))
+    modelo = etapa("modelo", lambda: motor.modelo_desde_celdas(celdas))
+
+    # Filtro habitual: todas las competiciones, primera vuelta de Liga
+    competiciones = sorted(modelo["partidos"]["COMPETICION"].unique())
+    jornadas = motor.rango_vuelta("Primera vuelta")
+    etapa("filtros", lambda: (
+        motor.filtrar_rangos(modelo["cubo"], modelo["indice_cubo"], competiciones, jornadas),
+        motor.filtrar_rangos(modelo["partidos"], modelo["indice_partidos"], competiciones, jornadas),
+    ))
+
+    # Las secciones trabajan sobre la temporada completa
+    cubo, partidos = modelo["cubo"], modelo["partidos"]
+    equipo, df_equipo = etapa("equipo", lambda: (
+        agregador.totales_equipo(partidos), agregador.calcular_equipo_por_partido(partidos),
+    ))
+    totales = etapa("totales", lambda: agregador.agregar_cubo(cubo, ["NOMBRE"]))
+    jugadores = list(totales.index[:2])
+    seleccion, tramos = etapa("comparador", lambda: motor.series_comparador(cubo, jugadores))
+    etapa("rivales", lambda: motor.matriz_rivales(cubo, agregador))
+    etapa("forma", lambda: motor.forma_reciente(cubo))
+    etapa("ranking_notas", lambda: motor.calcular_ranking_notas(totales, equipo))
+    etapa("ranking_ofensivo", lambda: motor.calcular_ranking_ofensivo(totales, equipo))
+    figuras = etapa("figuras", lambda: (
+        figura_equipo(df_equipo, "NOTA"),
+        figura_jugador(cubo[cubo["NOMBRE"] == jugadores[0]].sort_values("FECHA"), "NOTA"),
+        figura_comparador(seleccion, tramos, jugadores, "NOTA"),
+    ))
+    # Lo que hace st.plotly_chart con cada figura antes de enviarla al navegador
+    etapa("serializacion", lambda: [figura.to_json() for figura in figuras])
+    return {"parametros": parametros, "filas": len(crudo), "etapas": tiempos}
+
+
+def entorno():
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "plotly": plotly.__version__,
+        "maquina": platform.machine(),
+        "procesador": platform.processor(),
+    }
+
+
+def comparar(base, actual, umbral=UMBRAL, minimo=MINIMO):
+    # Devuelve las filas de la tabla (escenario, etapa, base, actual, cambio, regresión)
+    filas = []
+    for escenario, resultado in actual.items():
+        previo = base.get(escenario)
+        if previo and previo["parametros"] != resultado["parametros"]:
+            previo = None  # La base se midió con otro tamaño
+        for nombre, segundos in resultado["etapas"].items():
+            anterior = previo["etapas"].get(nombre) if previo else None
+            if anterior is None:
+                filas.append((escenario, nombre, None, segundos, None, False))
+                continue
+            cambio = segundos / anterior - 1 if anterior else 0.0
+            regresion = cambio > umbral and (segundos - anterior) * 1000 > minimo
+            filas.append((escenario, nombre, anterior, segundos, cambio, regresion))
+    return filas
+
+
+def imprimir(filas):
+    print(f"{'escenario':<10} {'etapa':<17} {'base ms':>10} {'actual ms':>10} {'cambio':>8}")
+    for escenario, nombre, anterior, segundos, cambio, regresion in filas:
+        base_ms = f"{anterior * 1000:.2f}" if anterior is not None else "-"
+        cambio_txt = f"{cambio:+.0%}" if cambio is not None else "-"
+        marca = "  REGRESIÓN" if regresion else ""
+        print(f"{escenario:<10} {nombre:<17} {base_ms:>10} {segundos * 1000:>10.2f} {cambio_txt:>8}{marca}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark por etapas con temporadas sintéticas.")
+    parser.add_argument("--escenarios", nargs="+", choices=list(ESCENARIOS), default=list(ESCENARIOS))
+    parser.add_argument("--repeticiones", type=int, default=5, help="ejecuciones por etapa (se toma la mediana)")
+    parser.add_argument("--agregador", choices=["pandas", "duckdb"], default="pandas", help="motor de agregación")
+    parser.add_argument("--base", default=BASE, help="archivo JSON con la línea base")
+    parser.add_argument("--guardar-base", action="store_true", help="guarda los tiempos como nueva línea base")
+    parser.add_argument("--umbral", type=float, default=UMBRAL, help="aumento relativo tolerado (0.2 = 20 %%)")
+    parser.add_argument("--minimo", type=float, default=MINIMO, help="diferencia mínima en ms para marcar regresión")
+    args = parser.parse_args(argv)
+
+    agregador = agregador_por_nombre(args.agregador)
+    actual = {}
+    for escenario in args.escenarios:
+        actual[escenario] = medir_escenario(ESCENARIOS[escenario], args.repeticiones, agregador)
+        print(f"{escenario}: {actual[escenario]['filas']} filas", file=sys.stderr)
+
+    try:
+        with open(args.base, encoding="utf-8") as f:
+            registro = json.load(f)
+    except (OSError, ValueError):
+        registro = {}
+    base = registro.get(args.agregador, {}).get("escenarios", {})
+
+    filas = comparar(base, actual, args.umbral, args.minimo)
+    imprimir(filas)
+
+    if args.guardar_base:
+        registro[args.agregador] = {"entorno": entorno(), "escenarios": {**base, **actual}}
+        with open(args.base, "w", encoding="utf-8") as f:
+            json.dump(registro, f, indent=2)
+        print(f"Línea base guardada en {args.base}")
+        return 0
+    if base and registro[args.agregador].get("entorno") != entorno():
+        print("Aviso: la línea base se midió en otro entorno", file=sys.stderr)
+    regresiones = sum(fila[-1] for fila in filas)
+    if regresiones:
+        print(f"{regresiones} etapas más lentas que la línea base")
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
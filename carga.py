@@ -0,0 +1,329 @@
+"""Prueba de carga de app.py con sesiones concurrentes (Streamlit AppTest).
+
+Cada sesión es un AppTest que ejecuta app.py en este mismo proceso, como
+hace el servidor de Streamlit con sus sesiones, así que todas comparten las
+cachés (st.cache_data / st.cache_resource) y la memoria. Cada sesión sigue un
+guion de interacciones al azar (competiciones, jugador de la sección 1,
+jugadores del comparador y tramo de la Liga) y se mide la duración de cada
+re-ejecución:
+
+    python carga.py --sesiones 1 4 8 16 --pasos 20
+    python carga.py --temporadas 10 --jugadores 500 --por-partido 40
+
+Por cada nivel de concurrencia se informa de los percentiles p50/p95/p99 de
+latencia y del pico de memoria residente del proceso. AppTest re-ejecuta el
+script completo en cada interacción (no solo el fragmento del widget), así que
+las latencias son una cota superior de las del navegador.
+
+Sin --temporadas se usa el archivo de ejemplo; con él, una temporada
+sintética (sintetico.py) guardada en un almacén temporal que las sesiones
+abren con ?temporada=<huella>.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+
+import almacen
+import sintetico
+from motor import compactar, preparar_datos
+
+try:
+    import streamlit
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest, app_test, local_script_runner
+    from streamlit.testing.v1.util import patch_config_options
+except ImportError:  # Versiones de Streamlit sin API de pruebas
+    AppTest = None
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+TIEMPO_MAXIMO = 120     # Segundos por re-ejecución antes de darla por fallida
+INTERVALO_MEMORIA = 0.05
+MAX_COMPARADOS = 6      # Jugadores en el comparador antes de volver a empezar
+# compartir_runtime() sustituye piezas internas de Streamlit (Runtime,
+# app_test, local_script_runner) que no forman parte de su API pública: solo
+# se ha comprobado con estas versiones
+VERSIONES_PROBADAS = ("1.65",)
+
+
+# -------------------------------
+# Memoria del proceso
+# -------------------------------
+def memoria_residente():
+    # Bytes de memoria residente (en Linux, la actual; en otros sistemas, el pico)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource  # No existe en Windows
+
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico if sys.platform == "darwin" else pico * 1024
+
+
+class PicoMemoria:
+    # Muestrea la memoria residente en segundo plano mientras dura el bloque
+    def __init__(self, intervalo=INTERVALO_MEMORIA):
+        self.intervalo = intervalo
+        self.inicial = self.pico = 0
+        self._parar = threading.Event()
+
+    def _muestrear(self):
+        while not self._parar.wait(self.intervalo):
+            self.pico = max(self.pico, memoria_residente())
+
+    def __enter__(self):
+        self.inicial = self.pico = memoria_residente()
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._hilo.join()
+        self.pico = max(self.pico, memoria_residente())
+
+
+# -------------------------------
+# Sesiones en paralelo
+# -------------------------------
+def version_probada():
+    # True si la versión instalada de Streamlit (mayor.menor) está en VERSIONES_PROBADAS
+    return ".".join(streamlit.__version__.split(".")[:2]) in VERSIONES_PROBADAS
+
+
+@contextlib.contextmanager
+def compartir_runtime():
+    # AppTest crea un Runtime simulado y activa la opción global.appTest en
+    # cada ejecución, y los deshace al acabar; también compila el script cada
+    # vez. Con varias sesiones en paralelo, una ejecución que termina dejaría
+    # a las demás sin Runtime ni opción. Como en el servidor real, dentro del
+    # bloque todas las sesiones comparten un Runtime (el último creado), la
+    # opción activa todo el tiempo y la caché del script compilado. Al salir
+    # se restauran los originales.
+    ultimo = []
+    instance, exists = Runtime.instance.__func__, Runtime.exists.__func__
+
+    def instancia(cls):
+        if cls._instance is not None:
+            ultimo[:] = [cls._instance]
+        return cls._instance or (ultimo[0] if ultimo else instance(cls))
+
+    script_cache = ScriptCache()
+    with contextlib.ExitStack() as pila:
+        pila.enter_context(mock.patch.object(Runtime, "instance", classmethod(instancia)))
+        pila.enter_context(mock.patch.object(Runtime, "exists", classmethod(lambda cls: exists(cls) or bool(ultimo))))
+        # Solo global.appTest; el resto de opciones se leen de la configuración real
+        pila.enter_context(patch_config_options({"global.appTest": True}))
+        pila.enter_context(mock.patch.object(app_test, "patch_config_options", lambda opciones: contextlib.nullcontext()))
+        for modulo in (app_test, local_script_runner):
+            pila.enter_context(mock.patch.object(modulo, "ScriptCache", lambda: script_cache))
+        yield
+
+
+@contextlib.contextmanager
+def sin_avisos():
+    # Los avisos de Streamlit fuera de `streamlit run` no aportan nada aquí;
+    # al salir se restaura el nivel desactivado que hubiera
+    anterior = logging.root.manager.disable
+    logging.disable(logging.WARNING)
+    try:
+        yield
+    finally:
+        logging.disable(anterior)
+
+
+@contextlib.contextmanager
+def almacen_temporal():
+    # Almacén en un directorio temporal, compartido con las sesiones por ser
+    # el mismo proceso; al salir se borra y se restaura el directorio anterior
+    with tempfile.TemporaryDirectory() as directorio, mock.patch.object(almacen, "DIRECTORIO_ALMACEN", directorio):
+        yield directorio
+
+
+# -------------------------------
+# Guiones de interacción
+# -------------------------------
+def widget(at, tipo, etiqueta):
+    # Widget por su etiqueta (None si no se muestra en esta ejecución)
+    for elemento in at.get(tipo):
+        if elemento.label == etiqueta:
+            return elemento
+    return None
+
+
+def cambiar_competiciones(at, rng):
+    selector = widget(at, "multiselect", "Selecciona las competiciones")
+    opciones = list(selector.options)
+    # La Liga casi siempre, para que también se usen los tramos
+    seleccion = [c for c in opciones if c != "Liga" and rng.random() < 0.5]
+    if "Liga" in opciones and (rng.random() < 0.8 or not seleccion):
+        seleccion.append("Liga")
+    selector.set_value(seleccion or opciones[:1])
+
+
+def cambiar_jugador(at, rng):
+    selector = widget(at, "selectbox", "Selecciona el jugador o Equipo General")
+    selector.set_value(rng.choice(list(selector.options)))
+
+
+def anadir_comparado(at, rng):
+    selector = widget(at, "multiselect", "Selecciona los jugadores a comparar")
+    actuales = list(selector.value)
+    libres = [j for j in selector.options if j not in actuales]
+    if len(actuales) >= MAX_COMPARADOS or not libres:
+        actuales = actuales[:1]
+    selector.set_value(actuales + [rng.choice(libres)] if libres else actuales)
+
+
+def cambiar_vuelta(at, rng):
+    selector = widget(at, "radio", "Selecciona el tramo de la Liga")
+    if selector is None:  # Sin Liga seleccionada no hay tramos
+        return cambiar_competiciones(at, rng)
+    selector.set_value(rng.choice(["Toda la Liga", "Primera vuelta", "Segunda vuelta"]))
+
+
+INTERACCIONES = {
+    "competiciones": cambiar_competiciones,
+    "jugador": cambiar_jugador,
+    "comparador": anadir_comparado,
+    "vuelta": cambiar_vuelta,
+}
+
+
+def ejecutar_sesion(indice, pasos, temporada, semilla, inicio, resultados):
+    # Una sesión: carga inicial y `pasos` interacciones al azar. Añade a
+    # `resultados` (interacción, segundos, error) por cada re-ejecución.
+    rng = random.Random(semilla * 10_000 + indice)
+    at = AppTest.from_file(RUTA_APP, default_timeout=TIEMPO_MAXIMO)
+    if temporada:
+        at.query_params["temporada"] = temporada
+    inicio.wait()
+
+    interaccion = "inicio"
+    for paso in range(pasos + 1):
+        if paso:
+            interaccion = rng.choice(list(INTERACCIONES))
+            try:
+                INTERACCIONES[interaccion](at, rng)
+            except AttributeError:  # La ejecución anterior no llegó a mostrar el widget
+                resultados.append((interaccion, np.nan, f"sin widget para «{interaccion}»"))
+                return
+        t0 = time.perf_counter()
+        try:
+            at.run()
+            error = str(at.exception[0].message) if at.exception else None
+        except Exception as e:  # Tiempo máximo superado o fallo del propio AppTest
+            error = f"{type(e).__name__}: {e}"
+        resultados.append((interaccion, time.perf_counter() - t0, error))
+        if error:
+            return
+
+
+def nivel_de_carga(sesiones, pasos, temporada=None, semilla=0):
+    # Ejecuta `sesiones` sesiones a la vez y devuelve sus métricas
+    resultados = []
+    inicio = threading.Barrier(sesiones)
+    hilos = [
+        threading.Thread(target=ejecutar_sesion, args=(i, pasos, temporada, semilla, inicio, resultados))
+        for i in range(sesiones)
+    ]
+    t0 = time.perf_counter()
+    with PicoMemoria() as memoria:
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+    duracion = time.perf_counter() - t0
+
+    # La carga inicial de cada sesión se mide aparte de las interacciones
+    latencias = np.array([s for interaccion, s, error in resultados if interaccion != "inicio" and not error])
+    iniciales = np.array([s for interaccion, s, error in resultados if interaccion == "inicio" and not error])
+    p50, p95, p99 = np.percentile(latencias, [50, 95, 99]) if len(latencias) else (np.nan,) * 3
+    return {
+        "sesiones": sesiones,
+        "reejecuciones": len(latencias),
+        "errores": [error for _, _, error in resultados if error],
+        "inicio_p50": float(np.median(iniciales)) if len(iniciales) else np.nan,
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "por_segundo": len(resultados) / duracion,
+        "memoria_pico": memoria.pico,
+        "memoria_inicial": memoria.inicial,
+    }
+
+
+def preparar_temporada(parametros, directorio):
+    # Guarda una temporada sintética en el almacén y devuelve su huella
+    buffer = io.StringIO()
+    sintetico.generar(**parametros).to_csv(buffer, index=False)
+    contenido = buffer.getvalue().encode()
+    huella = hashlib.sha256(contenido).hexdigest()
+    df = compactar(preparar_datos(io.BytesIO(contenido)))
+    almacen.guardar(huella, df, directorio, nombre=f"sintética ({len(df)} filas)")
+    return huella
+
+
+def imprimir(metricas):
+    print(f"{'sesiones':>8} {'reejec.':>8} {'errores':>8} {'inicio ms':>10} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'reejec./s':>10} {'pico MB':>9} {'Δ MB':>7}")
+    for m in metricas:
+        print(
+            f"{m['sesiones']:>8} {m['reejecuciones']:>8} {len(m['errores']):>8} {m['inicio_p50'] * 1000:>10.0f} "
+            f"{m['p50'] * 1000:>9.0f} {m['p95'] * 1000:>9.0f} {m['p99'] * 1000:>9.0f} {m['por_segundo']:>10.1f} "
+            f"{m['memoria_pico'] / 2**20:>9.0f} {(m['memoria_pico'] - m['memoria_inicial']) / 2**20:>7.0f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga de app.py con sesiones concurrentes.")
+    parser.add_argument("--sesiones", nargs="+", type=int, default=[1, 2, 4, 8], help="niveles de concurrencia")
+    parser.add_argument("--pasos", type=int, default=10, help="interacciones por sesión")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--temporadas", type=int, default=None, help="usar una temporada sintética de este tamaño")
+    parser.add_argument("--jugadores", type=int, default=25)
+    parser.add_argument("--por-partido", type=int, default=11)
+    args = parser.parse_args(argv)
+
+    if AppTest is None:
+        print("Esta versión de Streamlit no incluye streamlit.testing")
+        return 2
+    if not version_probada():
+        print(
+            f"Aviso: carga.py solo se ha probado con Streamlit {', '.join(VERSIONES_PROBADAS)} "
+            f"(instalada: {streamlit.__version__}); las sesiones concurrentes pueden fallar",
+            file=sys.stderr,
+        )
+    with compartir_runtime(), sin_avisos(), almacen_temporal() as directorio:
+        temporada = None
+        if args.temporadas:
+            temporada = preparar_temporada(
+                {"temporadas": args.temporadas, "jugadores": args.jugadores, "por_partido": args.por_partido},
+                directorio,
+            )
+        # Calentamiento sin medir: compila el script y llena las cachés
+        # compartidas, como en un servidor que ya ha atendido a alguien
+        nivel_de_carga(1, 0, temporada, args.semilla)
+        metricas = []
+        for sesiones in args.sesiones:
+            metricas.append(nivel_de_carga(sesiones, args.pasos, temporada, args.semilla))
+            for error in sorted(set(metricas[-1]["errores"])):
+                print(f"  error con {sesiones} sesiones: {error}", file=sys.stderr)
+    imprimir(metricas)
+    return 1 if any(m["errores"] for m in metricas) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
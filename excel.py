@@ -0,0 +1,362 @@
+"""Lectura en streaming de la plantilla de Excel (.xlsx), sin dependencias.
+
+Un .xlsx es un zip con una hoja en XML. La hoja se descomprime por trozos y
+se pasa al parser XML de la biblioteca estándar con un destino propio
+(CeldasHoja) que no crea un elemento por celda: de cada una solo se guardan
+su fila, su columna, su tipo y su texto, y cada FILAS_POR_BLOQUE filas las
+columnas se montan con numpy (openpyxl tarda varias veces más en el mismo
+archivo). Los demás XML del libro, pequeños, se leen con iterparse. Cada bloque sale con
+las columnas de la cabecera, de modo que a partir de ahí el archivo pasa por
+la misma validación, ingesta por bloques y caché que un CSV.
+
+Se lee la primera hoja del libro. Los atributos de las celdas pueden venir en
+cualquier orden y la referencia (r="B7") puede faltar: entonces la celda es
+la siguiente a la anterior de su fila. Los textos pueden venir en la tabla de
+textos compartidos o en la propia celda (también con formato, <is><r><t>), y
+las fechas como número de serie de Excel (sistema 1900 o 1904, según el
+libro) o como texto, igual que en el CSV. Las filas vacías de la hoja se
+saltan, pero cada fila conserva su número en la hoja (el índice FILA de los
+bloques), que es el que da el informe de errores.
+
+Un zip que no es un libro de Excel (le faltan partes, sus XML no se pueden
+leer o no enlazan la hoja) lanza ArchivoInvalido, como un CSV mal formado.
+"""
+import io
+import posixpath
+import re
+import zipfile
+import zlib
+from xml.etree.ElementTree import ParseError, XMLParser, iterparse
+
+import numpy as np
+import pandas as pd
+
+from motor import COLUMNAS_CATEGORICAS, TAM_BLOQUE, UMBRAL_INGESTA_POR_BLOQUES, ArchivoInvalido
+
+FIRMA = b"PK\x03\x04"          # Los .xlsx son archivos zip
+FILAS_POR_BLOQUE = TAM_BLOQUE  # Filas de la hoja por bloque
+TAM_LECTURA = 1024 * 1024      # Bytes de XML de la hoja que se pasan al parser de cada vez
+COLUMNAS_FECHA = ["FECHA"]     # Columnas con números de serie de fecha
+ORIGEN_FECHAS = "1899-12-30"   # Día 0 de los números de serie de Excel (sistema 1900)
+ORIGEN_FECHAS_1904 = "1904-01-01"  # Día 0 en los libros con date1904 (Excel de Mac antiguo)
+# Comprimido ocupa algo menos que el CSV, pero su XML unas 7 veces más:
+# se pasa antes a la ingesta por bloques
+UMBRAL_POR_BLOQUES = UMBRAL_INGESTA_POR_BLOQUES // 2
+
+DIMENSION = re.compile(rb'dimension ref="[A-Z]+\d+:[A-Z]+(\d+)"')
+
+
+def es_excel(contenido):
+    return contenido[:4] == FIRMA
+
+
+def indice_columna(letras):
+    # "A" -> 0, "Z" -> 25, "AA" -> 26...
+    indice = 0
+    for letra in letras:
+        indice = indice * 26 + ord(letra) - 64
+    return indice - 1
+
+
+# Errores al descomprimir una parte dañada del zip
+ERRORES_ZIP = (zipfile.BadZipFile, zlib.error, EOFError)
+
+
+def _abrir(origen):
+    try:
+        return zipfile.ZipFile(origen)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ArchivoInvalido("Archivo Excel inválido. No se puede abrir como .xlsx.") from e
+
+
+def _parte(libro, ruta):
+    # Una parte del libro (un XML del zip); si falta, el zip no es un .xlsx
+    try:
+        return libro.open(ruta)
+    except KeyError as e:
+        raise ArchivoInvalido(f"Archivo Excel inválido. No es un libro de Excel (falta {ruta}).") from e
+
+
+def _elementos(libro, ruta):
+    # (evento, elemento) de una parte pequeña del libro con iterparse
+    with _parte(libro, ruta) as f:
+        try:
+            yield from iterparse(f)
+        except ParseError as e:
+            raise ArchivoInvalido(f"Archivo Excel inválido. {ruta} no es un XML válido.") from e
+        except ERRORES_ZIP as e:
+            raise ArchivoInvalido(f"Archivo Excel inválido. {ruta} está dañado.") from e
+
+
+def _local(etiqueta):
+    # Nombre de la etiqueta sin el espacio de nombres ("{...}c" -> "c")
+    return etiqueta.rsplit("}", 1)[-1]
+
+
+def _texto(elemento):
+    # Texto de un <si> o un <is>: el <t> directo o los de cada tramo con
+    # formato (<r><t>); las guías fonéticas (<rPh>) no son parte del texto
+    partes = []
+    for hijo in elemento:
+        nombre = _local(hijo.tag)
+        if nombre == "t":
+            partes.append(hijo.text or "")
+        elif nombre == "r":
+            partes.extend(t.text or "" for t in hijo if _local(t.tag) == "t")
+    return "".join(partes)
+
+
+def textos_compartidos(libro):
+    # Tabla de textos compartidos (uno por texto distinto, no por celda)
+    if "xl/sharedStrings.xml" not in libro.namelist():
+        return np.array([], dtype=object)
+    textos = []
+    for _evento, elemento in _elementos(libro, "xl/sharedStrings.xml"):
+        if _local(elemento.tag) == "si":
+            textos.append(_texto(elemento))
+            elemento.clear()
+    return np.array(textos, dtype=object)
+
+
+def libro_de(libro):
+    # (ruta de la primera hoja, día 0 de las fechas). workbook.xml da el orden
+    # de las hojas, sus relaciones (la ruta de cada una) y el sistema de fechas.
+    hojas = []
+    origen_fechas = ORIGEN_FECHAS
+    for _evento, elemento in _elementos(libro, "xl/workbook.xml"):
+        nombre = _local(elemento.tag)
+        if nombre == "sheet":
+            hojas.append(elemento)
+        elif nombre == "workbookPr" and elemento.get("date1904", "").lower() in ("1", "true"):
+            origen_fechas = ORIGEN_FECHAS_1904
+    if not hojas:
+        raise ArchivoInvalido("Archivo Excel inválido. El libro no tiene hojas.")
+    id_relacion = next((v for k, v in hojas[0].attrib.items() if _local(k) == "id"), None)
+    destinos = {
+        e.get("Id"): e.get("Target") for _evento, e in _elementos(libro, "xl/_rels/workbook.xml.rels") if e.get("Id")
+    }
+    destino = destinos.get(id_relacion)
+    if not destino:
+        raise ArchivoInvalido("Archivo Excel inválido. No se encuentra la primera hoja del libro.")
+    ruta = destino.lstrip("/") if destino.startswith("/") else posixpath.normpath(posixpath.join("xl", destino))
+    return ruta, origen_fechas
+
+
+def ruta_primera_hoja(libro):
+    return libro_de(libro)[0]
+
+
+class CeldasHoja:
+    """Destino del parser de la hoja (XMLParser(target=...)).
+
+    Recibe etiquetas y texto sin crear un elemento por celda y guarda cada
+    celda con valor en cuatro listas: fila, índice de columna, tipo y texto.
+    """
+
+    def __init__(self):
+        self.filas, self.columnas, self.tipos, self.valores = [], [], [], []
+        self.fin_fila = 0       # Celdas de las filas ya cerradas
+        self.filas_cerradas = 0
+        self.fila = 0
+        self.columna = -1
+        self.tipo = "n"
+        self.texto = None       # Partes del <v> o <t> en curso (None fuera de ellos)
+        self.en_linea = None    # Partes de un <is> en curso
+        self.fonetica = False
+        self.indices = {}       # Letras de columna ya vistas -> índice
+        self.etiquetas = None
+
+    def start(self, etiqueta, atributos):
+        if self.etiquetas is None:
+            # Etiquetas completas con el espacio de nombres de la hoja
+            espacio = etiqueta[:etiqueta.find("}") + 1]
+            self.etiquetas = [espacio + nombre for nombre in ("row", "c", "v", "t", "is", "rPh")]
+        fila, celda, valor, texto, en_linea, fonetica = self.etiquetas
+        if etiqueta == celda:
+            referencia = atributos.get("r")
+            if referencia:
+                letras = referencia.rstrip("0123456789")
+                indice = self.indices.get(letras)
+                if indice is None:
+                    indice = self.indices[letras] = indice_columna(letras)
+                self.columna = indice
+            else:
+                self.columna += 1
+            self.tipo = atributos.get("t", "n")
+        elif etiqueta == valor:
+            self.texto = []
+        elif etiqueta == texto and self.en_linea is not None and not self.fonetica:
+            self.texto = self.en_linea
+        elif etiqueta == en_linea:
+            self.en_linea = []
+        elif etiqueta == fonetica:
+            self.fonetica = True
+        elif etiqueta == fila:
+            referencia = atributos.get("r")
+            self.fila = int(referencia) if referencia else self.fila + 1
+            self.columna = -1
+
+    def data(self, datos):
+        if self.texto is not None:
+            self.texto.append(datos)
+
+    def end(self, etiqueta):
+        fila, _celda, valor, texto, en_linea, fonetica = self.etiquetas
+        if etiqueta == valor:
+            self._anadir("".join(self.texto))
+            self.texto = None
+        elif etiqueta == texto:
+            self.texto = None
+        elif etiqueta == en_linea:
+            self._anadir("".join(self.en_linea))
+            self.en_linea = None
+        elif etiqueta == fonetica:
+            self.fonetica = False
+        elif etiqueta == fila:
+            self.fin_fila = len(self.filas)
+            self.filas_cerradas += 1
+
+    def close(self):
+        pass
+
+    def _anadir(self, valor):
+        self.filas.append(self.fila)
+        self.columnas.append(self.columna)
+        self.tipos.append(self.tipo)
+        self.valores.append(valor)
+
+    def sacar(self):
+        # Celdas de las filas ya cerradas como arrays; las de una fila a
+        # medias se quedan para el bloque siguiente
+        fin = self.fin_fila
+        celdas = (
+            np.array(self.filas[:fin], dtype=np.int64),
+            np.array(self.columnas[:fin], dtype=np.int64),
+            np.array(self.tipos[:fin], dtype=object),
+            np.array(self.valores[:fin], dtype=object),
+        )
+        for lista in (self.filas, self.columnas, self.tipos, self.valores):
+            del lista[:fin]
+        self.fin_fila = self.filas_cerradas = 0
+        return celdas
+
+
+def filas_de_hoja(hoja, filas_por_bloque=FILAS_POR_BLOQUE):
+    # Celdas con valor de la hoja en bloques de filas completas: cada bloque es
+    # (filas, índices de columna, tipos, textos). La hoja se descomprime y se
+    # pasa al parser por trozos de TAM_LECTURA bytes.
+    destino = CeldasHoja()
+    parser = XMLParser(target=destino)
+    try:
+        while True:
+            datos = hoja.read(TAM_LECTURA)
+            if not datos:
+                break
+            parser.feed(datos)
+            if destino.filas_cerradas >= filas_por_bloque and destino.fin_fila:
+                yield destino.sacar()
+        parser.close()
+    except ParseError as e:
+        raise ArchivoInvalido("Archivo Excel inválido. La hoja no es un XML válido.") from e
+    except ERRORES_ZIP as e:
+        raise ArchivoInvalido("Archivo Excel inválido. La hoja está dañada.") from e
+    if destino.fin_fila:
+        yield destino.sacar()
+
+
+def columna(tipos, valores, textos):
+    # Valores de una columna a partir del texto de sus celdas: números como
+    # float64 si todas son numéricas; si no, objetos (textos, números, None)
+    numericas = (tipos == "n") & (valores != "")
+    try:
+        if numericas.all():
+            return valores.astype(np.float64)
+        resultado = np.full(len(tipos), None, dtype=object)
+        resultado[numericas] = valores[numericas].astype(np.float64)
+        compartidas = tipos == "s"
+        if compartidas.any():
+            resultado[compartidas] = textos[valores[compartidas].astype(np.int64)]
+    except (ValueError, IndexError) as e:
+        # Números que no lo son o textos compartidos que no existen
+        raise ArchivoInvalido("Archivo Excel inválido. La hoja tiene celdas con valores no válidos.") from e
+    for tipo in ("inlineStr", "str", "d", "e"):
+        mascara = tipos == tipo
+        if mascara.any():
+            resultado[mascara] = valores[mascara]
+    booleanas = tipos == "b"
+    if booleanas.any():
+        resultado[booleanas] = valores[booleanas].astype(np.int64)
+    return resultado
+
+
+def bloque_de(celdas, textos, columnas, origen_fechas=ORIGEN_FECHAS):
+    # DataFrame de las celdas de un bloque; `columnas` es {índice de columna: nombre}.
+    # El índice (FILA) es el número de cada fila en la hoja, sin las vacías
+    filas, indices, tipos, valores = celdas
+    primera = filas.min()
+    n = filas.max() - primera + 1
+    datos = {}
+    for indice, nombre in columnas.items():
+        mascara = indices == indice
+        valores_columna = np.full(n, None, dtype=object)
+        if mascara.any():
+            convertidos = columna(tipos[mascara], valores[mascara], textos)
+            if convertidos.dtype == np.float64 and mascara.sum() == n:
+                valores_columna = np.empty(n)
+            valores_columna[filas[mascara] - primera] = convertidos
+        datos[nombre] = valores_columna
+    filas_hoja = pd.RangeIndex(primera, primera + n, name="FILA")
+    bloque = pd.DataFrame(datos, index=filas_hoja).dropna(how="all").infer_objects()
+    for nombre in COLUMNAS_FECHA:
+        # Números de serie a fechas (sin la hora); las fechas escritas como texto se dejan igual
+        serie = pd.to_numeric(bloque[nombre], errors="coerce") if nombre in bloque.columns else None
+        if serie is not None and serie.notna().any():
+            fechas = pd.to_datetime(np.floor(serie), unit="D", origin=origen_fechas)
+            bloque[nombre] = fechas if serie.notna().all() else bloque[nombre].astype(object).where(serie.isna(), fechas)
+    return bloque
+
+
+def bloques(origen, filas_por_bloque=FILAS_POR_BLOQUE):
+    # Bloques de filas (DataFrames) de la primera hoja, con las columnas de la cabecera
+    libro = _abrir(origen)
+    with libro:
+        textos = textos_compartidos(libro)
+        ruta, origen_fechas = libro_de(libro)
+        with _parte(libro, ruta) as hoja:
+            columnas = None
+            for celdas in filas_de_hoja(hoja, filas_por_bloque):
+                if columnas is None:
+                    # La cabecera es la primera fila con celdas (las primeras del XML)
+                    n = int(np.argmax(celdas[0] != celdas[0][0])) or len(celdas[0])
+                    cabecera, celdas = [c[:n] for c in celdas], [c[n:] for c in celdas]
+                    nombres = columna(cabecera[2], cabecera[3], textos)
+                    columnas = {
+                        int(indice): str(nombre).strip() for indice, nombre in zip(cabecera[1], nombres)
+                        if nombre is not None
+                    }
+                if len(celdas[0]):
+                    yield bloque_de(celdas, textos, columnas, origen_fechas)
+
+
+def leer_excel(origen):
+    # Hoja completa como DataFrame, con los textos repetidos como categóricos
+    # (como leer_csv) y el número de fila en la hoja como índice (FILA)
+    partes = list(bloques(origen))
+    if not partes:
+        raise ArchivoInvalido("Archivo Excel inválido. La primera hoja está vacía.")
+    df = pd.concat(partes)
+    for nombre in COLUMNAS_CATEGORICAS:
+        if nombre in df.columns:
+            df[nombre] = df[nombre].astype("category")
+    return df
+
+
+def filas(contenido):
+    # Filas de la primera hoja según su dimensión (None si el archivo no la indica)
+    libro = _abrir(io.BytesIO(contenido))
+    with libro, _parte(libro, ruta_primera_hoja(libro)) as hoja:
+        try:
+            encontrada = DIMENSION.search(hoja.read(4096))
+        except ERRORES_ZIP as e:
+            raise ArchivoInvalido("Archivo Excel inválido. La hoja está dañada.") from e
+    return int(encontrada.group(1)) - 1 if encontrada else None
@@ -0,0 +1,177 @@
+"""Figuras de Plotly de la app (sin Streamlit, para poder medirlas aparte).
+
+Las series se envían al navegador en el formato más compacto que entiende
+Plotly: las fechas como milisegundos (float64) sobre un eje de fechas, el valor
+y los datos numéricos del tooltip como arrays tipados (que se serializan en
+binario) y las etiquetas (competición y rival) aparte, en `text` y
+`hovertext`. Las series con más de MAX_PUNTOS_TRAZA puntos se reducen con
+LTTB, que conserva la forma de la curva (picos y valles), y a partir de
+UMBRAL_WEBGL puntos se dibujan con WebGL.
+"""
+import numpy as np
+import plotly.graph_objects as go
+
+UMBRAL_WEBGL = 1000       # Puntos de la figura a partir de los cuales se usa Scattergl
+MAX_PUNTOS_TRAZA = 1000   # Puntos por serie por encima de los cuales se reduce con LTTB
+
+# Datos numéricos del tooltip: etiqueta y formato (d3-format) de cada columna
+HOVER_NUMERICO = {
+    "GOLES_EN_CONTRA": ("Goles en contra", ":d"),
+    "GOLES": ("Goles", ":d"),
+    "ASISTENCIAS": ("Asistencias", ":d"),
+    "G/A": ("G/A", ":d"),
+    "MINS_JUGADOS": ("Mins jugados", ":d"),
+    "NOTA": ("Nota", ":.2f"),
+}
+# Estadísticas del mapa de calor por rival: etiqueta, formato y escala de color
+METRICAS_RIVALES = {
+    "NOTA_MEDIA": ("Nota media", ":.2f", "RdYlGn"),
+    "G/A": ("G/A", ":d", "Greens"),
+    "MINUTOS_TOTALES": ("Minutos", ":d", "Blues"),
+}
+HOVER_EQUIPO = ["GOLES_EN_CONTRA", "GOLES", "ASISTENCIAS", "G/A", "NOTA"]
+HOVER_JUGADOR = ["GOLES_EN_CONTRA", "GOLES", "ASISTENCIAS", "G/A", "MINS_JUGADOS", "NOTA"]
+
+
+def plantilla_hover(columnas):
+    return "<br>".join(
+        ["Competición: %{text}", "Rival: %{hovertext}"]
+        + [f"{HOVER_NUMERICO[c][0]}: %{{customdata[{i}]{HOVER_NUMERICO[c][1]}}}" for i, c in enumerate(columnas)]
+    )
+
+
+def lttb(x, y, n):
+    # Índices de los `n` puntos que conserva Largest-Triangle-Three-Buckets: el
+    # primero, el último y, en cada cubeta intermedia, el que forma el
+    # triángulo de mayor área con el elegido en la anterior y la media de la
+    # siguiente. `x` debe estar ordenado.
+    total = len(x)
+    if n >= total or n < 3:
+        return np.arange(total)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+
+    # n - 2 cubetas entre el primer y el último punto (ninguna vacía: paso >= 1)
+    limites = np.linspace(1, total - 1, n - 1).astype(np.int64)
+    tamanos = np.diff(limites)
+    medias_x = np.add.reduceat(x[:-1], limites[:-1]) / tamanos
+    medias_y = np.add.reduceat(y[:-1], limites[:-1]) / tamanos
+
+    indices = np.empty(n, dtype=np.int64)
+    indices[0], indices[-1] = 0, total - 1
+    a = 0
+    for i in range(n - 2):
+        inicio, fin = limites[i], limites[i + 1]
+        cx, cy = (medias_x[i + 1], medias_y[i + 1]) if i + 3 < n else (x[-1], y[-1])
+        areas = np.abs((x[a] - cx) * (y[inicio:fin] - y[a]) - (x[a] - x[inicio:fin]) * (cy - y[a]))
+        a = inicio + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+
+def columnas_serie(df, tipo_stat, columnas):
+    # Arrays de una serie (o de varias seguidas): x en ms, y y datos numéricos
+    # del tooltip tipados (float32 para decimales) y etiquetas como texto
+    y = df[tipo_stat].to_numpy()
+    return {
+        "x": df["FECHA"].to_numpy().astype("datetime64[ms]").astype(np.float64),
+        "y": y.astype(np.float32) if y.dtype.kind == "f" else y,
+        "customdata": df[columnas].to_numpy(dtype=np.float32),
+        "text": df["COMPETICION"].to_numpy(dtype=object),
+        "hovertext": df["RIVAL"].to_numpy(dtype=object),
+    }
+
+
+def traza(serie, columnas, webgl=False, inicio=0, fin=None, max_puntos=MAX_PUNTOS_TRAZA, **opciones):
+    # Traza con las filas [inicio, fin) de `serie`, reducida con LTTB si hace falta
+    tramo = {clave: valores[inicio:fin] for clave, valores in serie.items()}
+    if len(tramo["x"]) > max_puntos:
+        indices = lttb(tramo["x"], tramo["y"], max_puntos)
+        tramo = {clave: valores[indices] for clave, valores in tramo.items()}
+    Traza = go.Scattergl if webgl else go.Scatter
+    return Traza(mode="lines+markers", hovertemplate=plantilla_hover(columnas), **tramo, **opciones)
+
+
+def _serie(df, tipo_stat, columnas):
+    fig = go.Figure(traza(columnas_serie(df, tipo_stat, columnas), columnas, webgl=len(df) > UMBRAL_WEBGL))
+    fig.update_layout(
+        xaxis_title="MESES",
+        xaxis_type="date",
+        yaxis_title=tipo_stat,
+        hovermode="x unified"
+    )
+    return fig
+
+
+def figura_equipo(df_equipo, tipo_stat):
+    # Sección 1: serie del equipo partido a partido
+    return _serie(df_equipo, tipo_stat, HOVER_EQUIPO)
+
+
+def figura_jugador(df_jugador, tipo_stat):
+    # Sección 1: serie de un jugador (filas del cubo ordenadas por fecha)
+    return _serie(df_jugador, tipo_stat, HOVER_JUGADOR)
+
+
+def figura_comparador(seleccion, tramos, jugadores, tipo_comparar):
+    # Sección 2: una traza por jugador a partir de motor.series_comparador
+    serie = columnas_serie(seleccion, tipo_comparar, HOVER_JUGADOR)
+
+    # Con muchas series o temporadas largas se renderiza con WebGL
+    webgl = len(seleccion) > UMBRAL_WEBGL
+
+    fig = go.Figure()
+    for j in jugadores:
+        inicio, fin = tramos.get(j, (0, 0))
+        fig.add_trace(traza(serie, HOVER_JUGADOR, webgl, inicio, fin, name=j))
+
+    fig.update_layout(
+        title=f"Comparativa de {tipo_comparar} entre jugadores",
+        xaxis_title="MESES",
+        xaxis_type="date",
+        yaxis_title=tipo_comparar,
+        hovermode="x",
+    )
+    return fig
+
+
+def figura_rivales(valores, partidos, metrica):
+    # Sección 5: mapa de calor jugador × rival. `valores` y `partidos` son
+    # tablas jugadores × rivales (motor.tabla_rivales); las celdas vacías son
+    # rivales contra los que el jugador no ha jugado
+    etiqueta, formato, escala = METRICAS_RIVALES[metrica]
+    fig = go.Figure(go.Heatmap(
+        z=valores.to_numpy(dtype=np.float32),
+        x=valores.columns.astype(str).to_numpy(dtype=object),
+        y=valores.index.astype(str).to_numpy(dtype=object),
+        customdata=partidos.fillna(0).to_numpy(dtype=np.float32),
+        colorscale=escala,
+        hoverongaps=False,
+        hovertemplate=f"%{{y}} vs %{{x}}<br>{etiqueta}: %{{z{formato}}}<br>Partidos: %{{customdata:d}}<extra></extra>",
+    ))
+    fig.update_layout(
+        xaxis_title="RIVAL",
+        yaxis_autorange="reversed",
+        height=max(400, 22 * len(valores) + 150),
+    )
+    return fig
+
+
+def figura_forma(serie, tramos, jugadores, columna, ventana):
+    # Sección 5: forma reciente de cada jugador a partir de motor.forma_reciente
+    # (cada jugador es un tramo contiguo de `serie`)
+    webgl = sum(fin - inicio for inicio, fin in (tramos.get(j, (0, 0)) for j in jugadores)) > UMBRAL_WEBGL
+
+    fig = go.Figure()
+    for j in jugadores:
+        inicio, fin = tramos.get(j, (0, 0))
+        fig.add_trace(traza(columnas_serie(serie.iloc[inicio:fin], columna, HOVER_JUGADOR), HOVER_JUGADOR, webgl, name=j))
+
+    fig.update_layout(
+        title=f"{columna.removesuffix('_FORMA')} en los últimos {ventana} partidos",
+        xaxis_title="MESES",
+        xaxis_type="date",
+        yaxis_title=columna,
+        hovermode="x",
+    )
+    return fig
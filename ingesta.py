@@ -0,0 +1,226 @@
+"""Ingesta en segundo plano de los archivos subidos.
+
+Leer, validar y agregar un archivo grande lleva segundos, y si se hace en el
+hilo del script la página se queda girando sin más. Aquí cada archivo se
+procesa en un hilo de un pool compartido por el proceso: los resultados se
+quedan en memoria sin copiarlos entre procesos y pandas libera el GIL en buena
+parte de la lectura y las agregaciones. La tarea publica la etapa en curso y
+su avance; el script solo la consulta en cada ejecución.
+
+Las tareas se identifican por la huella del archivo, así que varias sesiones
+que suben el mismo archivo comparten una. Cuando una sesión recoge el
+resultado, la tarea se retira (`retirar`) y los datos pasan a la memoria de
+las sesiones, donde se cuentan una vez por huella; las terminadas que nadie
+recoge se conservan un tiempo. Una tarea en curso se cancela cuando ya
+no la espera ninguna sesión (p. ej. porque el usuario ha subido otro
+archivo); la cancelación se comprueba entre etapas y entre bloques.
+"""
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import almacen
+import excel
+from motor import (
+    UMBRAL_INGESTA_POR_BLOQUES, calcular_agregados, compactar, construir_cubo, ingerir_bloques,
+    ingerir_por_bloques, leer_csv, validar_datos,
+)
+
+logger = logging.getLogger(__name__)
+
+HILOS = 2                # Archivos procesados a la vez en el proceso
+MAX_TERMINADAS = 16      # Tareas terminadas que se conservan (las menos recientes se descartan)
+TTL_TERMINADAS = 60 * 60  # Segundos que se conserva una tarea terminada
+
+# Etapas en orden: texto para la barra de progreso y avance al empezarla
+ETAPAS = {
+    "cola": ("En cola", 0.0),
+    "almacen": ("Buscando la temporada guardada", 0.02),
+    "lectura": ("Leyendo el archivo", 0.05),
+    "validacion": ("Validando las filas", 0.35),
+    "modelo": ("Construyendo el cubo jugador × partido", 0.55),
+    "rankings": ("Calculando los rankings", 0.75),
+    "lista": ("Lista", 1.0),
+}
+
+
+class Cancelada(Exception):
+    """La tarea se canceló antes de terminar."""
+
+
+class Tarea:
+    """Ingesta de un archivo: etapa, avance y resultado (un concurrent.futures.Future)."""
+
+    def __init__(self, huella, nombre=None):
+        self.huella = huella
+        self.nombre = nombre
+        self.etapa = "cola"
+        self.progreso = 0.0
+        self.sesiones = set()
+        self.futuro = None
+        self.terminada_en = None
+        self._cancelada = threading.Event()
+
+    def avanzar(self, etapa, progreso=None):
+        # Lo llama el hilo de trabajo; si la tarea se ha cancelado, la interrumpe
+        if self._cancelada.is_set():
+            raise Cancelada(self.huella)
+        self.etapa = etapa
+        self.progreso = ETAPAS[etapa][1] if progreso is None else progreso
+
+    def cancelar(self):
+        self._cancelada.set()
+        if self.futuro is not None:
+            self.futuro.cancel()
+
+    @property
+    def cancelada(self):
+        return self._cancelada.is_set()
+
+    @property
+    def terminada(self):
+        return self.futuro is not None and self.futuro.done()
+
+    @property
+    def texto(self):
+        return ETAPAS[self.etapa][0]
+
+    def resultado(self):
+        return self.futuro.result()
+
+
+def leer(contenido):
+    # Filas crudas de un CSV o de un Excel (.xlsx), según el contenido
+    if excel.es_excel(contenido):
+        return excel.leer_excel(io.BytesIO(contenido))
+    return leer_csv(io.BytesIO(contenido))
+
+
+def procesar(tarea, contenido, agregador=None, medir=None, umbral_bloques=None):
+    # Modelo y agregados sin filtros del archivo, avanzando la tarea en cada
+    # etapa. `medir(nombre)` devuelve un context manager que mide cada paso.
+    medir = medir or (lambda nombre: nullcontext())
+    es_excel = excel.es_excel(contenido)
+    if umbral_bloques is None:
+        umbral_bloques = excel.UMBRAL_POR_BLOQUES if es_excel else UMBRAL_INGESTA_POR_BLOQUES
+    tarea.avanzar("almacen")
+    # Temporada ya convertida en otra sesión o ejecución: lectura con memory-map
+    with medir("carga_almacen"):
+        df = almacen.cargar(tarea.huella)
+
+    if df is None and len(contenido) >= umbral_bloques:
+        # Los archivos grandes se procesan por bloques y nunca se materializan
+        # como un DataFrame completo; el avance es el de las filas leídas (en
+        # un Excel sin dimensión de la hoja no se conoce el total)
+        tarea.avanzar("lectura")
+        inicio, fin = ETAPAS["lectura"][1], ETAPAS["rankings"][1]
+        filas = excel.filas(contenido) if es_excel else max(1, contenido.count(b"\n"))
+
+        def progreso(leidas):
+            tarea.avanzar("lectura", inicio + (fin - inicio) * min(1.0, leidas / filas) if filas else None)
+
+        # Cada bloque validado se escribe en el almacén; la temporada solo se
+        # publica si se han validado todos
+        with medir("carga_por_bloques"), almacen.Escritura(tarea.huella, nombre=tarea.nombre) as escritura:
+            if es_excel:
+                modelo = ingerir_bloques(excel.bloques(io.BytesIO(contenido)), progreso, escritura.anadir)
+            else:
+                modelo = ingerir_por_bloques(io.BytesIO(contenido), progreso=progreso, al_validar=escritura.anadir)
+    else:
+        if df is None:
+            tarea.avanzar("lectura")
+            with medir("carga"):
+                df = leer(contenido)
+            tarea.avanzar("validacion")
+            with medir("validacion"):
+                df = compactar(validar_datos(df))
+            almacen.guardar(tarea.huella, df, nombre=tarea.nombre)
+        tarea.avanzar("modelo")
+        with medir("modelo"):
+            modelo = construir_cubo(df)
+
+    tarea.avanzar("rankings")
+    competiciones = sorted(modelo["partidos"]["COMPETICION"].unique())
+    with medir("agregados_completos"):
+        agregados = calcular_agregados(modelo, competiciones, agregador=agregador, medir=medir)
+    tarea.avanzar("lista")
+    return {"huella": tarea.huella, "modelo": modelo, "agregados": agregados}
+
+
+class Ingestas:
+    """Pool de hilos del proceso y tareas por huella (en curso y terminadas recientes)."""
+
+    def __init__(self, hilos=HILOS, max_terminadas=MAX_TERMINADAS, ttl=TTL_TERMINADAS):
+        self._lock = threading.Lock()
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="ingesta")
+        self._tareas = OrderedDict()
+        self.max_terminadas = max_terminadas
+        self.ttl = ttl
+        self.canceladas = 0
+
+    def tarea_de(self, sesion, huella, nombre, funcion, *args):
+        # Devuelve (tarea de `huella` para `sesion`, si es nueva). La sesión
+        # deja de esperar cualquier otra tarea; si nadie más la espera, se cancela.
+        with self._lock:
+            self._soltar(sesion, excepto=huella)
+            self._purgar()
+            tarea = self._tareas.get(huella)
+            nueva = tarea is None or tarea.cancelada
+            if nueva:
+                tarea = self._tareas[huella] = Tarea(huella, nombre)
+                tarea.futuro = self._ejecutor.submit(self._ejecutar, tarea, funcion, *args)
+            self._tareas.move_to_end(huella)
+            tarea.sesiones.add(sesion)
+            return tarea, nueva
+
+    def soltar(self, sesion):
+        # La sesión ya no espera ningún archivo (p. ej. ha quitado el que subió)
+        with self._lock:
+            self._soltar(sesion)
+
+    def retirar(self, huella):
+        # Una sesión ya ha recogido el resultado: la tarea deja de retenerlo
+        with self._lock:
+            tarea = self._tareas.get(huella)
+            if tarea is not None and tarea.terminada:
+                del self._tareas[huella]
+
+    def _ejecutar(self, tarea, funcion, *args):
+        try:
+            return funcion(tarea, *args)
+        finally:
+            tarea.terminada_en = time.monotonic()
+
+    def _soltar(self, sesion, excepto=None):
+        for huella, tarea in list(self._tareas.items()):
+            if huella == excepto or sesion not in tarea.sesiones:
+                continue
+            tarea.sesiones.discard(sesion)
+            if not tarea.sesiones and not tarea.terminada:
+                tarea.cancelar()
+                del self._tareas[huella]
+                self.canceladas += 1
+                logger.info("Ingesta cancelada para %s", huella[:12])
+
+    def _purgar(self):
+        ahora = time.monotonic()
+        terminadas = [h for h, t in self._tareas.items() if t.terminada_en is not None]
+        sobrantes = len(terminadas) - self.max_terminadas
+        for huella in terminadas:
+            if sobrantes > 0 or ahora - self._tareas[huella].terminada_en > self.ttl:
+                del self._tareas[huella]
+                sobrantes -= 1
+
+    def resumen(self):
+        with self._lock:
+            en_curso = [t for t in self._tareas.values() if t.terminada_en is None]
+            return {
+                "en_curso": len(en_curso),
+                "terminadas": len(self._tareas) - len(en_curso),
+                "canceladas": self.canceladas,
+                "etapas": {t.huella[:8]: t.etapa for t in en_curso},
+            }
@@ -0,0 +1,141 @@
+"""Cálculo por lotes de rankings y resúmenes (procesos nocturnos).
+
+Procesa varios CSV (o .xlsx de la plantilla) de equipos en paralelo, uno por
+proceso, y escribe los resultados de cada equipo en su propia carpeta:
+
+    python lote.py equipos/*.csv --salida resultados --procesos 4
+
+Por cada archivo se generan ranking_notas.csv, ranking_ofensivo.csv,
+partidos_equipo.csv y resumen_competiciones.csv; si el archivo tiene filas no
+válidas, solo informe_errores.csv. Solo depende del motor de cálculo, no de
+Streamlit.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import excel
+import motor
+
+logger = logging.getLogger("lote")
+
+
+def cargar_modelo(ruta):
+    # Mismo criterio que la app: los archivos grandes se agregan por bloques
+    with open(ruta, "rb") as f:
+        es_excel = excel.es_excel(f.read(4))
+    if es_excel:
+        if os.path.getsize(ruta) >= excel.UMBRAL_POR_BLOQUES:
+            return motor.ingerir_bloques(excel.bloques(ruta))
+        return motor.construir_cubo(motor.compactar(motor.validar_datos(excel.leer_excel(ruta))))
+    if os.path.getsize(ruta) >= motor.UMBRAL_INGESTA_POR_BLOQUES:
+        return motor.ingerir_por_bloques(ruta)
+    return motor.construir_cubo(motor.compactar(motor.preparar_datos(ruta)))
+
+
+def agregador_por_nombre(nombre):
+    # DuckDB solo se importa si se elige
+    if nombre == "duckdb":
+        import motor_duckdb
+
+        if not motor_duckdb.disponible():
+            raise ValueError("DuckDB no está instalado")
+        return motor_duckdb
+    return motor.AGREGADOR_PANDAS
+
+
+def calcular_resultados(modelo, competiciones=None, parametros=None, agregador=None):
+    # Tablas de salida de un equipo (todas las competiciones por defecto)
+    agregador = agregador or motor.AGREGADOR_PANDAS
+    if competiciones is None:
+        competiciones = sorted(modelo["partidos"]["COMPETICION"].unique())
+    agregados = motor.calcular_agregados(modelo, competiciones, agregador=agregador)
+    if parametros:
+        equipo_notas, ranking_notas = motor.calcular_ranking_notas(agregados["totales"], agregados["equipo"], **parametros)
+    else:
+        equipo_notas, ranking_notas = agregados["ranking_notas"]
+    equipo_of, ranking_of = agregados["ranking_ofensivo"]
+    return {
+        "ranking_notas": pd.concat([equipo_notas, ranking_notas], ignore_index=True),
+        "ranking_ofensivo": pd.concat([equipo_of, ranking_of], ignore_index=True),
+        "partidos_equipo": agregados["df_equipo"],
+        "resumen_competiciones": agregador.agregar_cubo(agregados["cubo"], ["NOMBRE", "COMPETICION"]).reset_index(),
+    }
+
+
+def procesar_archivo(ruta, salida, competiciones=None, parametros=None, agregador="pandas"):
+    # Devuelve (ruta, carpeta de resultados, segundos); se ejecuta en un proceso hijo
+    inicio = time.perf_counter()
+    carpeta = os.path.join(salida, os.path.splitext(os.path.basename(ruta))[0])
+    try:
+        modelo = cargar_modelo(ruta)
+    except motor.DatosInvalidos as e:
+        # Informe con una fila por error, junto a donde irían los resultados
+        os.makedirs(carpeta, exist_ok=True)
+        e.informe.to_csv(os.path.join(carpeta, "informe_errores.csv"), index=False)
+        raise
+    resultados = calcular_resultados(modelo, competiciones, parametros, agregador_por_nombre(agregador))
+    os.makedirs(carpeta, exist_ok=True)
+    for nombre, tabla in resultados.items():
+        tabla.to_csv(os.path.join(carpeta, f"{nombre}.csv"), index=False)
+    return ruta, carpeta, time.perf_counter() - inicio
+
+
+def iniciar_proceso(hilos_duckdb):
+    # Con varios procesos, cada DuckDB usa pocos hilos para no saturar las CPU
+    import motor_duckdb
+
+    motor_duckdb.HILOS = hilos_duckdb
+
+
+def procesar_lote(rutas, salida, procesos=None, competiciones=None, parametros=None, agregador="pandas"):
+    # Devuelve el número de archivos con error
+    errores = 0
+    procesos = procesos or os.cpu_count() or 1
+    hilos_duckdb = max(1, (os.cpu_count() or 1) // procesos)
+    inicio = iniciar_proceso if agregador == "duckdb" else None
+    with ProcessPoolExecutor(max_workers=procesos, initializer=inicio, initargs=(hilos_duckdb,)) as ejecutor:
+        tareas = {
+            ejecutor.submit(procesar_archivo, ruta, salida, competiciones, parametros, agregador): ruta
+            for ruta in rutas
+        }
+        for tarea in as_completed(tareas):
+            ruta = tareas[tarea]
+            try:
+                _, carpeta, segundos = tarea.result()
+            except (motor.ArchivoInvalido, ValueError, OSError) as e:
+                errores += 1
+                logger.error("%s: %s", ruta, e)
+            else:
+                logger.info("%s -> %s (%.2f s)", ruta, carpeta, segundos)
+    return errores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rankings y resúmenes de varios CSV de equipos en paralelo.")
+    parser.add_argument("archivos", nargs="+", help="CSV o .xlsx con el formato de la plantilla")
+    parser.add_argument("--salida", default="resultados", help="carpeta de resultados (una subcarpeta por archivo)")
+    parser.add_argument("--procesos", type=int, default=None, help="procesos en paralelo (por defecto, uno por CPU)")
+    parser.add_argument("--competiciones", nargs="+", default=None, help="competiciones a incluir (por defecto, todas)")
+    parser.add_argument("--agregador", choices=["pandas", "duckdb"], default="pandas", help="motor de agregación")
+    parser.add_argument("--alpha", type=float, default=motor.ALPHA, help="potencia del peso por minutos")
+    parser.add_argument("--k", type=float, default=motor.K, help="suavizado hacia la nota global")
+    parser.add_argument("--gamma", type=float, default=motor.GAMMA, help="intensidad del bonus por minutos")
+    parser.add_argument("--beta", type=float, default=motor.BETA, help="curvatura del bonus")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    parametros = {"alpha": args.alpha, "k": args.k, "gamma": args.gamma, "beta": args.beta}
+    if parametros == {"alpha": motor.ALPHA, "k": motor.K, "gamma": motor.GAMMA, "beta": motor.BETA}:
+        parametros = None
+    errores = procesar_lote(args.archivos, args.salida, args.procesos, args.competiciones, parametros, args.agregador)
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Instrumentación: tiempos y memoria asignada por etapa, y su exportación.
+
+Cada etapa instrumentada (`with tramo("filtros", proceso, sesion): ...`)
+acumula en uno o varios destinos (las métricas del proceso y las de la sesión)
+el número de ejecuciones, el tiempo total, el máximo y el último. Si
+tracemalloc está activo también acumula los bytes asignados netos; con varias
+sesiones a la vez incluyen lo que asignen las demás, así que son orientativos.
+
+Las métricas se exportan como JSON o en el formato de texto de Prometheus, a
+un archivo (p. ej. para el textfile collector de node_exporter) o desde un
+servidor HTTP local:
+
+    curl localhost:9464/metrics
+    curl localhost:9464/metrics.json
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PREFIJO = "app_estadisticas"
+MAX_SESIONES = 200  # Sesiones con métricas propias (las menos recientes se descartan)
+
+
+class Metricas:
+    """Tiempos por etapa y contadores de un proceso o de una sesión."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tramos = {}
+        self.contadores = {}
+
+    def registrar(self, nombre, segundos, asignado=0):
+        with self._lock:
+            tramo = self.tramos.setdefault(nombre, {"n": 0, "segundos": 0.0, "max": 0.0, "ultimo": 0.0, "bytes": 0})
+            tramo["n"] += 1
+            tramo["segundos"] += segundos
+            tramo["max"] = max(tramo["max"], segundos)
+            tramo["ultimo"] = segundos
+            tramo["bytes"] += asignado
+
+    def incrementar(self, nombre, n=1):
+        with self._lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + n
+
+    def resumen(self):
+        with self._lock:
+            return {
+                "tramos": {nombre: dict(tramo) for nombre, tramo in self.tramos.items()},
+                "contadores": dict(self.contadores),
+            }
+
+
+class RegistroMetricas:
+    """Métricas del proceso, de las sesiones más recientes y fuentes externas.
+
+    Las fuentes son funciones sin argumentos que devuelven un dict (p. ej. el
+    resumen de una caché) y se consultan en cada exportación.
+    """
+
+    def __init__(self, max_sesiones=MAX_SESIONES):
+        self._lock = threading.Lock()
+        self.proceso = Metricas()
+        self._sesiones = OrderedDict()
+        self.max_sesiones = max_sesiones
+        self.fuentes = {}
+        self.inicio = time.time()
+
+    def de_sesion(self, sesion):
+        with self._lock:
+            metricas = self._sesiones.get(sesion)
+            if metricas is None:
+                metricas = self._sesiones[sesion] = Metricas()
+                while len(self._sesiones) > self.max_sesiones:
+                    self._sesiones.popitem(last=False)
+            self._sesiones.move_to_end(sesion)
+            return metricas
+
+    def resumen(self, sesiones=True):
+        with self._lock:
+            por_sesion = list(self._sesiones.items()) if sesiones else []
+            fuentes = dict(self.fuentes)
+        datos = {
+            "proceso": self.proceso.resumen(),
+            "segundos_activo": time.time() - self.inicio,
+            "sesiones_con_metricas": len(self._sesiones),
+        }
+        if tracemalloc.is_tracing():
+            datos["memoria_python"], datos["memoria_python_pico"] = tracemalloc.get_traced_memory()
+        if sesiones:
+            datos["sesiones"] = {sesion[:8]: metricas.resumen() for sesion, metricas in por_sesion}
+        for nombre, fuente in fuentes.items():
+            try:
+                datos[nombre] = fuente()
+            except Exception:  # Una fuente rota no debe impedir exportar las demás
+                logger.warning("Métricas: no se pudo leer la fuente %s", nombre, exc_info=True)
+        return datos
+
+
+@contextmanager
+def tramo(nombre, *destinos):
+    # Mide el bloque y lo registra en cada destino (Metricas), también si falla
+    asignado_inicio = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        asignado = 0
+        if asignado_inicio is not None and tracemalloc.is_tracing():
+            asignado = max(0, tracemalloc.get_traced_memory()[0] - asignado_inicio)
+        for destino in destinos:
+            destino.registrar(nombre, segundos, asignado)
+
+
+# -------------------------------
+# Exportación
+# -------------------------------
+def a_json(registro):
+    return json.dumps(registro.resumen(), indent=2, default=str)
+
+
+def _nombre(*partes):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(partes))
+
+
+def _etiqueta(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def a_prometheus(registro, prefijo=PREFIJO):
+    # Solo métricas del proceso: una serie por sesión dispararía la cardinalidad
+    datos = registro.resumen(sesiones=False)
+    lineas = []
+
+    def metrica(nombre, tipo, ayuda, valores):
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        for etiquetas, valor in valores:
+            texto = ",".join(f'{clave}="{_etiqueta(v)}"' for clave, v in etiquetas.items())
+            lineas.append(f"{nombre}{{{texto}}} {valor}" if texto else f"{nombre} {valor}")
+
+    proceso = datos.pop("proceso")
+    tramos, contadores = proceso["tramos"], proceso["contadores"]
+    metrica(f"{prefijo}_tramo_ejecuciones_total", "counter", "Ejecuciones de cada etapa.",
+            [({"tramo": t}, d["n"]) for t, d in tramos.items()])
+    metrica(f"{prefijo}_tramo_segundos_total", "counter", "Segundos acumulados en cada etapa.",
+            [({"tramo": t}, repr(d["segundos"])) for t, d in tramos.items()])
+    metrica(f"{prefijo}_tramo_segundos_max", "gauge", "Ejecución más lenta de cada etapa.",
+            [({"tramo": t}, repr(d["max"])) for t, d in tramos.items()])
+    metrica(f"{prefijo}_tramo_bytes_asignados_total", "counter", "Bytes asignados netos en cada etapa (con tracemalloc).",
+            [({"tramo": t}, d["bytes"]) for t, d in tramos.items()])
+    for nombre, valor in contadores.items():
+        metrica(_nombre(prefijo, nombre, "total"), "counter", f"Contador {nombre}.", [({}, valor)])
+
+    # Fuentes y demás valores: cada número es un gauge (los dicts anidados se aplanan)
+    def aplanar(partes, valor):
+        if isinstance(valor, bool):
+            valor = int(valor)
+        if isinstance(valor, (int, float)):
+            metrica(_nombre(prefijo, *partes), "gauge", " ".join(partes) + ".", [({}, repr(valor))])
+        elif isinstance(valor, dict) and partes[-1] != "por_sesion":
+            for clave, subvalor in valor.items():
+                aplanar(partes + [str(clave)], subvalor)
+
+    for clave, valor in datos.items():
+        aplanar([clave], valor)
+    return "\n".join(lineas) + "\n"
+
+
+def escribir(ruta, registro):
+    # JSON si la ruta termina en .json; si no, texto de Prometheus. Escritura
+    # atómica para que un lector nunca vea un archivo a medias.
+    contenido = a_json(registro) if ruta.endswith(".json") else a_prometheus(registro)
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+            f.write(contenido)
+        os.replace(temporal, ruta)
+    except OSError:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        logger.warning("Métricas: no se pudo escribir %s", ruta, exc_info=True)
+
+
+class ArchivoMetricas:
+    """Archivo de métricas que se reescribe como mucho una vez cada `intervalo` segundos."""
+
+    def __init__(self, ruta, intervalo=10):
+        self._lock = threading.Lock()
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self._ultima = float("-inf")
+
+    def actualizar(self, registro, forzar=False):
+        with self._lock:
+            ahora = time.monotonic()
+            if not forzar and ahora - self._ultima < self.intervalo:
+                return False
+            self._ultima = ahora
+        escribir(self.ruta, registro)
+        return True
+
+
+def servir(registro, puerto, host="127.0.0.1"):
+    # Servidor HTTP en segundo plano con /metrics (Prometheus) y /metrics.json
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                cuerpo, tipo = a_prometheus(registro), "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/metrics.json":
+                cuerpo, tipo = a_json(registro), "application/json"
+            else:
+                self.send_error(404)
+                return
+            datos = cuerpo.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def log_message(self, formato, *args):
+            logger.debug("Métricas: " + formato, *args)
+
+    try:
+        servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    except OSError:
+        logger.warning("Métricas: no se pudo abrir el puerto %s", puerto, exc_info=True)
+        return None
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    logger.info("Métricas en http://%s:%s/metrics", host, puerto)
+    return servidor
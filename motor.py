@@ -0,0 +1,1114 @@
+"""Motor de cálculo de estadísticas (sin Streamlit).
+
+Lectura y validación de los CSV, tabla de partidos, cubo jugador × partido,
+Nota Ajustada y rankings. No tiene efectos secundarios al importarse y solo
+depende de pandas y numpy, de modo que lo pueden usar tanto la app como los
+procesos por lotes (ver lote.py).
+"""
+import os
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+
+# -------------------------------
+# Lectura y validación
+# -------------------------------
+COLUMNAS_CATEGORICAS = ["NOMBRE", "COMPETICION", "RIVAL"]
+COLUMNAS_ENTERAS = ["GOLES", "ASISTENCIAS", "G/A", "MINS_JUGADOS", "GOLES_EN_CONTRA", "DIFERENCIA_GOLES"]
+DECIMALES_NOTA = 4  # float32 representa sin pérdida notas de 0 a 10 con hasta 4 decimales
+
+columnas_esperadas = [
+    "FECHA", "COMPETICION", "NOMBRE", "GOLES", 
+    "ASISTENCIAS", "NOTA", "MINS_JUGADOS", "GOLES_EN_CONTRA", "RIVAL"
+]
+
+
+class ArchivoInvalido(ValueError):
+    """El archivo subido no tiene el formato esperado."""
+
+
+def validar_columnas(columnas):
+    faltantes = [col for col in columnas_esperadas if col not in columnas]
+    if faltantes:
+        raise ArchivoInvalido(f"Archivo inválido. Faltan las columnas: {', '.join(faltantes)}")
+
+
+def leer_csv(origen):
+    # Los textos repetidos se leen directamente como categóricos, sin pasar por
+    # objetos de Python
+    return pd.read_csv(origen, dayfirst=True, dtype={columna: "category" for columna in COLUMNAS_CATEGORICAS})
+
+
+def validar_datos(df, primera_fila=2, estado=None):
+    # Validación de columnas y de cada fila, y columnas derivadas (sin
+    # modificar `df`). Con filas no válidas lanza DatosInvalidos (ver
+    # revisar_filas); `primera_fila` y `estado` solo los usa la ingesta por bloques.
+    validar_columnas(df.columns)
+    convertidas = revisar_filas(df, primera_fila, estado)
+
+    return df.assign(**convertidas, **{
+        "G/A": convertidas["GOLES"] + convertidas["ASISTENCIAS"],
+        "DIFERENCIA_GOLES": convertidas["GOLES"] - convertidas["GOLES_EN_CONTRA"],
+    })
+
+
+def preparar_datos(origen):
+    # Lectura, validación de columnas y columnas derivadas
+    return validar_datos(leer_csv(origen))
+
+
+def compactar(df):
+    # Esquema compacto: categóricos para las columnas de texto repetido, enteros
+    # reducidos al tipo más pequeño que los contiene y notas en float32. Las
+    # columnas enteras con nulos se quedan en coma flotante (float32).
+    df = df.copy()
+    for columna in COLUMNAS_CATEGORICAS:
+        if columna in df.columns:
+            df[columna] = df[columna].astype("category")
+    for columna in COLUMNAS_ENTERAS:
+        if columna in df.columns and pd.api.types.is_integer_dtype(df[columna]):
+            df[columna] = pd.to_numeric(df[columna], downcast="integer")
+        elif columna in df.columns and pd.api.types.is_float_dtype(df[columna]):
+            df[columna] = df[columna].astype("float32")
+    if "NOTA" in df.columns and pd.api.types.is_numeric_dtype(df["NOTA"]):
+        df["NOTA"] = df["NOTA"].astype("float32")
+    return df
+
+
+def sumas_de_notas(sumas):
+    # Las notas tienen como mucho DECIMALES_NOTA decimales, así que sus sumas
+    # también: redondear elimina el error de coma flotante y hace que el
+    # resultado no dependa del orden de suma (ni del motor de agregación)
+    return np.round(sumas, DECIMALES_NOTA)
+
+
+def notas_exactas(notas):
+    # Las notas compactas (float32) se acumulan en float64 a partir de su valor
+    # decimal: el error de float32 en el rango 0-10 es menor que 1e-6
+    if notas.dtype == np.float32:
+        return notas.astype("float64").round(DECIMALES_NOTA)
+    return notas
+
+
+# -------------------------------
+# Parámetros
+# -------------------------------
+TOTAL_JORNADAS = 38  # Jornadas de Liga por defecto (LaLiga)
+
+# Parámetros de la fórmula de la Nota Ajustada
+ALPHA = 2     # Potencia para peso de minutos
+K = 60        # Suavizado hacia la nota global
+GAMMA = 0.25  # Intensidad del bonus por minutos
+BETA = 2      # Curvatura del bonus
+
+# -------------------------------
+# Tabla de partidos
+# -------------------------------
+# Dimensión de partidos construida una vez por dataset: un PARTIDO_ID por
+# FECHA + COMPETICION + RIVAL, numerado en orden cronológico, con la temporada,
+# la jornada de Liga y los goles en contra. Las filas de apariciones enlazan por PARTIDO_ID.
+DIMENSIONES_PARTIDO = ["FECHA", "COMPETICION", "RIVAL"]
+# Mes en que empieza cada temporada: con 7 van de julio a junio ("2024-25"); con
+# 1 son años naturales ("2024"). Un archivo que abarque más de doce meses sin
+# esa pausa (p. ej. ejemplo.csv, de agosto a septiembre del año siguiente)
+# queda repartido en dos temporadas.
+MES_INICIO_TEMPORADA = int(os.environ.get("APP_ESTADISTICAS_MES_INICIO_TEMPORADA", "7"))
+COLUMNAS_PARTICION = ["TEMPORADA", "COMPETICION"]  # Particiones del modelo y del almacén
+
+
+def temporadas_de(fechas, mes_inicio=None):
+    # Temporada de cada fecha como categórico ordenado cronológicamente
+    mes_inicio = MES_INICIO_TEMPORADA if mes_inicio is None else mes_inicio
+    if not 1 <= mes_inicio <= 12:
+        raise ValueError(f"Mes de inicio de temporada no válido: {mes_inicio}")
+    fechas = pd.DatetimeIndex(fechas)
+    anios = fechas.year.to_numpy() - (fechas.month.to_numpy() < mes_inicio)
+    unicos, codigos = np.unique(anios, return_inverse=True)
+    etiquetas = [str(a) if mes_inicio == 1 else f"{a}-{(a + 1) % 100:02d}" for a in unicos]
+    return pd.Categorical.from_codes(codigos, etiquetas)
+
+
+def construir_partidos(df):
+    # Devuelve (PARTIDO_ID de cada fila, tabla de partidos indexada por PARTIDO_ID).
+    # Acepta tanto las filas originales como las celdas jugador × partido.
+    partido_id = df.groupby(DIMENSIONES_PARTIDO, observed=True, sort=True).ngroup().to_numpy()
+    partidos = (
+        df.assign(PARTIDO_ID=partido_id)
+        .groupby("PARTIDO_ID")
+        .agg(**{
+            "FECHA": ("FECHA", "first"),
+            "COMPETICION": ("COMPETICION", "first"),
+            "RIVAL": ("RIVAL", "first"),
+            "GOLES_EN_CONTRA": ("GOLES_EN_CONTRA", "max"),
+        })
+    )
+    partidos.insert(0, "TEMPORADA", temporadas_de(partidos["FECHA"]))
+
+    # Jornada de Liga: posición de la fecha entre las fechas de Liga de su
+    # temporada (0 fuera de Liga). Los partidos están en orden cronológico.
+    es_liga = (partidos["COMPETICION"] == "Liga").to_numpy()
+    temporadas = partidos["TEMPORADA"].cat.codes.to_numpy()[es_liga]
+    fechas = partidos["FECHA"].to_numpy()[es_liga]
+    nueva_fecha = np.r_[True, fechas[1:] != fechas[:-1]]
+    nueva_temporada = np.r_[True, temporadas[1:] != temporadas[:-1]]
+    jornadas = np.cumsum(nueva_fecha)
+    jornadas -= np.maximum.accumulate(np.where(nueva_temporada, jornadas - 1, 0))
+    partidos["JORNADA"] = 0
+    partidos.loc[es_liga, "JORNADA"] = jornadas
+    return partido_id, partidos
+
+
+def indexar_rangos(tabla):
+    # Índice por partición (temporada, competición): posiciones de sus filas
+    # (en orden cronológico) junto a sus fechas y jornadas, para resolver
+    # rangos con searchsorted
+    fechas = tabla["FECHA"].to_numpy()
+    jornadas = tabla["JORNADA"].to_numpy()
+    indice = {}
+    for particion, posiciones in tabla.groupby(COLUMNAS_PARTICION, observed=True).indices.items():
+        indice[particion] = {
+            "posiciones": posiciones,
+            "fechas": fechas[posiciones],
+            "jornadas": jornadas[posiciones],
+        }
+    return indice
+
+
+def rango_ordenado(valores, inicio=None, fin=None):
+    # Slice [i, j) de un array ordenado con valores en [inicio, fin]
+    i = 0 if inicio is None else np.searchsorted(valores, inicio, side="left")
+    j = len(valores) if fin is None else np.searchsorted(valores, fin, side="right")
+    return i, j
+
+
+def particiones_de(indice, comp_filtro, temporadas=None):
+    # Particiones del índice que tocan los filtros de competición y temporada
+    comp_filtro = set(comp_filtro)
+    return [
+        (temporada, comp) for temporada, comp in indice
+        if comp in comp_filtro and (temporadas is None or temporada in temporadas)
+    ]
+
+
+def filtrar_rangos(tabla, indice, comp_filtro, jornadas=None, fechas=None, temporadas=None):
+    # Filtra por competición, temporada, rango de jornadas (solo Liga) y rango
+    # de fechas. Solo se visitan las particiones seleccionadas y dentro de cada
+    # una las condiciones son búsquedas binarias: no se recorre la tabla.
+    seleccion = []
+    for temporada, comp in particiones_de(indice, comp_filtro, temporadas):
+        entrada = indice[(temporada, comp)]
+        i, j = 0, len(entrada["posiciones"])
+        if fechas is not None:
+            i, j = rango_ordenado(entrada["fechas"], *fechas)
+        if comp == "Liga" and jornadas is not None:
+            ji, jj = rango_ordenado(entrada["jornadas"], *jornadas)
+            i, j = max(i, ji), min(j, jj)
+        if i < j:
+            seleccion.append(entrada["posiciones"][i:j])
+    if not seleccion:
+        return tabla.iloc[:0]
+    return tabla.iloc[np.sort(np.concatenate(seleccion))]
+
+
+def rango_vuelta(vuelta, total_jornadas=TOTAL_JORNADAS):
+    # Rango de jornadas (inclusivo) de cada tramo de la Liga; None = sin límite
+    corte_liga = total_jornadas // 2
+    if vuelta == "Primera vuelta":
+        return (None, corte_liga)
+    if vuelta == "Segunda vuelta":
+        return (corte_liga + 1, None)
+    return None
+
+
+# -------------------------------
+# Cubo de agregados jugador × partido
+# -------------------------------
+# Se construye una sola vez por dataset. Todas las secciones leen de él: los
+# totales por jugador, los del equipo y los desgloses por competición o vuelta
+# son roll-ups del cubo, sin volver a recorrer las filas originales. Además se
+# guardan los totales por jugador de cada partición (temporada × competición):
+# los totales de cualquier selección de particiones completas son un roll-up
+# de esa tabla, cuyo tamaño no depende del número de partidos.
+AGREGADOS_CUBO = {
+    "NOTA_SUMA": ("NOTA_SUMA", "sum"),
+    "NOTA_N": ("NOTA_N", "sum"),
+    "GOLES": ("GOLES", "sum"),
+    "ASISTENCIAS": ("ASISTENCIAS", "sum"),
+    "G/A": ("G/A", "sum"),
+    "MINUTOS_TOTALES": ("MINS_JUGADOS", "sum"),
+    "PARTIDOS_JUGADOS": ("PARTIDO_ID", "nunique"),
+}
+
+METRICAS_CUBO = ["NOTA_SUMA", "NOTA_N", "GOLES", "ASISTENCIAS", "G/A", "MINS_JUGADOS"]
+
+
+AGREGACION_CELDAS = {
+    "NOTA_SUMA": "sum",
+    "NOTA_N": "sum",
+    "GOLES": "sum",
+    "ASISTENCIAS": "sum",
+    "G/A": "sum",
+    "MINS_JUGADOS": "sum",
+    "GOLES_EN_CONTRA": "max",
+}
+
+
+def celdas_de(df):
+    # Una pasada sobre las filas: celdas jugador × partido
+    return (
+        df.assign(NOTA=notas_exactas(df["NOTA"]))
+        .groupby(DIMENSIONES_PARTIDO + ["NOMBRE"], observed=True)
+        .agg(**{
+            "NOTA_SUMA": ("NOTA", "sum"),
+            "NOTA_N": ("NOTA", "count"),
+            "GOLES": ("GOLES", "sum"),
+            "ASISTENCIAS": ("ASISTENCIAS", "sum"),
+            "G/A": ("G/A", "sum"),
+            "MINS_JUGADOS": ("MINS_JUGADOS", "sum"),
+            "GOLES_EN_CONTRA": ("GOLES_EN_CONTRA", "max"),
+        })
+        .reset_index()
+    )
+
+
+def combinar_celdas(*partes):
+    # Las celdas son sumas (y un máximo), así que se pueden plegar por partes
+    return (
+        pd.concat(partes, ignore_index=True)
+        .groupby(DIMENSIONES_PARTIDO + ["NOMBRE"], observed=True)
+        .agg(AGREGACION_CELDAS)
+        .reset_index()
+    )
+
+
+def tablas_desde_celdas(celdas, primer_partido=0, jornadas_previas=None):
+    # Tabla de partidos y cubo a partir de celdas. Con `primer_partido` y
+    # `jornadas_previas` ({temporada: jornadas de Liga ya jugadas}) la
+    # numeración continúa la de un modelo ya existente.
+    partido_id, partidos = construir_partidos(celdas)
+    if jornadas_previas:
+        previas = partidos["TEMPORADA"].astype(object).map(jornadas_previas).fillna(0).astype(np.int64)
+        partidos["JORNADA"] = np.where(partidos["JORNADA"] > 0, partidos["JORNADA"] + previas, 0)
+
+    cubo = celdas.drop(columns="GOLES_EN_CONTRA").assign(PARTIDO_ID=partido_id + primer_partido)
+    # Atributos del partido por enlace directo (PARTIDO_ID es la posición en la tabla)
+    dimensiones = partidos.iloc[partido_id].reset_index(drop=True)
+    for columna in ["TEMPORADA", "JORNADA", "GOLES_EN_CONTRA"]:
+        cubo[columna] = dimensiones[columna].array
+    cubo["NOTA"] = cubo["NOTA_SUMA"] / cubo["NOTA_N"]
+    # Los datos de entrada pueden venir con enteros compactos (int8/int16): los
+    # roll-ups del cubo necesitan un tipo que no desborde al acumular temporadas
+    cubo = cubo.astype({columna: "int32" for columna in METRICAS_CUBO if columna != "NOTA_SUMA"})
+
+    # Roll-up por partido (totales del equipo en cada encuentro)
+    por_partido = cubo.groupby("PARTIDO_ID")[METRICAS_CUBO].sum()
+    partidos.index += primer_partido
+    partidos = partidos.join(por_partido).reset_index()
+    partidos["NOTA"] = partidos["NOTA_SUMA"] / partidos["NOTA_N"]
+    return partidos, cubo
+
+
+def modelo_desde_celdas(celdas):
+    # Devuelve el modelo del dataset: tabla de partidos, cubo jugador × partido,
+    # los índices de rangos de ambos y los totales por partición
+    partidos, cubo = tablas_desde_celdas(celdas)
+    return {
+        "partidos": partidos,
+        "cubo": cubo,
+        "indice_partidos": indexar_rangos(partidos),
+        "indice_cubo": indexar_rangos(cubo),
+        "particiones": agregar_cubo(cubo, COLUMNAS_PARTICION + ["NOMBRE"]),
+    }
+
+
+def construir_cubo(df):
+    return modelo_desde_celdas(celdas_de(df))
+
+
+# -------------------------------
+# Calidad de datos
+# -------------------------------
+# Antes de construir nada se revisan todas las filas en una sola pasada
+# vectorizada (una máscara por comprobación y columna): tipos, vacíos, rangos,
+# jugadores repetidos en un partido y coherencia de los datos de cada
+# partido. Si algo falla se lanza DatosInvalidos con un informe de una fila
+# por error; FILA es el número de fila en el archivo (la cabecera es la 1).
+# Si el lector ya la conoce (un índice llamado FILA, como el de las hojas de
+# Excel, que se saltan las filas vacías) se usa esa.
+FORMATOS_FECHA = ("%d/%m/%Y", "%Y-%m-%d")   # Formatos admitidos (sin inferencia)
+
+# (mínimo, máximo) de cada columna numérica; None = sin límite
+LIMITES = {
+    "GOLES": (0, None),
+    "ASISTENCIAS": (0, None),
+    "NOTA": (0, 10),
+    "MINS_JUGADOS": (0, 150),
+    "GOLES_EN_CONTRA": (0, None),
+}
+COLUMNAS_CON_VACIOS = ["NOTA"]  # Un jugador puede no tener nota
+
+# Datos de un partido que deben coincidir en todas sus filas:
+# (columnas que identifican el partido, columna, error)
+COHERENCIA_PARTIDO = [
+    (["FECHA", "COMPETICION"], "RIVAL", "rival distinto en la misma fecha y competición"),
+    (DIMENSIONES_PARTIDO, "GOLES_EN_CONTRA", "goles en contra distintos en el mismo partido"),
+]
+
+COLUMNAS_INFORME = ["FILA", "COLUMNA", "VALOR", "ERROR", "FILA_REFERENCIA"]
+MAX_ERRORES_INFORME = 100_000  # Filas del informe (el total se cuenta siempre)
+
+
+class DatosInvalidos(ArchivoInvalido):
+    """Hay filas con valores no válidos; `informe` tiene una fila por error."""
+
+    def __init__(self, informe, total=None):
+        self.informe = informe
+        self.total = len(informe) if total is None else total
+        tipos = informe.groupby(["COLUMNA", "ERROR"], sort=False).size().sort_values(ascending=False)
+        resumen = "; ".join(f"{columna}: {error} ({n})" for (columna, error), n in tipos.head(5).items())
+        super().__init__(
+            f"Archivo inválido. Errores en los datos: {self.total} ({resumen}). "
+            "El informe de errores indica la fila de cada uno."
+        )
+
+    def __reduce__(self):
+        # Para que llegue entero desde otro proceso (lote.py)
+        return type(self), (self.informe, self.total)
+
+
+def parsear_fechas(fechas, formato=None):
+    # Devuelve (fechas, formato). Con un formato explícito no hay inferencia
+    # fila a fila; si no se conoce (primer bloque) se usa el admitido que
+    # reconoce más fechas. Las que no encajan quedan como NaT.
+    if pd.api.types.is_datetime64_any_dtype(fechas):
+        return fechas, formato
+    mejor = None
+    for candidato in ([formato] if formato else FORMATOS_FECHA):
+        convertidas = pd.to_datetime(fechas, format=candidato, errors="coerce")
+        validas = convertidas.notna().sum()
+        if mejor is None or validas > mejor[0]:
+            mejor = (validas, convertidas, candidato)
+        if validas == fechas.notna().sum():
+            break
+    return mejor[1], mejor[2]
+
+
+def huellas_de(df):
+    # Un entero de 64 bits por fila a partir de sus valores (no de los códigos
+    # de los categóricos), comparable entre bloques
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def buscar_huellas(vistas, huellas):
+    # FILA de la primera aparición de cada huella en bloques anteriores (-1 si no está)
+    referencia = np.full(len(huellas), -1, dtype=np.int64)
+    for ordenadas, filas in vistas:
+        posiciones = np.searchsorted(ordenadas, huellas).clip(max=len(ordenadas) - 1)
+        encontradas = ordenadas[posiciones] == huellas
+        referencia[encontradas] = filas[posiciones[encontradas]]
+    return referencia
+
+
+def revisar_valores(df, formato=None):
+    # Comprobaciones fila a fila. Devuelve (errores, columnas convertidas,
+    # formato de fecha); cada error es (máscara, columna, error, None)
+    errores = []
+    convertidas = {}
+
+    fechas, formato = parsear_fechas(df["FECHA"], formato)
+    vacias = df["FECHA"].isna().to_numpy()
+    errores.append((vacias, "FECHA", "vacío", None))
+    errores.append((fechas.isna().to_numpy() & ~vacias, "FECHA", "fecha no válida (DD/MM/AAAA o AAAA-MM-DD)", None))
+    convertidas["FECHA"] = fechas
+
+    for columna in COLUMNAS_CATEGORICAS:
+        errores.append((df[columna].isna().to_numpy(), columna, "vacío", None))
+
+    for columna, (minimo, maximo) in LIMITES.items():
+        original = df[columna]
+        numerica = pd.api.types.is_numeric_dtype(original) and not pd.api.types.is_bool_dtype(original)
+        valores = original if numerica else pd.to_numeric(original, errors="coerce")
+        vacios = original.isna().to_numpy()
+        if columna not in COLUMNAS_CON_VACIOS:
+            errores.append((vacios, columna, "vacío", None))
+        errores.append((valores.isna().to_numpy() & ~vacios, columna, "no es un número", None))
+        if columna in COLUMNAS_ENTERAS and not pd.api.types.is_integer_dtype(valores):
+            errores.append(((valores % 1 != 0).to_numpy() & valores.notna().to_numpy(), columna, "no es un número entero", None))
+            if valores.notna().all():
+                valores = valores.astype("int64")
+        fuera = (valores < minimo) if minimo is not None else np.zeros(len(valores), dtype=bool)
+        if maximo is not None:
+            fuera = fuera | (valores > maximo)
+        rango = f"fuera de rango ({minimo} a {maximo})" if maximo is not None else f"menor que {minimo}"
+        errores.append((np.asarray(fuera, dtype=bool), columna, rango, None))
+        convertidas[columna] = valores
+
+    return errores, convertidas, formato
+
+
+def revisar_coherencia(claves, filas, estado):
+    # Jugadores repetidos y datos de partido contradictorios, también respecto
+    # a los bloques anteriores guardados en `estado`. Cada error es
+    # (máscara, columna, error, FILA de la primera aparición).
+    errores = []
+
+    celdas = huellas_de(claves[DIMENSIONES_PARTIDO + ["NOMBRE"]])
+    primera = pd.Series(filas).groupby(celdas, sort=False).transform("first").to_numpy()
+    referencia = np.where(pd.Series(celdas).duplicated().to_numpy(), primera, -1)
+    previa = buscar_huellas(estado.get("celdas", []), celdas)
+    referencia = np.where(previa >= 0, previa, referencia)
+    errores.append((referencia >= 0, "NOMBRE", "jugador repetido en el mismo partido", referencia))
+
+    grupos = {}
+    for dimensiones, columna, error in COHERENCIA_PARTIDO:
+        valores = claves[columna]
+        if pd.api.types.is_numeric_dtype(valores):
+            valores = valores.astype("float64")  # 1 y 1.0 son el mismo valor
+        actual = pd.DataFrame({"GRUPO": huellas_de(claves[dimensiones]), "VALOR": huellas_de(valores), "FILA": filas})
+        previos = estado.get("grupos", {}).get(columna)
+        todos = actual if previos is None else pd.concat([previos, actual], ignore_index=True)
+        primero = todos.groupby("GRUPO", sort=False)[["VALOR", "FILA"]].transform("first").iloc[len(todos) - len(actual):]
+        distinto = primero["VALOR"].to_numpy() != actual["VALOR"].to_numpy()
+        errores.append((distinto, columna, error, primero["FILA"].to_numpy()))
+        grupos[columna] = todos.drop_duplicates("GRUPO")
+
+    return errores, celdas, grupos
+
+
+def numeros_de_fila(df, primera_fila=2):
+    # Número en el archivo de cada fila de `df`: su índice FILA si lo tiene y,
+    # si no, consecutivos desde `primera_fila`
+    if df.index.name == "FILA":
+        return df.index.to_numpy(dtype=np.int64)
+    return np.arange(primera_fila, primera_fila + len(df), dtype=np.int64)
+
+
+def informe_errores(df, errores, primera_fila=2, limite=MAX_ERRORES_INFORME):
+    # Devuelve (informe ordenado por fila con como mucho `limite` errores, total de errores)
+    filas = numeros_de_fila(df, primera_fila)
+    partes = []
+    total = 0
+    for mascara, columna, error, referencia in errores:
+        posiciones = np.flatnonzero(mascara)
+        total += len(posiciones)
+        posiciones = posiciones[:limite]
+        if not len(posiciones):
+            continue
+        valores = df[columna].iloc[posiciones]
+        partes.append(pd.DataFrame({
+            "FILA": filas[posiciones],
+            "COLUMNA": columna,
+            "VALOR": valores.astype(str).where(valores.notna(), "").to_numpy(),
+            "ERROR": error,
+            "FILA_REFERENCIA": pd.array(referencia[posiciones] if referencia is not None else [None] * len(posiciones), dtype="Int64"),
+        }))
+    if not partes:
+        return pd.DataFrame(columns=COLUMNAS_INFORME), 0
+    informe = pd.concat(partes, ignore_index=True).sort_values(["FILA", "COLUMNA"], kind="stable")
+    return informe.head(limite).reset_index(drop=True), total
+
+
+def revisar_filas(df, primera_fila=2, estado=None):
+    # Revisa todas las filas y devuelve las columnas convertidas (FECHA como
+    # fecha, las numéricas como números). Con errores lanza DatosInvalidos.
+    # `estado` (un dict, vacío al principio) conserva entre bloques el formato
+    # de fecha y lo necesario para detectar repetidos y contradicciones entre ellos.
+    revision = {} if estado is None else estado
+    errores, convertidas, formato = revisar_valores(df, revision.get("formato"))
+    filas = numeros_de_fila(df, primera_fila)
+    claves = df[COLUMNAS_CATEGORICAS].assign(FECHA=convertidas["FECHA"], GOLES_EN_CONTRA=convertidas["GOLES_EN_CONTRA"])
+    coherencia, celdas, grupos = revisar_coherencia(claves, filas, revision)
+    errores += coherencia
+
+    informe, total = informe_errores(df, errores, primera_fila)
+    if total:
+        raise DatosInvalidos(informe, total)
+
+    if estado is not None:
+        # Huellas ordenadas de las celdas de este bloque (para buscarlas con
+        # searchsorted); cada BLOQUES_POR_COMBINACION bloques se juntan en una
+        estado["formato"] = formato
+        orden = np.argsort(celdas, kind="stable")
+        vistas = estado.setdefault("celdas", [])
+        vistas.append((celdas[orden], filas[orden]))
+        if len(vistas) >= BLOQUES_POR_COMBINACION:
+            juntas = np.concatenate([h for h, _ in vistas])
+            orden = np.argsort(juntas, kind="stable")
+            vistas[:] = [(juntas[orden], np.concatenate([f for _, f in vistas])[orden])]
+        estado["grupos"] = grupos
+    return convertidas
+
+
+# -------------------------------
+# Ingesta por bloques
+# -------------------------------
+# Para archivos grandes (archivos de varias temporadas) el CSV no se carga
+# entero: se lee por bloques de tamaño acotado, cada bloque se valida y se
+# pliega en las celdas jugador × partido, y se descarta. Lo único que se
+# conserva entre bloques son las celdas ya agregadas.
+TAM_BLOQUE = 100_000                              # Filas por bloque
+BLOQUES_POR_COMBINACION = 8                       # Bloques acumulados antes de plegarlos
+UMBRAL_INGESTA_POR_BLOQUES = 20 * 1024 * 1024     # Bytes a partir de los cuales se usa
+
+
+def ingerir_por_bloques(origen, tam_bloque=TAM_BLOQUE, progreso=None, al_validar=None):
+    return ingerir_bloques(pd.read_csv(origen, chunksize=tam_bloque), progreso, al_validar)
+
+
+def ingerir_bloques(bloques, progreso=None, al_validar=None):
+    # Modelo a partir de bloques de filas crudas (de un CSV o de un Excel).
+    # `progreso(filas)`, si se indica, se llama tras cada bloque con las filas
+    # leídas hasta el momento (y puede lanzar una excepción para interrumpir);
+    # `al_validar(bloque)` recibe cada bloque ya validado (p. ej. para guardarlo)
+    partes = []
+    estado = {}
+    primera_fila = 2
+    for bloque in bloques:
+        validar_columnas(bloque.columns)
+        bloque = validar_datos(bloque[columnas_esperadas], primera_fila, estado)
+        primera_fila += len(bloque)
+        if al_validar is not None:
+            al_validar(bloque)
+        partes.append(celdas_de(bloque))
+        if len(partes) >= BLOQUES_POR_COMBINACION:
+            partes = [combinar_celdas(*partes)]
+        if progreso is not None:
+            progreso(primera_fila - 2)
+
+    if not partes:
+        raise ArchivoInvalido("Archivo inválido. No contiene ninguna fila.")
+    celdas = partes[0] if len(partes) == 1 else combinar_celdas(*partes)
+    return modelo_desde_celdas(compactar(celdas))
+
+
+def tramo_liga(cubo, total_jornadas=TOTAL_JORNADAS):
+    corte_liga = total_jornadas // 2
+    return pd.Series(
+        np.select(
+            [cubo["JORNADA"] == 0, cubo["JORNADA"] <= corte_liga],
+            ["-", "Primera vuelta"],
+            "Segunda vuelta",
+        ),
+        index=cubo.index,
+    )
+
+
+def agregar_cubo(cubo, por, total_jornadas=TOTAL_JORNADAS):
+    # Roll-up por cualquier combinación de NOMBRE, COMPETICION, RIVAL y TRAMO (vuelta de Liga)
+    if "TRAMO" in por:
+        cubo = cubo.assign(TRAMO=tramo_liga(cubo, total_jornadas))
+    totales = cubo.groupby(por, observed=True).agg(**AGREGADOS_CUBO)
+    totales["NOTA_SUMA"] = sumas_de_notas(totales["NOTA_SUMA"])
+    totales["NOTA_MEDIA"] = totales["NOTA_SUMA"] / totales["NOTA_N"]
+    return totales
+
+
+def totales_particiones(particiones, comp_filtro, temporadas=None, por=("NOMBRE",)):
+    # Roll-up de los totales de las particiones seleccionadas (ver
+    # modelo_desde_celdas). Cada partido está en una sola partición, así que
+    # los partidos jugados también se suman.
+    seleccion = particiones.index.get_level_values("COMPETICION").isin(comp_filtro)
+    if temporadas is not None:
+        seleccion &= particiones.index.get_level_values("TEMPORADA").isin(temporadas)
+    totales = particiones[seleccion].groupby(level=list(por), observed=True)[list(AGREGADOS_CUBO)].sum()
+    totales["NOTA_SUMA"] = sumas_de_notas(totales["NOTA_SUMA"])
+    totales["NOTA_MEDIA"] = totales["NOTA_SUMA"] / totales["NOTA_N"]
+    return totales
+
+
+def totales_de(totales, nombres):
+    # Filas de totales para jugadores concretos (ceros si no jugaron con los filtros actuales)
+    filas = totales.reindex(nombres, fill_value=0)
+    filas["NOTA_MEDIA"] = filas["NOTA_SUMA"] / filas["NOTA_N"]
+    return filas
+
+
+def totales_equipo(partidos):
+    nota_suma = sumas_de_notas(partidos["NOTA_SUMA"].sum())
+    return {
+        "NOTA_SUMA": nota_suma,
+        "NOTA_N": partidos["NOTA_N"].sum(),
+        "NOTA_MEDIA": nota_suma / partidos["NOTA_N"].sum(),
+        "GOLES": partidos["GOLES"].sum(),
+        "ASISTENCIAS": partidos["ASISTENCIAS"].sum(),
+        "G/A": partidos["G/A"].sum(),
+        "GOLES_EN_CONTRA": partidos["GOLES_EN_CONTRA"].sum(),
+        "MINUTOS_TOTALES": partidos["MINS_JUGADOS"].sum(),
+        "PARTIDOS_JUGADOS": len(partidos),  # Una fila por partido (PARTIDO_ID)
+    }
+
+
+def calcular_por_partido(total, partidos):
+    return round(total / partidos, 2) if partidos else 0
+
+
+def columnas_resumen(tipo_stat, equipo=False):
+    if tipo_stat == "NOTA":
+        columnas = ["NOMBRE", "NOTA_MEDIA", "PARTIDOS_JUGADOS", "MINUTOS_TOTALES"]
+    elif tipo_stat == "GOLES" and equipo:
+        columnas = ["NOMBRE","GOLES","GOLES_POR_PARTIDO","GOLES_EN_CONTRA","DIFERENCIA_GOLES","PARTIDOS_JUGADOS","MINUTOS_TOTALES"]
+    else:
+        columnas = ["NOMBRE", tipo_stat, f"{tipo_stat}_POR_PARTIDO", "PARTIDOS_JUGADOS", "MINUTOS_TOTALES"]
+    return columnas if equipo else columnas + ["PARTIDOS_REALES"]
+
+
+def fila_resumen(nombre, totales, tipo_stat, equipo=False):
+    # Fila de la tabla "Resumen de participación" a partir de los totales del cubo
+    partidos = totales["PARTIDOS_JUGADOS"]
+    fila = {
+        "NOMBRE": nombre,
+        "PARTIDOS_JUGADOS": partidos,
+        "MINUTOS_TOTALES": totales["MINUTOS_TOTALES"],
+    }
+    if not equipo:
+        fila["PARTIDOS_REALES"] = round(totales["MINUTOS_TOTALES"] / 90, 2)
+
+    if tipo_stat == "NOTA":
+        fila["NOTA_MEDIA"] = round(totales["NOTA_MEDIA"], 2)
+
+    elif tipo_stat == "GOLES" and equipo:
+        total = totales["GOLES"]
+        goles_en_contra_total = totales["GOLES_EN_CONTRA"]
+        fila.update({"GOLES": total, "GOLES_EN_CONTRA": goles_en_contra_total, "DIFERENCIA_GOLES": total - goles_en_contra_total})
+        fila["GOLES_POR_PARTIDO"] = calcular_por_partido(total, partidos)
+
+    else:
+        total = totales[tipo_stat]
+        fila.update({tipo_stat: total, f"{tipo_stat}_POR_PARTIDO": calcular_por_partido(total, partidos)})
+
+    return fila
+
+
+def calcular_equipo_por_partido(partidos):
+    # Serie temporal del Equipo General: una fila por partido
+    df_equipo = partidos[DIMENSIONES_PARTIDO + ["NOTA", "GOLES", "ASISTENCIAS", "G/A", "GOLES_EN_CONTRA"]].copy()
+    # Redondeamos nota para hover
+    df_equipo["NOTA"] = df_equipo["NOTA"].round(2)
+    return df_equipo
+
+
+def calcular_ranking_notas(totales, equipo, alpha=ALPHA, k=K, gamma=GAMMA, beta=BETA):
+    # Devuelve (fila del Equipo General, ranking de jugadores por Nota Ajustada)
+    media_global = equipo["NOTA_MEDIA"]
+
+    # Datos base por jugador (ya agregados en el cubo)
+    ranking_notas = totales[["NOTA_MEDIA", "PARTIDOS_JUGADOS", "MINUTOS_TOTALES"]].reset_index()
+
+    # Calculamos máximo de minutos para normalizar el bonus
+    minutos_max = ranking_notas["MINUTOS_TOTALES"].replace(0, 1).max()
+
+    # Paso 1: peso no lineal por minutos (partidos equivalentes ^ alpha)
+    ranking_notas["PESO_MINUTOS"] = (ranking_notas["MINUTOS_TOTALES"] / 90.0) ** alpha
+
+    # Paso 2: base ponderada entre nota del jugador y media global
+    ranking_notas["BASE"] = (
+        (ranking_notas["PESO_MINUTOS"] * ranking_notas["NOTA_MEDIA"] + k * media_global)
+        / (ranking_notas["PESO_MINUTOS"] + k)
+    )
+
+    # Paso 3: bonus por minutos jugados (normalizado respecto al máximo/2)
+    ranking_notas["BONUS"] = gamma * (ranking_notas["MINUTOS_TOTALES"] / minutos_max) ** beta
+
+    # Paso 4: nota ajustada final
+    ranking_notas["NOTA_AJUSTADA"] = (ranking_notas["BASE"] + ranking_notas["BONUS"]).round(2)
+    ranking_notas["NOTA_MEDIA"] = ranking_notas["NOTA_MEDIA"].round(2)
+
+    # Añadimos columna de partidos reales
+    ranking_notas["PARTIDOS_REALES"] = (ranking_notas["MINUTOS_TOTALES"] / 90).round(2)
+
+    # -------------------------------
+    # Equipo general
+    # -------------------------------
+    nota_ajustada_equipo = round(ranking_notas["NOTA_AJUSTADA"].mean(), 2)
+    nota_media_equipo = round(ranking_notas["NOTA_MEDIA"].mean(), 2)
+
+    equipo_notas = pd.DataFrame({
+        "POS": ["-"],
+        "NOMBRE": ["Equipo General"],
+        "NOTA_AJUSTADA": [nota_ajustada_equipo],
+        "NOTA_MEDIA": [nota_media_equipo],
+        "PARTIDOS_JUGADOS": [equipo["PARTIDOS_JUGADOS"]],
+        "MINUTOS_TOTALES": [equipo["MINUTOS_TOTALES"]],
+    })
+
+    # -------------------------------
+    # Ranking final de jugadores
+    # -------------------------------
+    orden = orden_por_nota(ranking_notas["NOTA_AJUSTADA"].to_numpy(dtype=float), ranking_notas["NOMBRE"].to_numpy())
+    ranking_jugadores = ranking_notas.iloc[orden].reset_index(drop=True)
+    ranking_jugadores.insert(0, "POS", range(1, len(ranking_jugadores) + 1))
+
+    # Columnas a mostrar
+    columnas_equipo = [
+        "POS", "NOMBRE", "NOTA_AJUSTADA", "NOTA_MEDIA",
+        "PARTIDOS_JUGADOS", "MINUTOS_TOTALES"
+    ]
+
+    columnas_jugadores = columnas_equipo + ["PARTIDOS_REALES"]
+
+    ranking_jugadores = ranking_jugadores[columnas_jugadores]
+    equipo_notas = equipo_notas[columnas_equipo]
+
+    return equipo_notas, ranking_jugadores
+
+
+def barrido_nota_ajustada(totales, equipo, alphas, ks, gammas, betas):
+    # Nota Ajustada de todos los jugadores para toda la rejilla (α, k, γ, β) de
+    # una vez: cada parámetro ocupa un eje y los jugadores el último, de modo
+    # que la fórmula se evalúa por broadcasting sin bucles.
+    # Devuelve (combinaciones, notas) con notas de forma (combinaciones, jugadores)
+    combinaciones = pd.MultiIndex.from_product(
+        [alphas, ks, gammas, betas], names=["ALPHA", "K", "GAMMA", "BETA"]
+    ).to_frame(index=False)
+    minutos = totales["MINUTOS_TOTALES"].to_numpy(dtype=float)
+    nota = totales["NOTA_MEDIA"].to_numpy(dtype=float)
+    if len(minutos) == 0:
+        return combinaciones, np.empty((len(combinaciones), 0))
+    minutos_max = np.where(minutos == 0, 1, minutos).max()
+
+    alpha = np.asarray(alphas, dtype=float)[:, None, None, None, None]
+    k = np.asarray(ks, dtype=float)[None, :, None, None, None]
+    gamma = np.asarray(gammas, dtype=float)[None, None, :, None, None]
+    beta = np.asarray(betas, dtype=float)[None, None, None, :, None]
+
+    peso = (minutos / 90.0) ** alpha                                # (A, 1, 1, 1, J)
+    base = (peso * nota + k * equipo["NOTA_MEDIA"]) / (peso + k)    # (A, K, 1, 1, J)
+    bonus = gamma * (minutos / minutos_max) ** beta                 # (1, 1, G, B, J)
+    notas = np.round(base + bonus, 2).reshape(-1, len(minutos))
+    return combinaciones, notas
+
+
+def orden_por_nota(notas, nombres):
+    # Orden del ranking por Nota Ajustada en cada fila de `notas` (o en `notas`
+    # si es 1-D): de mayor a menor, sin nota al final y los empates por NOMBRE.
+    # El ranking y el barrido usan este mismo orden, así que sus POS coinciden.
+    nombres = np.asarray(nombres, dtype=object)
+    rango_nombre = np.empty(len(nombres), dtype=np.int64)
+    rango_nombre[np.argsort(nombres, kind="stable")] = np.arange(len(nombres))
+    clave_nota = -np.nan_to_num(notas, nan=-np.inf)
+    return np.lexsort((np.broadcast_to(rango_nombre, clave_nota.shape), clave_nota), axis=-1)
+
+
+def posiciones_barrido(notas, nombres):
+    # POS de cada jugador en cada combinación (1 = mejor nota; sin nota, al final)
+    orden = orden_por_nota(notas, nombres)
+    posiciones = np.empty_like(orden)
+    np.put_along_axis(posiciones, orden, np.broadcast_to(np.arange(1, notas.shape[1] + 1), orden.shape), axis=1)
+    return posiciones
+
+
+def estabilidad_posiciones(totales, notas, ranking_jugadores):
+    # Cuánto se mueve la POS de cada jugador a lo largo de la rejilla respecto a
+    # la POS con los parámetros actuales
+    posiciones = posiciones_barrido(notas, totales.index)
+    pos_actual = ranking_jugadores.set_index("NOMBRE")["POS"].reindex(totales.index).to_numpy()
+    estabilidad = pd.DataFrame({
+        "POS": pos_actual,
+        "NOMBRE": totales.index,
+        "POS_MEJOR": posiciones.min(axis=0),
+        "POS_PEOR": posiciones.max(axis=0),
+        "POS_MEDIA": posiciones.mean(axis=0).round(2),
+        "DESV_POS": posiciones.std(axis=0).round(2),
+        "%_MISMA_POS": (100 * (posiciones == pos_actual).mean(axis=0)).round(1),
+        "NOTA_AJUSTADA_MIN": notas.min(axis=0),
+        "NOTA_AJUSTADA_MAX": notas.max(axis=0),
+    })
+    return estabilidad.sort_values("POS").reset_index(drop=True)
+
+
+def calcular_ranking_ofensivo(totales, equipo):
+    # Devuelve (fila del Equipo General, ranking de jugadores por G/A)
+    # Ranking individual de jugadores (ya agregados en el cubo)
+    ranking_ofensivo = totales[["GOLES", "ASISTENCIAS", "G/A", "PARTIDOS_JUGADOS", "MINUTOS_TOTALES"]].reset_index()
+    ranking_ofensivo["GOLES_POR_PARTIDO"] = (ranking_ofensivo["GOLES"] / ranking_ofensivo["PARTIDOS_JUGADOS"]).round(2)
+    ranking_ofensivo["ASISTENCIAS_POR_PARTIDO"] = (ranking_ofensivo["ASISTENCIAS"] / ranking_ofensivo["PARTIDOS_JUGADOS"]).round(2)
+    ranking_ofensivo["G/A_POR_PARTIDO"] = (ranking_ofensivo["G/A"] / ranking_ofensivo["PARTIDOS_JUGADOS"]).round(2)
+    ranking_ofensivo["PARTIDOS_REALES"] = (ranking_ofensivo["MINUTOS_TOTALES"] / 90).round(2)
+
+    # Ordenamos jugadores por G/A
+    ranking_jugadores_of = ranking_ofensivo.sort_values("G/A", ascending=False).reset_index(drop=True)
+    ranking_jugadores_of.insert(0, "POS", range(1, len(ranking_jugadores_of)+1))
+
+    # -----------------------
+    # Equipo General
+    # -----------------------
+    goles_en_contra_total = equipo["GOLES_EN_CONTRA"]
+    diferencia_total = equipo["GOLES"] - goles_en_contra_total
+
+    equipo_of = pd.DataFrame({
+        "POS": ["-"],
+        "NOMBRE": ["Equipo General"],
+        "GOLES": [equipo["GOLES"]],
+        "GOLES_EN_CONTRA": [goles_en_contra_total],
+        "DIFERENCIA_GOLES": [diferencia_total],
+        "GOLES_POR_PARTIDO": [(equipo["GOLES"] / equipo["PARTIDOS_JUGADOS"]).round(2)],
+        "PARTIDOS_JUGADOS": [equipo["PARTIDOS_JUGADOS"]],
+    })
+
+    ranking_jugadores_of = ranking_jugadores_of[[
+        "POS", "NOMBRE", "G/A", "GOLES", "ASISTENCIAS",
+        "GOLES_POR_PARTIDO", "ASISTENCIAS_POR_PARTIDO", "G/A_POR_PARTIDO",
+        "PARTIDOS_JUGADOS", "MINUTOS_TOTALES", "PARTIDOS_REALES"
+    ]]
+
+    return equipo_of, ranking_jugadores_of
+
+
+# Agregaciones intercambiables: cualquier objeto con estas tres funciones y el
+# mismo resultado puede sustituir a pandas en calcular_agregados
+AGREGADOR_PANDAS = SimpleNamespace(
+    nombre="pandas",
+    agregar_cubo=agregar_cubo,
+    totales_equipo=totales_equipo,
+    calcular_equipo_por_partido=calcular_equipo_por_partido,
+)
+
+
+def calcular_agregados(modelo, comp_filtro, jornadas=None, fechas=None, agregador=None, medir=None, temporadas=None):
+    # Todo lo que necesitan las secciones para un estado de filtros dado. El
+    # filtrado usa siempre los índices del modelo; las agregaciones las hace
+    # `agregador` (pandas por defecto, ver AGREGADOR_PANDAS y motor_duckdb).
+    # Sin filtros dentro de las particiones (jornadas o fechas) los totales
+    # por jugador salen de los totales por partición, con cualquier agregador.
+    # El agregador recibe siempre las tablas ya filtradas en memoria: DuckDB
+    # no lee el almacén.
+    # `medir(nombre)`, si se indica, devuelve un context manager que mide cada paso.
+    agregador = agregador or AGREGADOR_PANDAS
+    medir = medir or (lambda nombre: nullcontext())
+    with medir("filtros.rangos"):
+        cubo_filtrado = filtrar_rangos(modelo["cubo"], modelo["indice_cubo"], comp_filtro, jornadas, fechas, temporadas)
+        partidos_filtrados = filtrar_rangos(
+            modelo["partidos"], modelo["indice_partidos"], comp_filtro, jornadas, fechas, temporadas
+        )
+    with medir("estadisticas.totales"):
+        if jornadas is None and fechas is None and "particiones" in modelo:
+            totales = totales_particiones(modelo["particiones"], comp_filtro, temporadas)
+        else:
+            totales = agregador.agregar_cubo(cubo_filtrado, ["NOMBRE"])
+    with medir("estadisticas.equipo"):
+        equipo = agregador.totales_equipo(partidos_filtrados)
+        df_equipo = agregador.calcular_equipo_por_partido(partidos_filtrados)
+    with medir("ranking_notas.agregacion"):
+        ranking_notas = calcular_ranking_notas(totales, equipo)
+    with medir("ranking_ofensivo.agregacion"):
+        ranking_ofensivo = calcular_ranking_ofensivo(totales, equipo)
+    return {
+        "cubo": cubo_filtrado,
+        "partidos": partidos_filtrados,
+        "totales": totales,
+        "equipo": equipo,
+        "df_equipo": df_equipo,
+        "ranking_notas": ranking_notas,
+        "ranking_ofensivo": ranking_ofensivo,
+    }
+
+
+# -------------------------------
+# Añadir jornada (actualización incremental)
+# -------------------------------
+# Cada semana se añade una jornada. En lugar de volver a subir y recalcular la
+# temporada completa, las filas nuevas se pliegan sobre el modelo existente:
+# solo se agregan las filas nuevas y se suman a los totales acumulados de los
+# jugadores afectados y del equipo. La Nota Ajustada depende de la media del
+# equipo y del máximo de minutos, así que se vuelve a puntuar la tabla de
+# jugadores (una fila por jugador), nunca las filas de la temporada.
+def concatenar(base, nuevo):
+    # Concatena manteniendo los categóricos (con categorías ordenadas)
+    combinado = pd.concat([base, nuevo], ignore_index=True)
+    for columna in COLUMNAS_CATEGORICAS + ["TEMPORADA"]:
+        if columna in base.columns and isinstance(base[columna].dtype, pd.CategoricalDtype):
+            combinado[columna] = pd.api.types.union_categoricals(
+                [base[columna], nuevo[columna].astype("category")], sort_categories=True
+            )
+    return combinado
+
+
+def ampliar_indice(indice, tabla_nueva, desplazamiento):
+    ampliado = dict(indice)
+    for particion, entrada in indexar_rangos(tabla_nueva).items():
+        previa = indice.get(particion)
+        entrada = {**entrada, "posiciones": entrada["posiciones"] + desplazamiento}
+        if previa is not None:
+            entrada = {clave: np.concatenate([previa[clave], entrada[clave]]) for clave in entrada}
+        ampliado[particion] = entrada
+    return ampliado
+
+
+def ampliar_particiones(particiones, cubo_nuevo):
+    # Totales por partición con las celdas nuevas sumadas (son partidos
+    # posteriores, así que también los partidos jugados se suman)
+    claves = COLUMNAS_PARTICION + ["NOMBRE"]
+    suma = (
+        concatenar(particiones.reset_index(), agregar_cubo(cubo_nuevo, claves).reset_index())
+        .groupby(claves, observed=True)[list(AGREGADOS_CUBO)]
+        .sum()
+    )
+    suma["NOTA_SUMA"] = sumas_de_notas(suma["NOTA_SUMA"])
+    suma["NOTA_MEDIA"] = suma["NOTA_SUMA"] / suma["NOTA_N"]
+    return suma
+
+
+def celdas_del_modelo(modelo):
+    columnas = DIMENSIONES_PARTIDO + ["NOMBRE"] + list(AGREGACION_CELDAS)
+    return modelo["cubo"][columnas]
+
+
+def revisar_solapes(modelo, df_nuevo, primera_fila=2):
+    # Las filas nuevas de un jugador en un partido que ya está en el modelo se
+    # sumarían a las cargadas: se rechazan con el informe de errores por fila
+    claves = DIMENSIONES_PARTIDO + ["NOMBRE"]
+    cubo = modelo["cubo"]
+    cubo = cubo[cubo["FECHA"].between(df_nuevo["FECHA"].min(), df_nuevo["FECHA"].max())]
+    cargadas = pd.MultiIndex.from_frame(cubo[claves].astype(object))
+    repetidas = pd.MultiIndex.from_frame(df_nuevo[claves].astype(object)).isin(cargadas)
+    informe, total = informe_errores(
+        df_nuevo, [(repetidas, "NOMBRE", "jugador ya cargado en ese partido", None)], primera_fila
+    )
+    if total:
+        raise DatosInvalidos(informe, total)
+
+
+def anexar_a_modelo(modelo, df_nuevo):
+    # Devuelve (modelo ampliado, cubo con solo las celdas nuevas). Si las filas
+    # nuevas no son posteriores a la temporada (fechas anteriores o partidos ya
+    # cargados con jugadores nuevos) hay que renumerar y se reconstruye: el cubo
+    # nuevo es None. Las filas de celdas ya cargadas lanzan DatosInvalidos.
+    revisar_solapes(modelo, df_nuevo)
+    celdas_nuevas = celdas_de(df_nuevo)
+    partidos = modelo["partidos"]
+    if len(partidos) and celdas_nuevas["FECHA"].min() <= partidos["FECHA"].max():
+        return modelo_desde_celdas(combinar_celdas(celdas_del_modelo(modelo), celdas_nuevas)), None
+
+    # La jornada de Liga continúa la de su temporada
+    jornadas_previas = partidos.groupby("TEMPORADA", observed=True)["JORNADA"].max()
+    partidos_nuevos, cubo_nuevo = tablas_desde_celdas(
+        celdas_nuevas, len(partidos), {str(t): int(j) for t, j in jornadas_previas.items()}
+    )
+    ampliado = {
+        "partidos": concatenar(partidos, partidos_nuevos),
+        "cubo": concatenar(modelo["cubo"], cubo_nuevo),
+        "indice_partidos": ampliar_indice(modelo["indice_partidos"], partidos_nuevos, len(partidos)),
+        "indice_cubo": ampliar_indice(modelo["indice_cubo"], cubo_nuevo, len(modelo["cubo"])),
+        "particiones": ampliar_particiones(modelo["particiones"], cubo_nuevo),
+    }
+    return ampliado, cubo_nuevo
+
+
+def sumar_totales(totales, nuevos):
+    # Suma por jugador alineando índices (los jugadores nuevos entran con sus
+    # totales). Si los dos índices son categóricos, el resultado también, con
+    # la unión ordenada de sus categorías (como el cubo ampliado, ver concatenar)
+    nombres = totales.index.astype(object).union(nuevos.index.astype(object))
+    suma = totales_de(totales, nombres)[list(AGREGADOS_CUBO)] + totales_de(nuevos, nombres)[list(AGREGADOS_CUBO)]
+    suma["NOTA_SUMA"] = sumas_de_notas(suma["NOTA_SUMA"])
+    suma["NOTA_MEDIA"] = suma["NOTA_SUMA"] / suma["NOTA_N"]
+    if isinstance(totales.index, pd.CategoricalIndex) and isinstance(nuevos.index, pd.CategoricalIndex):
+        categorias = pd.api.types.union_categoricals([totales.index, nuevos.index], sort_categories=True).categories
+        suma.index = pd.CategoricalIndex(suma.index, categories=categorias)
+    suma.index.name = "NOMBRE"
+    return suma
+
+
+def actualizar_agregados(agregados, modelo, cubo_nuevo):
+    # Agregados sin filtros del modelo ampliado a partir de los de la temporada
+    # base y de las celdas nuevas
+    partidos_nuevos = modelo["partidos"].iloc[len(agregados["partidos"]):]
+    totales = sumar_totales(agregados["totales"], agregar_cubo(cubo_nuevo, ["NOMBRE"]))
+    equipo_nuevo = totales_equipo(partidos_nuevos)
+    equipo = {
+        clave: agregados["equipo"][clave] + equipo_nuevo[clave]
+        for clave in agregados["equipo"] if clave != "NOTA_MEDIA"
+    }
+    equipo["NOTA_SUMA"] = sumas_de_notas(equipo["NOTA_SUMA"])
+    equipo["NOTA_MEDIA"] = equipo["NOTA_SUMA"] / equipo["NOTA_N"]
+    return {
+        "cubo": modelo["cubo"],
+        "partidos": modelo["partidos"],
+        "totales": totales,
+        "equipo": equipo,
+        "df_equipo": concatenar(agregados["df_equipo"], calcular_equipo_por_partido(partidos_nuevos)),
+        "ranking_notas": calcular_ranking_notas(totales, equipo),
+        "ranking_ofensivo": calcular_ranking_ofensivo(totales, equipo),
+    }
+
+
+def anexar_jornada(modelo, agregados, df_nuevo):
+    # Devuelve (modelo ampliado, agregados sin filtros del modelo ampliado)
+    ampliado, cubo_nuevo = anexar_a_modelo(modelo, df_nuevo)
+    if cubo_nuevo is None:
+        competiciones = sorted(ampliado["partidos"]["COMPETICION"].unique())
+        return ampliado, calcular_agregados(ampliado, competiciones)
+    return ampliado, actualizar_agregados(agregados, ampliado, cubo_nuevo)
+
+
+# -------------------------------
+# Comparador de jugadores
+# -------------------------------
+def tramos_por_jugador(nombres):
+    # Tramo [inicio, fin) de filas de cada jugador en un array ordenado por jugador
+    if len(nombres) == 0:
+        return {}
+    inicios = np.flatnonzero(np.r_[True, nombres[1:] != nombres[:-1]])
+    fines = np.r_[inicios[1:], len(nombres)]
+    return {nombres[i]: (i, f) for i, f in zip(inicios, fines)}
+
+
+def series_comparador(cubo, jugadores):
+    # Un único filtrado y una única ordenación: cada jugador queda como un tramo
+    # contiguo de filas, de modo que las trazas se obtienen por slicing
+    seleccion = cubo[cubo["NOMBRE"].isin(jugadores)].sort_values(["NOMBRE", "FECHA"], kind="stable")
+    return seleccion, tramos_por_jugador(seleccion["NOMBRE"].to_numpy())
+
+
+# -------------------------------
+# Rivales y forma reciente
+# -------------------------------
+# Ambos análisis salen del cubo filtrado con operaciones por grupos, sin
+# recorrer los jugadores uno a uno: la matriz jugador × rival es un roll-up
+# del cubo (solo con los pares que existen) y la forma reciente son ventanas
+# móviles por jugador calculadas en una única pasada sobre el cubo ordenado
+# por jugador y fecha, como diferencias de sumas acumuladas.
+VENTANA_FORMA = 5  # Partidos de la ventana de forma reciente
+
+
+def matriz_rivales(cubo, agregador=None):
+    # Una fila por par jugador × rival con partidos (matriz dispersa en formato largo)
+    agregador = agregador or AGREGADOR_PANDAS
+    return agregador.agregar_cubo(cubo, ["NOMBRE", "RIVAL"]).reset_index()
+
+
+def tabla_rivales(matriz, columna, jugadores):
+    # Matriz densa jugadores × rivales de `columna` (NaN donde no se enfrentaron)
+    seleccion = matriz[matriz["NOMBRE"].isin(jugadores)]
+    tabla = seleccion.pivot(index="NOMBRE", columns="RIVAL", values=columna)
+    return tabla.reindex(index=jugadores, columns=sorted(seleccion["RIVAL"].unique()))
+
+
+def forma_reciente(cubo, ventana=VENTANA_FORMA):
+    # Devuelve (cubo ordenado por jugador y fecha con la forma en los últimos
+    # `ventana` partidos de cada fila, tramo de filas de cada jugador).
+    # NOTA_FORMA es la media de las notas de la ventana y G/A_FORMA la suma.
+    serie = cubo.sort_values(["NOMBRE", "FECHA"], kind="stable")
+    nombres = serie["NOMBRE"].to_numpy()
+    posiciones = np.arange(len(serie))
+    # Primera fila de la ventana: `ventana` filas atrás sin salir del jugador
+    nuevo_jugador = np.r_[True, nombres[1:] != nombres[:-1]] if len(serie) else np.zeros(0, dtype=bool)
+    inicio_jugador = np.maximum.accumulate(np.where(nuevo_jugador, posiciones, 0))
+    desde = np.maximum(posiciones - ventana + 1, inicio_jugador)
+
+    def movil(columna):
+        acumulado = np.r_[0.0, np.cumsum(serie[columna].to_numpy(dtype=np.float64))]
+        return acumulado[posiciones + 1] - acumulado[desde]
+
+    notas = movil("NOTA_N")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        nota_forma = np.where(notas > 0, sumas_de_notas(movil("NOTA_SUMA")) / notas, np.nan)
+    serie = serie.assign(**{
+        "NOTA_FORMA": nota_forma.round(2),
+        "G/A_FORMA": movil("G/A").astype(np.int64),
+        "PARTIDOS_FORMA": posiciones - desde + 1,
+    })
+    return serie, tramos_por_jugador(nombres)
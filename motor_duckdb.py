@@ -0,0 +1,232 @@
+"""Agregaciones sobre DuckDB (motor alternativo a pandas).
+
+Ejecuta como SQL, en un DuckDB en proceso con varios hilos, las mismas
+agregaciones que motor.calcular_agregados hace con pandas: totales por
+jugador (o por cualquier combinación de NOMBRE, COMPETICION, RIVAL y TRAMO),
+totales del equipo y serie temporal del equipo. Las tablas del modelo se
+leen sin copia desde pandas. La Nota Ajustada y el ranking ofensivo se
+calculan después con las funciones de motor sobre tablas de una fila por
+jugador, así que el resultado es idéntico al de pandas:
+
+    motor.calcular_agregados(modelo, competiciones, agregador=motor_duckdb)
+
+Para comprobar la paridad con pandas sobre un CSV:
+
+    python motor_duckdb.py ejemplo.csv
+
+DuckDB recibe las tablas en memoria ya filtradas por motor.filtrar_rangos: no
+consulta el almacén (.almacen) ni aplica los filtros. Los totales por jugador
+sin filtros de jornadas o fechas salen de motor.totales_particiones con
+cualquier motor, así que DuckDB solo agrega las vistas con esos filtros, la
+serie del equipo y las tablas por rival.
+"""
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+import motor
+
+try:
+    import duckdb
+except ImportError:  # DuckDB es opcional: sin él se usa pandas
+    duckdb = None
+
+nombre = "duckdb"
+
+HILOS = None  # Hilos de DuckDB (None: uno por CPU)
+
+_base = None
+_lock = threading.Lock()
+
+# Mismas métricas que motor.AGREGADOS_CUBO. Las sumas enteras se calculan en
+# BIGINT y se devuelven con el tipo de la columna del cubo, como en pandas
+FUNCIONES_SQL = {"sum": "SUM({})", "nunique": "COUNT(DISTINCT {})"}
+
+
+def disponible():
+    return duckdb is not None
+
+
+def _cursor():
+    # Una base en memoria por proceso; cada consulta usa su propio cursor, que
+    # es la forma de usar DuckDB desde varios hilos
+    global _base
+    with _lock:
+        if _base is None:
+            config = {} if HILOS is None else {"threads": HILOS}
+            _base = duckdb.connect(":memory:", config=config)
+        return _base.cursor()
+
+
+def consultar(sql, **tablas):
+    # Ejecuta `sql` con los DataFrames de `tablas` registrados como vistas
+    cursor = _cursor()
+    try:
+        for nombre_tabla, tabla in tablas.items():
+            cursor.register(nombre_tabla, tabla)
+        return cursor.execute(sql).df()
+    finally:
+        cursor.close()
+
+
+def _columna(nombre_columna, total_jornadas):
+    if nombre_columna == "TRAMO":
+        return (
+            "CASE WHEN JORNADA = 0 THEN '-' "
+            f"WHEN JORNADA <= {int(total_jornadas) // 2} THEN 'Primera vuelta' "
+            "ELSE 'Segunda vuelta' END AS TRAMO"
+        )
+    return f'"{nombre_columna}"'
+
+
+def _metrica(nombre_metrica, columna, funcion):
+    expresion = FUNCIONES_SQL[funcion].format(f'"{columna}"')
+    if nombre_metrica != "NOTA_SUMA":
+        expresion = f"CAST({expresion} AS BIGINT)"
+    return f'{expresion} AS "{nombre_metrica}"'
+
+
+def agregar_cubo(cubo, por, total_jornadas=motor.TOTAL_JORNADAS):
+    claves = ", ".join(f'"{columna}"' for columna in por)
+    metricas = ",\n            ".join(
+        _metrica(nombre_metrica, columna, funcion)
+        for nombre_metrica, (columna, funcion) in motor.AGREGADOS_CUBO.items()
+    )
+    totales = consultar(
+        f"""
+        SELECT {", ".join(_columna(columna, total_jornadas) for columna in por)},
+            {metricas}
+        FROM cubo
+        GROUP BY {claves}
+        ORDER BY {claves}
+        """,
+        cubo=cubo,
+    )
+    for columna in por:
+        # Los categóricos vuelven con las mismas categorías que en el cubo
+        if columna in cubo.columns and isinstance(cubo[columna].dtype, pd.CategoricalDtype):
+            totales[columna] = totales[columna].astype(cubo[columna].dtype)
+        elif columna == "TRAMO":
+            totales[columna] = totales[columna].astype("str")
+    for nombre_metrica, (columna, funcion) in motor.AGREGADOS_CUBO.items():
+        if funcion == "sum" and pd.api.types.is_integer_dtype(cubo[columna]):
+            totales[nombre_metrica] = totales[nombre_metrica].astype(cubo[columna].dtype)
+    totales = totales.set_index(por)
+    totales["NOTA_SUMA"] = motor.sumas_de_notas(totales["NOTA_SUMA"])
+    totales["NOTA_MEDIA"] = totales["NOTA_SUMA"] / totales["NOTA_N"]
+    return totales
+
+
+def totales_equipo(partidos):
+    fila = consultar(
+        """
+        SELECT COALESCE(SUM(NOTA_SUMA), 0) AS NOTA_SUMA,
+            CAST(COALESCE(SUM(NOTA_N), 0) AS BIGINT) AS NOTA_N,
+            CAST(COALESCE(SUM(GOLES), 0) AS BIGINT) AS GOLES,
+            CAST(COALESCE(SUM(ASISTENCIAS), 0) AS BIGINT) AS ASISTENCIAS,
+            CAST(COALESCE(SUM("G/A"), 0) AS BIGINT) AS "G/A",
+            CAST(COALESCE(SUM(GOLES_EN_CONTRA), 0) AS BIGINT) AS GOLES_EN_CONTRA,
+            CAST(COALESCE(SUM(MINS_JUGADOS), 0) AS BIGINT) AS MINUTOS_TOTALES,
+            COUNT(*) AS PARTIDOS_JUGADOS
+        FROM partidos
+        """,
+        partidos=partidos,
+    ).iloc[0]
+    equipo = {columna: np.int64(valor) for columna, valor in fila.items() if columna != "NOTA_SUMA"}
+    equipo["NOTA_SUMA"] = motor.sumas_de_notas(np.float64(fila["NOTA_SUMA"]))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        equipo["NOTA_MEDIA"] = equipo["NOTA_SUMA"] / equipo["NOTA_N"]
+    return {clave: equipo[clave] for clave in [
+        "NOTA_SUMA", "NOTA_N", "NOTA_MEDIA", "GOLES", "ASISTENCIAS", "G/A",
+        "GOLES_EN_CONTRA", "MINUTOS_TOTALES", "PARTIDOS_JUGADOS",
+    ]}
+
+
+def calcular_equipo_por_partido(partidos):
+    df_equipo = consultar(
+        """
+        SELECT PARTIDO_ID, FECHA, COMPETICION, RIVAL, NOTA, GOLES, ASISTENCIAS, "G/A", GOLES_EN_CONTRA
+        FROM partidos
+        ORDER BY PARTIDO_ID
+        """,
+        partidos=partidos,
+    )
+    # PARTIDO_ID es la posición en la tabla de partidos, igual que su índice
+    df_equipo = df_equipo.set_index(pd.Index(df_equipo.pop("PARTIDO_ID").to_numpy(), dtype=partidos.index.dtype))
+    for columna in df_equipo.columns:
+        if df_equipo[columna].dtype != partidos[columna].dtype:
+            df_equipo[columna] = df_equipo[columna].astype(partidos[columna].dtype)
+    # Mismo redondeo que pandas (mitades al par)
+    df_equipo["NOTA"] = df_equipo["NOTA"].round(2)
+    return df_equipo
+
+
+# -------------------------------
+# Paridad con pandas
+# -------------------------------
+def combinaciones_de_filtros(modelo, total_jornadas=motor.TOTAL_JORNADAS):
+    # Combinaciones de filtros representativas: todas las competiciones, cada
+    # una por separado, vueltas de Liga y un rango de fechas
+    competiciones = sorted(modelo["partidos"]["COMPETICION"].unique())
+    fechas = modelo["partidos"]["FECHA"]
+    mitad = fechas.iloc[len(fechas) // 2]
+    combinaciones = [(competiciones, None, None)]
+    combinaciones += [([comp], None, None) for comp in competiciones]
+    for vuelta in ["Primera vuelta", "Segunda vuelta"]:
+        combinaciones.append((competiciones, motor.rango_vuelta(vuelta, total_jornadas), None))
+    combinaciones.append((competiciones, None, (np.datetime64(fechas.iloc[0]), np.datetime64(mitad))))
+    antes = np.datetime64(fechas.iloc[0]) - np.timedelta64(1, "D")
+    combinaciones.append((competiciones, None, (antes, antes)))  # Sin partidos
+    return combinaciones
+
+
+def comprobar_paridad(modelo, combinaciones=None):
+    # Devuelve la lista de diferencias (vacía si ambos motores coinciden)
+    diferencias = []
+    for comp_filtro, jornadas, fechas in combinaciones or combinaciones_de_filtros(modelo):
+        filtros = f"{comp_filtro} jornadas={jornadas} fechas={fechas}"
+        with np.errstate(invalid="ignore", divide="ignore"):  # Combinaciones sin partidos
+            esperado = motor.calcular_agregados(modelo, comp_filtro, jornadas, fechas)
+            obtenido = motor.calcular_agregados(modelo, comp_filtro, jornadas, fechas, agregador=sys.modules[__name__])
+        tablas = {
+            "totales": (esperado["totales"], obtenido["totales"]),
+            "df_equipo": (esperado["df_equipo"], obtenido["df_equipo"]),
+            "ranking_notas": (pd.concat(esperado["ranking_notas"]), pd.concat(obtenido["ranking_notas"])),
+            "ranking_ofensivo": (pd.concat(esperado["ranking_ofensivo"]), pd.concat(obtenido["ranking_ofensivo"])),
+            "desglose": (
+                motor.agregar_cubo(esperado["cubo"], ["COMPETICION", "TRAMO"]),
+                agregar_cubo(obtenido["cubo"], ["COMPETICION", "TRAMO"]),
+            ),
+        }
+        for tabla, (a, b) in tablas.items():
+            try:
+                pd.testing.assert_frame_equal(a, b, check_exact=True)
+            except AssertionError as e:
+                diferencias.append(f"{filtros} · {tabla}: {e}")
+        for clave, valor in esperado["equipo"].items():
+            otro = obtenido["equipo"][clave]
+            if not (valor == otro or (np.isnan(valor) and np.isnan(otro))):
+                diferencias.append(f"{filtros} · equipo[{clave}]: {valor!r} != {otro!r}")
+    return diferencias
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not disponible():
+        print("DuckDB no está instalado")
+        return 2
+    fallos = 0
+    for ruta in argv:
+        modelo = motor.construir_cubo(motor.compactar(motor.preparar_datos(ruta)))
+        diferencias = comprobar_paridad(modelo)
+        fallos += bool(diferencias)
+        print(f"{ruta}: {'OK' if not diferencias else f'{len(diferencias)} diferencias'}")
+        for diferencia in diferencias:
+            print("  " + diferencia)
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Generador de temporadas sintéticas con el esquema de ejemplo.csv.
+
+Sirve para medir el rendimiento con plantillas y calendarios mucho mayores
+que el ejemplo (miles de jugadores, muchas temporadas):
+
+    python sintetico.py datos.csv --temporadas 20 --jugadores 2000 --por-partido 60
+
+Cada partido tiene una fecha distinta; los de Liga se numeran como jornadas
+consecutivas. Todos los jugadores de un partido comparten RIVAL y
+GOLES_EN_CONTRA, como en los datos reales.
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Partidos por temporada y competición (como en el ejemplo)
+CALENDARIO = {"Liga": 38, "Champions": 12, "Copa del Rey": 5, "Supercopa": 5}
+
+RIVALES = [
+    "Athletic Club", "Atletico Madrid", "Bayern", "Betis", "Celta", "Granada", "Inter", "Juventus",
+    "Manchester City", "PSG", "Real Madrid", "Real Sociedad", "Sevilla", "Valencia", "Villarreal",
+]
+
+COLUMNAS = ["FECHA", "NOMBRE", "COMPETICION", "GOLES", "ASISTENCIAS", "NOTA", "MINS_JUGADOS", "RIVAL", "GOLES_EN_CONTRA"]
+
+
+def calendario(temporadas, primer_anio=2000):
+    # Un partido por fecha: de mediados de agosto a finales de mayo, con las
+    # competiciones intercaladas al azar y la Liga en orden de jornadas
+    partidos = []
+    competiciones = np.repeat(list(CALENDARIO), list(CALENDARIO.values()))
+    rng = np.random.default_rng(primer_anio)
+    for temporada in range(temporadas):
+        inicio = pd.Timestamp(primer_anio + temporada, 8, 15)
+        dias = np.sort(rng.choice(np.arange(0, 285), size=len(competiciones), replace=False))
+        partidos.append(pd.DataFrame({
+            "FECHA": inicio + pd.to_timedelta(dias, unit="D"),
+            "COMPETICION": rng.permutation(competiciones),
+        }))
+    return pd.concat(partidos, ignore_index=True)
+
+
+def generar(temporadas=1, jugadores=25, por_partido=11, semilla=0, primer_anio=2000):
+    # DataFrame con el mismo formato que ejemplo.csv (FECHA como texto dd/mm/aaaa)
+    rng = np.random.default_rng(semilla)
+    por_partido = min(por_partido, jugadores)
+    partidos = calendario(temporadas, primer_anio)
+    n_partidos = len(partidos)
+    nombres = np.array([f"Jugador {i + 1:0{len(str(jugadores))}d}" for i in range(jugadores)])
+
+    # Alineaciones: `por_partido` jugadores distintos por partido, con más
+    # minutos para los habituales (los primeros de la plantilla)
+    pesos = 1.0 / np.arange(1, jugadores + 1) ** 0.5
+    pesos /= pesos.sum()
+    alineaciones = np.stack([
+        rng.choice(jugadores, size=por_partido, replace=False, p=pesos) for _ in range(n_partidos)
+    ])
+    filas = n_partidos * por_partido
+    partido = np.repeat(np.arange(n_partidos), por_partido)
+
+    goles_en_contra = rng.poisson(1.2, size=n_partidos)
+    rivales = rng.choice(RIVALES, size=n_partidos)
+    df = pd.DataFrame({
+        "FECHA": partidos["FECHA"].dt.strftime("%d/%m/%Y").to_numpy()[partido],
+        "NOMBRE": nombres[alineaciones.ravel()],
+        "COMPETICION": partidos["COMPETICION"].to_numpy()[partido],
+        "GOLES": rng.poisson(0.2, size=filas),
+        "ASISTENCIAS": rng.poisson(0.15, size=filas),
+        "NOTA": np.clip(rng.normal(7.0, 1.0, size=filas), 3.0, 10.0).round(1),
+        "MINS_JUGADOS": rng.integers(1, 91, size=filas),
+        "RIVAL": rivales[partido],
+        "GOLES_EN_CONTRA": goles_en_contra[partido],
+    })
+    return df[COLUMNAS]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un CSV sintético con el formato de la plantilla.")
+    parser.add_argument("salida", help="ruta del CSV a generar")
+    parser.add_argument("--temporadas", type=int, default=1)
+    parser.add_argument("--jugadores", type=int, default=25, help="tamaño de la plantilla")
+    parser.add_argument("--por-partido", type=int, default=11, help="jugadores con minutos en cada partido")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    df = generar(args.temporadas, args.jugadores, args.por_partido, args.semilla)
+    df.to_csv(args.salida, index=False)
+    print(f"{args.salida}: {len(df)} filas, {args.jugadores} jugadores, {args.temporadas} temporadas")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
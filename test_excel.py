@@ -0,0 +1,172 @@
+"""Lector de Excel (excel.py) con libros .xlsx mínimos escritos a mano.
+
+    python -m pytest test_excel.py
+"""
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import excel
+import motor
+
+ESPACIO = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+RELACIONES = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+
+LIBRO = (
+    f'<workbook {ESPACIO} {RELACIONES}>{{propiedades}}'
+    '<sheets><sheet name="Datos" sheetId="1" {id_relacion}/></sheets></workbook>'
+)
+RELACIONES_LIBRO = (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>'
+)
+
+# Cabecera y filas de la plantilla: textos compartidos (t="s"), en la celda
+# (t="inlineStr", también con formato) y fechas como número de serie
+COMPARTIDOS = ["FECHA", "NOMBRE", "NOTA", "GOLES", "ASISTENCIAS", "COMPETICION", "MINS_JUGADOS", "RIVAL",
+               "GOLES_EN_CONTRA", "Liga", "Pedri", "Real Madrid"]
+
+
+def celda(referencia, valor, tipo=None):
+    if tipo == "inlineStr":
+        return f'<c r="{referencia}" t="inlineStr"><is><r><t>{valor[:2]}</t></r><r><t>{valor[2:]}</t></r></is></c>'
+    atributo = f' t="{tipo}"' if tipo else ""
+    return f'<c r="{referencia}"{atributo}><v>{valor}</v></c>'
+
+
+def fila(numero, valores):
+    # `valores`: (valor, tipo) por columna desde la A
+    celdas = "".join(celda(f"{chr(65 + i)}{numero}", v, t) for i, (v, t) in enumerate(valores))
+    return f'<row r="{numero}">{celdas}</row>'
+
+
+def jugador(fecha, nombre=(10, "s"), nota="7.5", rival=(11, "s")):
+    fecha = fecha if isinstance(fecha, tuple) else (fecha, None)
+    return [fecha, nombre, (nota, None), ("1", None), ("0", None), (9, "s"), ("90", None), rival, ("2", None)]
+
+
+def hoja(*filas):
+    return f'<worksheet {ESPACIO}><sheetData>{"".join(filas)}</sheetData></worksheet>'
+
+
+def xlsx(partes):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as libro:
+        for ruta, contenido in partes.items():
+            libro.writestr(ruta, contenido)
+    return buffer.getvalue()
+
+
+def partes_de(*filas, propiedades="", id_relacion='r:id="rId1"'):
+    textos = "".join(f"<si><t>{t}</t></si>" for t in COMPARTIDOS)
+    return {
+        "xl/workbook.xml": LIBRO.format(propiedades=propiedades, id_relacion=id_relacion),
+        "xl/_rels/workbook.xml.rels": RELACIONES_LIBRO,
+        "xl/sharedStrings.xml": f'<sst {ESPACIO}>{textos}</sst>',
+        "xl/worksheets/sheet1.xml": hoja(fila(1, [(i, "s") for i in range(9)]), *filas),
+    }
+
+
+def leer(partes):
+    return excel.leer_excel(io.BytesIO(xlsx(partes)))
+
+
+def test_textos_y_fechas():
+    # 45968 es el 07/11/2025 en el sistema de 1900
+    df = leer(partes_de(fila(2, jugador("45968")), fila(3, jugador("45969.75", nombre=("Gavi", "inlineStr")))))
+    assert sorted(df.columns) == sorted(motor.columnas_esperadas)
+    assert list(df["NOMBRE"]) == ["Pedri", "Gavi"]
+    assert list(df["RIVAL"]) == ["Real Madrid", "Real Madrid"]
+    assert df["NOMBRE"].dtype == "category"
+    assert list(df["FECHA"]) == [pd.Timestamp("2025-11-07"), pd.Timestamp("2025-11-08")]
+    assert df["NOTA"].tolist() == [7.5, 7.5]
+
+
+def test_fechas_1904():
+    df = leer(partes_de(fila(2, jugador("44506")), propiedades='<workbookPr date1904="1"/>'))
+    assert df["FECHA"].iloc[0] == pd.Timestamp("2025-11-07")
+
+
+def test_fechas_como_texto():
+    df = leer(partes_de(fila(2, jugador(("07/11/2025", "str")))))
+    validado = motor.validar_datos(df)
+    assert validado["FECHA"].iloc[0] == pd.Timestamp("2025-11-07")
+
+
+def test_filas_vacias_conservan_su_numero():
+    # Las filas 3 y 5 están vacías (una sin celdas y otra sin fila): el
+    # informe de errores debe señalar las filas 4 y 6 de la hoja
+    df = leer(partes_de(
+        fila(2, jugador("45968")),
+        '<row r="3"/>',
+        fila(4, jugador("45969", nota="11")),
+        fila(6, jugador("45970", nota="12")),
+    ))
+    assert list(df.index) == [2, 4, 6]
+    with pytest.raises(motor.DatosInvalidos) as error:
+        motor.validar_datos(df)
+    informe = error.value.informe
+    assert informe["FILA"].tolist() == [4, 6]
+    assert set(informe["COLUMNA"]) == {"NOTA"}
+
+
+def test_filas_vacias_por_bloques(monkeypatch):
+    # Con la ingesta por bloques los números de fila también son los de la hoja
+    monkeypatch.setattr(excel, "TAM_LECTURA", 256)
+    filas = [fila(2 * i + 2, jugador(str(45968 + i))) for i in range(5)]
+    filas.append(fila(20, jugador("45968")))  # Repetido de la fila 2
+    with pytest.raises(motor.DatosInvalidos) as error:
+        motor.ingerir_bloques(excel.bloques(io.BytesIO(xlsx(partes_de(*filas))), filas_por_bloque=2))
+    informe = error.value.informe
+    assert informe[["FILA", "FILA_REFERENCIA"]].values.tolist() == [[20, 2]]
+
+
+def test_bloques_sin_filas_vacias(monkeypatch):
+    monkeypatch.setattr(excel, "TAM_LECTURA", 256)
+    filas = [fila(i, jugador(str(45968 + i))) for i in range(2, 12)]
+    partes = list(excel.bloques(io.BytesIO(xlsx(partes_de(*filas))), filas_por_bloque=3))
+    assert len(partes) > 1
+    assert np.concatenate([p.index for p in partes]).tolist() == list(range(2, 12))
+
+
+def sin(partes, ruta):
+    return {k: v for k, v in partes.items() if k != ruta}
+
+
+CORRUPTOS = {
+    "zip_sin_libro": {"a.txt": "no es un libro"},
+    "sin_relaciones": sin(partes_de(fila(2, jugador("45968"))), "xl/_rels/workbook.xml.rels"),
+    "hoja_sin_id": partes_de(fila(2, jugador("45968")), id_relacion=""),
+    "sin_hoja": sin(partes_de(fila(2, jugador("45968"))), "xl/worksheets/sheet1.xml"),
+    "libro_no_xml": {**partes_de(fila(2, jugador("45968"))), "xl/workbook.xml": "<workbook"},
+    "hoja_no_xml": {**partes_de(fila(2, jugador("45968"))), "xl/worksheets/sheet1.xml": "<worksheet><sheetData>"},
+    "texto_compartido_inexistente": partes_de(fila(2, jugador("45968", nombre=(99, "s")))),
+    "numero_no_valido": partes_de(fila(2, jugador("45968", nota="siete"))),
+}
+
+
+@pytest.mark.parametrize("caso", list(CORRUPTOS))
+def test_archivo_corrupto(caso):
+    contenido = xlsx(CORRUPTOS[caso])
+    with pytest.raises(motor.ArchivoInvalido):
+        excel.leer_excel(io.BytesIO(contenido))
+    with pytest.raises(motor.ArchivoInvalido):
+        list(excel.bloques(io.BytesIO(contenido)))
+
+
+def test_zip_danado():
+    contenido = bytearray(xlsx(partes_de(fila(2, jugador("45968")))))
+    contenido[len(contenido) // 2:] = b"\0" * (len(contenido) - len(contenido) // 2)
+    assert excel.es_excel(bytes(contenido))
+    with pytest.raises(motor.ArchivoInvalido):
+        excel.leer_excel(io.BytesIO(bytes(contenido)))
+
+
+def test_plantilla():
+    df = excel.leer_excel("plantilla_estadisticas.xlsx")
+    validado = motor.validar_datos(df)
+    assert len(validado) == 1
+    assert validado["NOTA"].iloc[0] == pytest.approx(8.4)
@@ -0,0 +1,53 @@
+"""Reducción de series con LTTB (graficos.py).
+
+    python -m pytest test_graficos.py
+"""
+import numpy as np
+import pytest
+
+import graficos
+
+
+@pytest.mark.parametrize("n", [3, 10, 100, 999])
+def test_lttb_puntos(n):
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 20)
+    indices = graficos.lttb(x, y, n)
+    assert len(indices) == n
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert (np.diff(indices) > 0).all()
+
+
+@pytest.mark.parametrize("n", [0, 2, 1000, 5000])
+def test_lttb_sin_reducir(n):
+    # Con n menor que 3 o mayor o igual que el número de puntos no se reduce
+    assert graficos.lttb(np.arange(1000), np.zeros(1000), n).tolist() == list(range(1000))
+
+
+def test_lttb_conserva_picos():
+    x = np.arange(10_000, dtype=np.float64)
+    y = np.zeros(10_000)
+    picos = [1234, 5678, 9000]
+    y[picos] = [10, -10, 5]
+    indices = graficos.lttb(x, y, 50)
+    assert set(picos) <= set(indices.tolist())
+
+
+def test_lttb_con_huecos():
+    # Los NaN (p. ej. partidos sin nota) no rompen la reducción
+    y = np.where(np.arange(2000) % 3 == 0, np.nan, np.cos(np.arange(2000) / 50))
+    assert len(graficos.lttb(np.arange(2000), y, 100)) == 100
+
+
+def test_traza_reducida():
+    n = graficos.MAX_PUNTOS_TRAZA * 3
+    serie = {
+        "x": np.arange(n, dtype=np.float64),
+        "y": np.random.default_rng(0).normal(size=n).astype(np.float32),
+        "customdata": np.zeros((n, 1), dtype=np.float32),
+        "text": np.full(n, "Liga", dtype=object),
+        "hovertext": np.full(n, "Betis", dtype=object),
+    }
+    traza = graficos.traza(serie, ["NOTA"])
+    assert len(traza.x) == len(traza.customdata) == len(traza.text) == graficos.MAX_PUNTOS_TRAZA
+    assert traza.x[0] == 0 and traza.x[-1] == n - 1
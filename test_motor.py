@@ -0,0 +1,152 @@
+"""Validación de filas y anexado de jornadas del motor.
+
+    python -m pytest test_motor.py
+"""
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import motor
+import sintetico
+
+
+@pytest.fixture(scope="module")
+def filas():
+    # Una temporada ya validada, en orden de fecha
+    df = motor.compactar(motor.validar_datos(sintetico.generar(1, 20, 11)))
+    return df.sort_values("FECHA", kind="stable").reset_index(drop=True)
+
+
+def construir(df):
+    modelo = motor.construir_cubo(motor.compactar(df))
+    return modelo, motor.calcular_agregados(modelo, sorted(modelo["partidos"]["COMPETICION"].unique()))
+
+
+def comparar(obtenidos, esperados):
+    # Mismos valores y tipos (también los del índice)
+    for clave, esperado in esperados.items():
+        obtenido = obtenidos[clave]
+        if isinstance(esperado, tuple):
+            for a, b in zip(obtenido, esperado):
+                pd.testing.assert_frame_equal(a, b, check_exact=True)
+        elif isinstance(esperado, dict):
+            assert obtenido == esperado, clave
+        else:
+            pd.testing.assert_frame_equal(obtenido, esperado, check_exact=True, check_categorical=True)
+
+
+def con_jugador_nuevo(df):
+    # Algunas filas pasan a un jugador que no estaba en la temporada
+    nombres = df["NOMBRE"].astype(str).where(np.arange(len(df)) % 7 != 0, "Zz Nuevo")
+    return motor.compactar(df.assign(NOMBRE=nombres))
+
+
+@pytest.mark.parametrize("nuevo", [False, True], ids=["mismos_jugadores", "jugador_nuevo"])
+def test_anexar_igual_que_reconstruir(filas, nuevo):
+    corte = filas["FECHA"].iloc[int(len(filas) * 0.8)]
+    base, anexo = filas[filas["FECHA"] < corte], filas[filas["FECHA"] >= corte]
+    if nuevo:
+        anexo = con_jugador_nuevo(anexo)
+    modelo, agregados = construir(base)
+    modelo_anexado, agregados_anexados = motor.anexar_jornada(modelo, agregados, motor.compactar(anexo))
+    modelo_completo, agregados_completos = construir(motor.concatenar(base, anexo))
+
+    comparar(agregados_anexados, agregados_completos)
+    for tabla in ["partidos", "cubo"]:
+        pd.testing.assert_frame_equal(modelo_anexado[tabla], modelo_completo[tabla], check_exact=True)
+    assert isinstance(agregados_anexados["totales"].index, pd.CategoricalIndex)
+
+
+def test_anexar_filas_anteriores_reconstruye(filas):
+    # Filas anteriores al final de la temporada: se renumera y se reconstruye
+    corte = filas["FECHA"].iloc[len(filas) // 2]
+    base, anexo = filas[filas["FECHA"] >= corte], filas[filas["FECHA"] < corte]
+    modelo, agregados = construir(base)
+    _, agregados_anexados = motor.anexar_jornada(modelo, agregados, motor.compactar(anexo))
+    _, agregados_completos = construir(motor.concatenar(base, anexo))
+    comparar(agregados_anexados, agregados_completos)
+
+
+def test_anexar_filas_repetidas(filas):
+    corte = filas["FECHA"].iloc[int(len(filas) * 0.8)]
+    anexo = filas[filas["FECHA"] >= corte].reset_index(drop=True)
+    modelo, agregados = construir(filas)
+    with pytest.raises(motor.DatosInvalidos) as error:
+        motor.anexar_jornada(modelo, agregados, anexo)
+    informe = error.value.informe
+    assert error.value.total == len(anexo)
+    assert informe["FILA"].tolist() == list(range(2, len(anexo) + 2))
+    assert set(informe["ERROR"]) == {"jugador ya cargado en ese partido"}
+
+
+# -------------------------------
+# Validación de filas
+# -------------------------------
+CSV_VALIDO = """FECHA,NOMBRE,COMPETICION,GOLES,ASISTENCIAS,NOTA,MINS_JUGADOS,RIVAL,GOLES_EN_CONTRA
+10/08/2025,Pedri,Liga,0,1,7.5,90,Valencia,1
+10/08/2025,Gavi,Liga,1,0,,80,Valencia,1
+17/08/2025,Pedri,Liga,0,0,6.0,90,Betis,0
+"""
+
+
+def leer(texto):
+    return motor.leer_csv(io.StringIO(texto))
+
+
+def errores(texto):
+    with pytest.raises(motor.DatosInvalidos) as error:
+        motor.validar_datos(leer(texto))
+    return error.value.informe
+
+
+def test_validar_datos_validos():
+    df = motor.validar_datos(leer(CSV_VALIDO))
+    assert pd.api.types.is_datetime64_any_dtype(df["FECHA"])
+    assert df["G/A"].tolist() == [1, 1, 0]
+    assert df["NOTA"].isna().tolist() == [False, True, False]
+
+
+@pytest.mark.parametrize("fila, columna, error", [
+    ("31/02/2025,Pedri,Liga,0,0,7,90,Betis,0", "FECHA", "fecha no válida (DD/MM/AAAA o AAAA-MM-DD)"),
+    ("24/08/2025,Pedri,Liga,0,0,11,90,Betis,0", "NOTA", "fuera de rango (0 a 10)"),
+    ("24/08/2025,Pedri,Liga,-1,0,7,90,Betis,0", "GOLES", "menor que 0"),
+    ("24/08/2025,Pedri,Liga,1.5,0,7,90,Betis,0", "GOLES", "no es un número entero"),
+    ("24/08/2025,Pedri,Liga,0,0,7,noventa,Betis,0", "MINS_JUGADOS", "no es un número"),
+    ("24/08/2025,,Liga,0,0,7,90,Betis,0", "NOMBRE", "vacío"),
+])
+def test_validar_valores(fila, columna, error):
+    informe = errores(CSV_VALIDO + fila + "\n")
+    assert informe[["FILA", "COLUMNA", "ERROR"]].values.tolist() == [[5, columna, error]]
+
+
+def test_validar_repetidos_y_contradicciones():
+    informe = errores(
+        CSV_VALIDO
+        + "10/08/2025,Pedri,Liga,0,0,7,90,Valencia,1\n"   # Pedri ya jugó ese partido (fila 2)
+        + "17/08/2025,Gavi,Liga,0,0,7,90,Sevilla,0\n"     # Otro rival en la misma fecha (fila 4)
+    )
+    assert informe[["FILA", "COLUMNA", "FILA_REFERENCIA"]].values.tolist() == [
+        [5, "NOMBRE", 2],
+        [6, "RIVAL", 4],
+    ]
+
+
+def test_validar_por_bloques():
+    # Las filas y los repetidos se cuentan en todo el archivo, no por bloque
+    texto = CSV_VALIDO + "24/08/2025,Pedri,Liga,0,0,7,90,Betis,0\n" + "10/08/2025,Gavi,Liga,0,0,7,90,Valencia,1\n"
+    with pytest.raises(motor.DatosInvalidos) as error:
+        motor.ingerir_por_bloques(io.StringIO(texto), tam_bloque=2)
+    assert error.value.informe[["FILA", "FILA_REFERENCIA"]].values.tolist() == [[6, 3]]
+
+
+def test_informe_limitado():
+    fila = "24/08/2025,Pedri,Liga,0,0,11,90,Betis,0\n"
+    texto = CSV_VALIDO.split("\n", 1)[0] + "\n" + fila * 50
+    with pytest.raises(motor.DatosInvalidos):
+        motor.validar_datos(leer(texto))
+    informe, total = motor.informe_errores(
+        leer(texto), [(np.ones(50, dtype=bool), "NOTA", "fuera de rango (0 a 10)", None)], limite=10
+    )
+    assert total == 50 and len(informe) == 10
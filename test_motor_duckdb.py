@@ -0,0 +1,146 @@
+"""Paridad de las agregaciones de DuckDB con las de pandas.
+
+Cada combinación de filtros se aplica con los índices del modelo y las dos
+implementaciones agregan el mismo cubo filtrado: así se comparan las
+consultas SQL en todos los casos, también en los que la app toma los
+totales sin filtros de motor.totales_particiones.
+
+    python -m pytest test_motor_duckdb.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import motor
+import motor_duckdb
+import sintetico
+
+pytestmark = pytest.mark.skipif(not motor_duckdb.disponible(), reason="DuckDB no está instalado")
+
+
+@pytest.fixture(scope="module")
+def modelo():
+    # Dos temporadas con todas las competiciones
+    return motor.construir_cubo(motor.compactar(motor.validar_datos(sintetico.generar(2, 30, 14))))
+
+
+def competiciones(modelo):
+    return sorted(modelo["partidos"]["COMPETICION"].unique())
+
+
+def temporadas(modelo):
+    return list(modelo["partidos"]["TEMPORADA"].cat.categories)
+
+
+def fechas_de(modelo, desde, hasta):
+    fechas = modelo["partidos"]["FECHA"].sort_values()
+    return np.datetime64(fechas.iloc[desde]), np.datetime64(fechas.iloc[hasta])
+
+
+def antes_de_empezar(modelo):
+    antes = fechas_de(modelo, 0, 0)[0] - np.timedelta64(1, "D")
+    return antes, antes
+
+
+# Filtros de cada caso: modelo -> (competiciones, jornadas, fechas, temporadas)
+FILTROS = {
+    "todo": lambda m: (competiciones(m), None, None, None),
+    "temporada": lambda m: (competiciones(m), None, None, temporadas(m)[:1]),
+    "ultima_temporada": lambda m: (competiciones(m), None, None, temporadas(m)[-1:]),
+    "competicion": lambda m: (["Champions"], None, None, None),
+    "liga": lambda m: (["Liga"], None, None, None),
+    "temporada_y_competicion": lambda m: (["Liga", "Copa del Rey"], None, None, temporadas(m)[-1:]),
+    "fechas": lambda m: (competiciones(m), None, fechas_de(m, 10, len(m["partidos"]) // 2), None),
+    "fechas_y_temporada": lambda m: (competiciones(m), None, fechas_de(m, 0, -1), temporadas(m)[1:]),
+    "primera_vuelta": lambda m: (competiciones(m), motor.rango_vuelta("Primera vuelta"), None, None),
+    "segunda_vuelta": lambda m: (["Liga"], motor.rango_vuelta("Segunda vuelta"), None, temporadas(m)[:1]),
+    "jornadas": lambda m: (competiciones(m), (5, 12), None, None),
+    "jornadas_y_fechas": lambda m: (["Liga"], (3, 30), fechas_de(m, 20, -20), None),
+    "sin_partidos": lambda m: (competiciones(m), None, antes_de_empezar(m), None),
+}
+
+AGRUPACIONES = [
+    ["NOMBRE"],
+    ["COMPETICION", "TRAMO"],
+    ["TEMPORADA", "COMPETICION", "NOMBRE"],
+    ["NOMBRE", "RIVAL"],
+]
+
+
+def filtrados(modelo, caso):
+    comp_filtro, jornadas, fechas, temporadas_filtro = FILTROS[caso](modelo)
+    cubo = motor.filtrar_rangos(
+        modelo["cubo"], modelo["indice_cubo"], comp_filtro, jornadas, fechas, temporadas_filtro
+    )
+    partidos = motor.filtrar_rangos(
+        modelo["partidos"], modelo["indice_partidos"], comp_filtro, jornadas, fechas, temporadas_filtro
+    )
+    return cubo, partidos
+
+
+@pytest.mark.parametrize("por", AGRUPACIONES, ids="+".join)
+@pytest.mark.parametrize("caso", list(FILTROS))
+def test_agregar_cubo(modelo, caso, por):
+    cubo, _ = filtrados(modelo, caso)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        esperado = motor.agregar_cubo(cubo, por)
+        obtenido = motor_duckdb.agregar_cubo(cubo, por)
+    pd.testing.assert_frame_equal(esperado, obtenido, check_exact=True)
+
+
+@pytest.mark.parametrize("caso", list(FILTROS))
+def test_totales_equipo(modelo, caso):
+    _, partidos = filtrados(modelo, caso)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        esperado = motor.totales_equipo(partidos)
+        obtenido = motor_duckdb.totales_equipo(partidos)
+    assert list(esperado) == list(obtenido)
+    for clave, valor in esperado.items():
+        assert valor == obtenido[clave] or (np.isnan(valor) and np.isnan(obtenido[clave])), clave
+
+
+@pytest.mark.parametrize("caso", list(FILTROS))
+def test_equipo_por_partido(modelo, caso):
+    _, partidos = filtrados(modelo, caso)
+    pd.testing.assert_frame_equal(
+        motor.calcular_equipo_por_partido(partidos),
+        motor_duckdb.calcular_equipo_por_partido(partidos),
+        check_exact=True,
+    )
+
+
+@pytest.mark.parametrize("caso", list(FILTROS))
+def test_matriz_rivales(modelo, caso):
+    cubo, _ = filtrados(modelo, caso)
+    pd.testing.assert_frame_equal(
+        motor.matriz_rivales(cubo),
+        motor.matriz_rivales(cubo, agregador=motor_duckdb),
+        check_exact=True,
+    )
+
+
+@pytest.mark.parametrize("caso", ["todo", "temporada", "competicion", "temporada_y_competicion"])
+def test_totales_particiones(modelo, caso):
+    # Sin filtros dentro de las particiones la app suma los totales por
+    # partición: deben coincidir con agregar el cubo filtrado con DuckDB
+    comp_filtro, _, _, temporadas_filtro = FILTROS[caso](modelo)
+    cubo, _ = filtrados(modelo, caso)
+    pd.testing.assert_frame_equal(
+        motor.totales_particiones(modelo["particiones"], comp_filtro, temporadas_filtro),
+        motor_duckdb.agregar_cubo(cubo, ["NOMBRE"]),
+        check_exact=True,
+        check_dtype=False,
+    )
+
+
+@pytest.mark.parametrize("caso", list(FILTROS))
+def test_calcular_agregados(modelo, caso):
+    comp_filtro, jornadas, fechas, temporadas_filtro = FILTROS[caso](modelo)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        esperado = motor.calcular_agregados(modelo, comp_filtro, jornadas, fechas, temporadas=temporadas_filtro)
+        obtenido = motor.calcular_agregados(
+            modelo, comp_filtro, jornadas, fechas, agregador=motor_duckdb, temporadas=temporadas_filtro
+        )
+    pd.testing.assert_frame_equal(esperado["totales"], obtenido["totales"], check_exact=True)
+    for tabla in ["ranking_notas", "ranking_ofensivo"]:
+        pd.testing.assert_frame_equal(pd.concat(esperado[tabla]), pd.concat(obtenido[tabla]), check_exact=True)